@@ -0,0 +1,136 @@
+"""Time common client operations against a local Dataverse stand-in.
+
+Every operation runs against dataverses of 10, 1000 and 100000 datasets.
+Operations on individual datasets or files handle at most ``--sample`` of
+them, so that the largest scale finishes in minutes.
+
+Run with ``python -m benchmarks.bench_client``, or with ``--help`` for the
+scales, latency and payload sizes.
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.server import DataverseModel, DataverseServer
+from dataverse.connection import Connection
+from dataverse.utils import concurrent_map
+
+SCALES = (10, 1000, 100000)
+
+
+def run_scale(scale, sample=1000, latency=0, file_size=1024, description_size=100,
+              workers=4):
+    """Time each operation against a dataverse of `scale` datasets.
+
+    :return: list of ``(operation, items, requests, seconds)``
+    """
+    model = DataverseModel(
+        datasets=scale, file_size=file_size, description_size=description_size,
+    )
+    count = min(scale, sample)
+    results = []
+    source_dir = tempfile.mkdtemp()
+    dest_dir = tempfile.mkdtemp()
+
+    with DataverseServer(model, latency=latency) as server:
+        connection = Connection(server.host, 'token', use_https=False, lazy=True)
+        state = {}
+
+        def connect():
+            connection.validate()
+            state['dataverse'] = connection.get_dataverse(model.alias)
+            return 1
+
+        def list_datasets():
+            state['datasets'] = state['dataverse'].get_datasets()
+            return len(state['datasets'])
+
+        def revalidate_datasets():
+            return len(state['dataverse'].get_datasets(refresh=True))
+
+        def fetch_metadata():
+            datasets = state['datasets'][:count]
+            state['dataverse'].resolve_ids(datasets)
+            fetches = concurrent_map(
+                lambda dataset: dataset.get_metadata(refresh=True), datasets, workers,
+            )
+            return sum(1 for _, _, error in fetches if error is None)
+
+        def upload():
+            filepaths = []
+            for index in range(count):
+                filepath = os.path.join(source_dir, 'upload-{0}.bin'.format(index))
+                with open(filepath, 'wb') as f:
+                    f.write(model.file_content)
+                filepaths.append(filepath)
+            reports = state['datasets'][0].upload_batches(
+                filepaths, max_files=100, workers=workers,
+            )
+            return sum(len(r.filepaths) for r in reports if r.status == 'uploaded')
+
+        def download():
+            reports = state['datasets'][0].download_all(dest_dir, workers=workers)
+            return sum(1 for r in reports if r.status == 'downloaded')
+
+        operations = [
+            ('connect', connect),
+            ('list datasets', list_datasets),
+            ('list datasets, revalidated', revalidate_datasets),
+            ('fetch metadata', fetch_metadata),
+            ('upload files', upload),
+            ('download files', download),
+        ]
+        try:
+            for name, operation in operations:
+                started = time.time()
+                with connection.track_requests() as tracker:
+                    items = operation()
+                results.append((name, items, tracker.count, time.time() - started))
+        finally:
+            shutil.rmtree(source_dir, ignore_errors=True)
+            shutil.rmtree(dest_dir, ignore_errors=True)
+
+    return results
+
+
+def run(scales=SCALES, **options):
+    return [
+        (scale, name, items, requests, seconds)
+        for scale in scales
+        for name, items, requests, seconds in run_scale(scale, **options)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=list(SCALES),
+                        help='numbers of datasets in the dataverse')
+    parser.add_argument('--sample', type=int, default=1000,
+                        help='most datasets or files handled by a per-item operation')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds the server waits before each response')
+    parser.add_argument('--file-size', type=int, default=1024, help='bytes per file')
+    parser.add_argument('--description-size', type=int, default=100,
+                        help='characters in each dataset description')
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    print('{0:>8}  {1:<28}{2:>8}{3:>10}{4:>10}{5:>12}'.format(
+        'scale', 'operation', 'items', 'requests', 'seconds', 'items/s',
+    ))
+    for scale in args.scales:
+        for name, items, requests, seconds in run_scale(
+                scale, sample=args.sample, latency=args.latency, file_size=args.file_size,
+                description_size=args.description_size, workers=args.workers):
+            print('{0:>8}  {1:<28}{2:>8}{3:>10}{4:>10.3f}{5:>12.1f}'.format(
+                scale, name, items, requests, seconds,
+                items / seconds if seconds else 0,
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Time sanitizing and building large file listings.
+
+Run with ``python -m benchmarks.bench_listing``.
+"""
+from __future__ import absolute_import, print_function
+
+import time
+
+import bleach
+
+from benchmarks.server import DataverseModel, DataverseServer
+from dataverse import utils
+from dataverse.connection import Connection
+
+
+def bleach_clean(value):
+    """The `sanitize` of earlier versions, which always parsed its input."""
+    return bleach.clean(value, strip=True, tags=[], attributes=[], styles=[])
+
+
+def timed(func, number=1):
+    start = time.time()
+    for _ in range(number):
+        func()
+    return time.time() - start
+
+
+def run(file_count=50000):
+    model = DataverseModel(datasets=1)
+    doi = next(iter(model.datasets))
+    model.add_files(doi, ['survey-{0:05d}.tab'.format(i) for i in range(file_count)])
+    names = [f['name'] for f in model.datasets[doi]['files']]
+
+    results = [
+        ('sanitize names, bleach', timed(lambda: [bleach_clean(name) for name in names])),
+        ('sanitize names, fast path', timed(lambda: [utils.sanitize(name) for name in names])),
+    ]
+
+    with DataverseServer(model) as server:
+        connection = Connection(server.host, 'token', use_https=False)
+        dataverse = connection.get_dataverse(model.alias)
+        dataset = dataverse.get_datasets()[0]
+        dataset.get_metadata()
+
+        collection = dataverse.collection
+        results.extend([
+            ('dataverse title, uncached', timed(lambda: bleach_clean(utils.get_element(
+                collection, namespace='atom', tag='title',
+            ).text), number=file_count)),
+            ('dataverse title, memoized', timed(lambda: dataverse.title, number=file_count)),
+            ('get_files, first call', timed(dataset.get_files)),
+            ('get_files, cached', timed(dataset.get_files)),
+        ])
+
+    return file_count, results
+
+
+def main():
+    file_count, results = run()
+    print('{0:<28}{1:>12}  ({2} files or lookups)'.format('operation', 'seconds', file_count))
+    for name, seconds in results:
+        print('{0:<28}{1:>12.4f}'.format(name, seconds))
+
+
+if __name__ == '__main__':
+    main()
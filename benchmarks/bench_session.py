@@ -0,0 +1,49 @@
+"""Compare handshakes and wall time with and without the pooled session.
+
+Run with ``python -m benchmarks.bench_session``.
+"""
+from __future__ import absolute_import, print_function
+
+import time
+
+import requests
+
+from benchmarks.server import StubServer
+from dataverse.connection import Connection
+
+SD_PATH = '/dvn/api/data-deposit/v1.1/swordv2/service-document'
+SERVICE_DOCUMENT = b'''<?xml version='1.0'?>
+<service xmlns="http://www.w3.org/2007/app"><workspace/></service>'''
+
+
+def run(requests_per_trial=200):
+    routes = {SD_PATH: SERVICE_DOCUMENT}
+    results = []
+
+    with StubServer(routes) as server:
+        url = 'http://{0}{1}'.format(server.host, SD_PATH)
+
+        server.connection_count = 0
+        start = time.time()
+        for _ in range(requests_per_trial):
+            requests.get(url)
+        results.append(('module-level requests', server.connection_count, time.time() - start))
+
+        server.connection_count = 0
+        start = time.time()
+        connection = Connection(server.host, 'token', use_https=False)
+        for _ in range(requests_per_trial - 1):
+            connection.get_service_document(refresh=True)
+        results.append(('Connection.session', server.connection_count, time.time() - start))
+
+    return results
+
+
+def main():
+    print('{0:<24}{1:>12}{2:>12}'.format('client', 'handshakes', 'seconds'))
+    for name, handshakes, elapsed in run():
+        print('{0:<24}{1:>12}{2:>12.3f}'.format(name, handshakes, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""Time the XML lookups made on deposit receipts and statements.
+
+Run with ``python -m benchmarks.bench_utils``.
+"""
+from __future__ import absolute_import, print_function
+
+import timeit
+
+from lxml import etree
+
+from dataverse import utils
+
+STATEMENT_RELATION = 'http://purl.org/net/sword/terms/statement'
+RECEIPT = '''<?xml version='1.0' encoding='UTF-8'?>
+<entry xmlns="http://www.w3.org/2005/Atom">
+  <id>https://example.org/edit/study/doi:10.5072/FK2/ABC</id>
+  <link rel="edit" href="https://example.org/edit/study/doi:10.5072/FK2/ABC"/>
+  <link rel="edit-media" href="https://example.org/edit-media/study/doi:10.5072/FK2/ABC"/>
+  <link rel="{0}" href="https://example.org/statement/study/doi:10.5072/FK2/ABC"/>
+  <category term="latestVersionState" scheme="x" label="State">DRAFT</category>
+</entry>'''.format(STATEMENT_RELATION).encode('utf-8')
+RELATIONS = ('edit', 'edit-media', STATEMENT_RELATION)
+
+
+def links_from_content():
+    for relation in RELATIONS:
+        utils.get_element(RECEIPT, tag='link', attribute='rel', attribute_value=relation)
+
+
+def links_from_tree():
+    root = etree.XML(RECEIPT)
+    for relation in RELATIONS:
+        utils.get_element(root, tag='link', attribute='rel', attribute_value=relation)
+
+
+def run(number=20000):
+    trials = [
+        ('receipt links, 3 parses', links_from_content),
+        ('receipt links, 1 parse', links_from_tree),
+    ]
+    return [
+        (name, min(timeit.repeat(func, number=number, repeat=3)) / number)
+        for name, func in trials
+    ]
+
+
+def main():
+    print('{0:<28}{1:>16}'.format('lookup', 'us per call'))
+    for name, seconds in run():
+        print('{0:<28}{1:>16.2f}'.format(name, seconds * 1e6))
+
+
+if __name__ == '__main__':
+    main()
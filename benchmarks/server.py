@@ -0,0 +1,531 @@
+"""Local HTTP stand-ins for a Dataverse host, used by the benchmarks.
+
+`StubServer` serves fixed bodies by path. `DataverseServer` implements the
+SWORD and native API endpoints the client uses, backed by an in-memory
+`DataverseModel` of one dataverse. Both count the TCP connections they
+accept, which is the number of handshakes a client had to perform.
+"""
+from __future__ import absolute_import
+
+import hashlib
+import io
+import json
+import re
+import threading
+import time
+import zipfile
+import zlib
+from collections import OrderedDict
+from xml.sax.saxutils import escape, quoteattr
+
+from lxml import etree
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs
+
+SWORD_PATH = '/dvn/api/data-deposit/v1.1/swordv2'
+NATIVE_PATH = '/api/v1'
+STATEMENT_RELATION = 'http://purl.org/net/sword/terms/statement'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Allow keep-alive
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = self.server.routes.get(self.path.split('?', 1)[0], b'')
+        self.send_response(200 if body else 404)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, routes=None, host='127.0.0.1', port=0, handler=StubHandler):
+        HTTPServer.__init__(self, (host, port), handler)
+        self.routes = routes or {}
+        self.connection_count = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def host(self):
+        return '{0}:{1}'.format(*self.server_address)
+
+    def get_request(self):
+        request = HTTPServer.get_request(self)
+        with self._lock:
+            self.connection_count += 1
+        return request
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class DataverseModel(object):
+    """An in-memory dataverse of generated datasets and files.
+
+    Datasets and files share one sequence of ids, starting at 1, and every
+    file has the same content unless it was added with its own.
+
+    :param int datasets: number of datasets to generate
+    :param int files_per_dataset: number of files in each generated dataset
+    :param int file_size: size of every file, in bytes
+    :param int description_size: length of each dataset's description, which
+        pads its Atom entry and version json
+    """
+
+    AUTHORITY = '10.5072'
+
+    def __init__(self, alias='bench', datasets=10, files_per_dataset=1, file_size=1024,
+                 description_size=100):
+        self.alias = alias
+        self.description = ('Lorem ipsum dolor sit amet. ' * (description_size // 28 + 1))[
+            :description_size]
+        self.file_content = (b'0123456789abcdef' * (file_size // 16 + 1))[:file_size]
+        self.file_md5 = hashlib.md5(self.file_content).hexdigest()
+        self.released = True
+
+        self.datasets = OrderedDict()
+        self.dois = {}
+        self.files = {}
+        self.file_contents = {}
+        self._next_id = 1
+        self._feed = None
+        self._contents = None
+        self._lock = threading.RLock()
+
+        for _ in range(datasets):
+            self.add_dataset(files=files_per_dataset)
+
+    def _new_id(self):
+        new_id = self._next_id
+        self._next_id += 1
+        return new_id
+
+    def add_dataset(self, title=None, files=0):
+        with self._lock:
+            dataset_id = self._new_id()
+            doi = 'doi:{0}/FK2/BENCH{1:07d}'.format(self.AUTHORITY, dataset_id)
+            dataset = {
+                'id': dataset_id,
+                'doi': doi,
+                'title': title or 'Benchmark dataset {0}'.format(dataset_id),
+                'state': 'DRAFT',
+                'version': 1,
+                'edits': 0,
+                'files': [],
+            }
+            self.datasets[doi] = dataset
+            self.dois[dataset_id] = doi
+            self.add_files(doi, ['data-{0}-{1}.bin'.format(dataset_id, i) for i in range(files)])
+            dataset['edits'] = 0
+            self._feed = self._contents = None
+            return dataset
+
+    def add_files(self, doi, names, content=None):
+        with self._lock:
+            dataset = self.datasets[doi]
+            if content is None:
+                content, md5 = self.file_content, self.file_md5
+            else:
+                md5 = hashlib.md5(content).hexdigest()
+            added = []
+            for name in names:
+                file_id = self._new_id()
+                self.files[file_id] = doi
+                if content is not self.file_content:
+                    self.file_contents[file_id] = content
+                added.append({
+                    'id': file_id,
+                    'name': name,
+                    'filesize': len(content),
+                    'md5': md5,
+                })
+            dataset['files'].extend(added)
+            dataset['edits'] += 1
+            return added
+
+    def content(self, file_id):
+        return self.file_contents.get(file_id, self.file_content)
+
+    def delete_dataset(self, doi):
+        with self._lock:
+            dataset = self.datasets.pop(doi)
+            del self.dois[dataset['id']]
+            for dataverse_file in dataset['files']:
+                del self.files[dataverse_file['id']]
+                self.file_contents.pop(dataverse_file['id'], None)
+            self._feed = self._contents = None
+
+    def delete_file(self, file_id):
+        with self._lock:
+            dataset = self.datasets[self.files.pop(file_id)]
+            self.file_contents.pop(file_id, None)
+            dataset['files'] = [f for f in dataset['files'] if f['id'] != file_id]
+            dataset['edits'] += 1
+
+    def service_document(self, sword):
+        return '''<?xml version='1.0' encoding='UTF-8'?>
+<service xmlns="http://www.w3.org/2007/app" xmlns:atom="http://www.w3.org/2005/Atom">
+  <workspace>
+    <atom:title>Dataverse Network</atom:title>
+    <collection href="{0}/collection/dataverse/{1}">
+      <atom:title>Benchmark Dataverse</atom:title>
+      <accept>application/zip</accept>
+    </collection>
+  </workspace>
+</service>'''.format(sword, self.alias).encode('utf-8')
+
+    def collection_feed(self, sword):
+        with self._lock:
+            if self._feed is None:
+                entries = ''.join(
+                    '''
+  <entry xml:base="{0}/edit/study/{1}">
+    <id>{0}/edit/study/{1}</id>
+    <title type="text">{2}</title>
+    <link rel="edit-media" href="{0}/edit-media/study/{1}"/>
+  </entry>'''.format(sword, doi, escape(dataset['title']))
+                    for doi, dataset in self.datasets.items()
+                )
+                self._feed = '''<?xml version='1.0' encoding='UTF-8'?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+  <id>{0}/collection/dataverse/{1}</id>
+  <title type="text">Benchmark Dataverse</title>{2}
+  <dataverseHasBeenReleased xmlns="http://purl.org/net/sword/terms/state">{3}\
+</dataverseHasBeenReleased>
+</feed>'''.format(sword, self.alias, entries, str(self.released).lower()).encode('utf-8')
+            return self._feed
+
+    def entry(self, sword, dataset):
+        return '''<?xml version='1.0' encoding='UTF-8'?>
+<entry xmlns="http://www.w3.org/2005/Atom" xmlns:dcterms="http://purl.org/dc/terms/">
+  <id>{0}/edit/study/{1}</id>
+  <link rel="edit" href="{0}/edit/study/{1}"/>
+  <link rel="edit-media" href="{0}/edit-media/study/{1}"/>
+  <link rel={2} href="{0}/statement/study/{1}"/>
+  <dcterms:title>{3}</dcterms:title>
+  <dcterms:description>{4}</dcterms:description>
+  <dcterms:creator>Benchmark</dcterms:creator>
+  <dcterms:bibliographicCitation>Benchmark, "{3}", {1}</dcterms:bibliographicCitation>
+</entry>'''.format(
+            sword, dataset['doi'], quoteattr(STATEMENT_RELATION), escape(dataset['title']),
+            escape(self.description),
+        ).encode('utf-8')
+
+    def statement(self, sword, dataset):
+        return '''<?xml version='1.0' encoding='UTF-8'?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+  <id>{0}/statement/study/{1}</id>
+  <category term="latestVersionState" scheme="http://purl.org/net/sword/terms/state"
+            label="State">{2}</category>
+</feed>'''.format(sword, dataset['doi'], dataset['state']).encode('utf-8')
+
+    def contents(self):
+        with self._lock:
+            if self._contents is None:
+                data = []
+                for doi, dataset in self.datasets.items():
+                    protocol, rest = doi.split(':', 1)
+                    authority, identifier = rest.split('/', 1)
+                    data.append({
+                        'type': 'dataset',
+                        'id': dataset['id'],
+                        'protocol': protocol,
+                        'authority': authority,
+                        'identifier': identifier,
+                    })
+                self._contents = json.dumps({'status': 'OK', 'data': data}).encode('utf-8')
+            return self._contents
+
+    def last_update_time(self, dataset):
+        seconds = dataset['version'] + dataset['edits']
+        return '2015-01-01T00:{0:02d}:{1:02d}Z'.format(seconds // 60 % 60, seconds % 60)
+
+    def search(self, start, per_page):
+        with self._lock:
+            datasets = list(self.datasets.values())
+        items = [
+            {'type': 'dataset', 'global_id': dataset['doi'],
+             'updatedAt': self.last_update_time(dataset)}
+            for dataset in datasets[start:start + per_page]
+        ]
+        return json.dumps({'status': 'OK', 'data': {
+            'total_count': len(datasets), 'start': start, 'items': items,
+        }}).encode('utf-8')
+
+    def version(self, dataset):
+        return json.dumps({'status': 'OK', 'data': {
+            'id': dataset['id'],
+            'versionNumber': dataset['version'],
+            'versionMinorNumber': 0,
+            'versionState': dataset['state'],
+            'lastUpdateTime': self.last_update_time(dataset),
+            'metadataBlocks': dataset.get('metadataBlocks') or {'citation': {'fields': [
+                {'typeName': 'title', 'value': dataset['title']},
+                {'typeName': 'dsDescription', 'value': self.description},
+            ]}},
+            'files': [
+                {'label': f['name'], 'datafile': dict(f)} for f in dataset['files']
+            ],
+        }}).encode('utf-8')
+
+
+def entity_tag(body):
+    return '"{0:x}-{1}"'.format(zlib.crc32(body) & 0xffffffff, len(body))
+
+
+class DataverseHandler(BaseHTTPRequestHandler):
+    """Serve the SWORD and native API of the server's `DataverseModel`.
+
+    GETs answer with an ETag and honor ``If-None-Match``, downloads honor
+    ``Range`` and ``If-Range``, and every request waits the server's `latency` first. Paths
+    in the server's `faults` answer with the status given there instead.
+    Credentials are not checked.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    ROUTES = [
+        ('GET', SWORD_PATH + r'/service-document$', 'get_service_document'),
+        ('GET', SWORD_PATH + r'/collection/dataverse/(?P<alias>[^/]+)$', 'get_collection'),
+        ('POST', SWORD_PATH + r'/collection/dataverse/(?P<alias>[^/]+)$', 'create_dataset'),
+        ('POST', SWORD_PATH + r'/edit/dataverse/(?P<alias>[^/]+)$', 'publish_dataverse'),
+        ('GET', SWORD_PATH + r'/edit/study/(?P<doi>.+)$', 'get_entry'),
+        ('POST', SWORD_PATH + r'/edit/study/(?P<doi>.+)$', 'publish_dataset'),
+        ('DELETE', SWORD_PATH + r'/edit/study/(?P<doi>.+)$', 'delete_dataset'),
+        ('GET', SWORD_PATH + r'/statement/study/(?P<doi>.+)$', 'get_statement'),
+        ('POST', SWORD_PATH + r'/edit-media/study/(?P<doi>.+)$', 'upload_files'),
+        ('DELETE', SWORD_PATH + r'/edit-media/file/(?P<file_id>\d+)$', 'delete_file'),
+        ('GET', NATIVE_PATH + r'/dataverses/(?P<alias>[^/]+)/contents$', 'get_contents'),
+        ('GET', NATIVE_PATH + r'/datasets/:persistentId/?$', 'get_dataset_id'),
+        ('GET', NATIVE_PATH + r'/datasets/(?P<dataset_id>\d+)/versions/:(?P<version>[\w-]+)$',
+         'get_version'),
+        ('PUT', NATIVE_PATH + r'/datasets/(?P<dataset_id>\d+)/versions/:draft$',
+         'update_version'),
+        ('GET', NATIVE_PATH + r'/access/datafile/(?P<file_id>\d+)$', 'download_file'),
+        ('GET', NATIVE_PATH + r'/search$', 'search'),
+    ]
+    ROUTES = [(method, re.compile(pattern), name) for method, pattern, name in ROUTES]
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    @property
+    def model(self):
+        return self.server.model
+
+    @property
+    def sword(self):
+        return 'http://{0}{1}'.format(self.server.host, SWORD_PATH)
+
+    def dispatch(self, method):
+        self.body = self.read_body()
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        path, _, query = self.path.partition('?')
+        self.query = parse_qs(query)
+        if path in self.server.faults:
+            return self.respond(method, self.server.faults[path], b'')
+
+        for route_method, pattern, name in self.ROUTES:
+            match = pattern.match(path)
+            if route_method == method and match:
+                try:
+                    response = getattr(self, name)(**match.groupdict())
+                except (KeyError, ValueError):
+                    response = 404, b''
+                break
+        else:
+            response = 404, b''
+
+        self.respond(method, *response)
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if not size:
+                    self.rfile.readline()
+                    return b''.join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def respond(self, method, status, body, headers=None):
+        headers = dict(headers or {})
+        if method == 'GET' and status == 200:
+            etag = entity_tag(body)
+            headers['ETag'] = etag
+            if self.headers.get('If-None-Match') == etag:
+                status, body = 304, b''
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def receipt(self, status, dataset):
+        return status, self.model.entry(self.sword, dataset), {
+            'Content-Type': 'application/atom+xml;type=entry',
+        }
+
+    def get_service_document(self):
+        return 200, self.model.service_document(self.sword)
+
+    def get_collection(self, alias):
+        if alias != self.model.alias:
+            return 404, b''
+        return 200, self.model.collection_feed(self.sword)
+
+    def create_dataset(self, alias):
+        title = etree.XML(self.body).findtext('{http://purl.org/dc/terms/}title')
+        if not title:
+            return 400, b''
+        return self.receipt(201, self.model.add_dataset(title))
+
+    def publish_dataverse(self, alias):
+        self.model.released = True
+        return 200, b''
+
+    def get_entry(self, doi):
+        return 200, self.model.entry(self.sword, self.model.datasets[doi])
+
+    def publish_dataset(self, doi):
+        dataset = self.model.datasets[doi]
+        dataset['state'] = 'RELEASED'
+        dataset['edits'] += 1
+        return self.receipt(200, dataset)
+
+    def delete_dataset(self, doi):
+        self.model.delete_dataset(doi)
+        return 204, b''
+
+    def get_statement(self, doi):
+        return 200, self.model.statement(self.sword, self.model.datasets[doi])
+
+    def upload_files(self, doi):
+        dataset = self.model.datasets[doi]
+        package = zipfile.ZipFile(io.BytesIO(self.body))
+        names = [info.filename.rsplit('/', 1)[-1] for info in package.infolist()]
+        self.model.add_files(doi, names)
+        return self.receipt(201, dataset)
+
+    def delete_file(self, file_id):
+        self.model.delete_file(int(file_id))
+        return 204, b''
+
+    def get_contents(self, alias):
+        if alias != self.model.alias:
+            return 404, b''
+        return 200, self.model.contents()
+
+    def get_dataset_id(self):
+        dataset = self.model.datasets[self.query['persistentId'][0]]
+        return 200, json.dumps({'status': 'OK', 'data': {'id': dataset['id']}}).encode('utf-8')
+
+    def get_version(self, dataset_id, version):
+        dataset = self.model.datasets[self.model.dois[int(dataset_id)]]
+        released = dataset['state'] == 'RELEASED'
+        if (version == 'draft' and released) or (version == 'latest-published' and not released):
+            return 404, b''
+        return 200, self.model.version(dataset)
+
+    def update_version(self, dataset_id):
+        dataset = self.model.datasets[self.model.dois[int(dataset_id)]]
+        if dataset['state'] == 'RELEASED':
+            dataset['version'] += 1
+        dataset['state'] = 'DRAFT'
+        dataset['edits'] += 1
+        blocks = json.loads(self.body.decode('utf-8') or '{}').get('metadataBlocks')
+        if blocks:
+            dataset['metadataBlocks'] = blocks
+        return 200, self.model.version(dataset)
+
+    def download_file(self, file_id):
+        if int(file_id) not in self.model.files:
+            return 404, b''
+        content = self.model.content(int(file_id))
+
+        match = re.match(r'bytes=(\d+)-$', self.headers.get('Range') or '')
+        if_range = self.headers.get('If-Range')
+        if match and (if_range is None or if_range == entity_tag(content)):
+            start = int(match.group(1))
+            if start >= len(content):
+                return 416, b'', {'Content-Range': 'bytes */{0}'.format(len(content))}
+            return 206, content[start:], {
+                'ETag': entity_tag(content),
+                'Content-Range': 'bytes {0}-{1}/{2}'.format(
+                    start, len(content) - 1, len(content),
+                ),
+            }
+        return 200, content
+
+    def search(self):
+        if self.query.get('subtree', [self.model.alias])[0] != self.model.alias:
+            return 200, json.dumps({'status': 'OK', 'data': {
+                'total_count': 0, 'start': 0, 'items': [],
+            }}).encode('utf-8')
+        return 200, self.model.search(
+            int(self.query.get('start', ['0'])[0]),
+            int(self.query.get('per_page', ['10'])[0]),
+        )
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DataverseServer(StubServer):
+    """Serve a `DataverseModel` on a local port.
+
+    :param float latency: seconds to wait before answering each request
+    :param dict faults: status to answer with, instead of handling the
+        request, by path (without the query string)
+    """
+
+    def __init__(self, model=None, latency=0, faults=None, host='127.0.0.1', port=0):
+        StubServer.__init__(self, host=host, port=port, handler=DataverseHandler)
+        self.model = model or DataverseModel()
+        self.latency = latency
+        self.faults = faults if faults is not None else {}
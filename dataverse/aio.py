@@ -0,0 +1,423 @@
+"""An asyncio client mirroring `Connection`, `Dataverse` and `Dataset`.
+
+Requires Python 3.6+ and aiohttp (``pip install dataverse[async]``). The XML
+and JSON handling is shared with the synchronous client through
+`dataverse.utils`. Zipping and file I/O run in the event loop's default
+executor, so that they do not block other coroutines.
+"""
+from __future__ import absolute_import
+
+import asyncio
+import base64
+import os
+from functools import partial
+
+try:
+    import aiohttp
+except ImportError:
+    raise ImportError(
+        'The asyncio client requires aiohttp. Install it with '
+        '`pip install dataverse[async]`.'
+    )
+from lxml import etree
+
+from dataverse.exceptions import (
+    ConnectionError, DataverseNotFoundError, MetadataNotFoundError, NoContainerError,
+    OperationFailedError, UnauthorizedError, VersionJsonNotFoundError,
+)
+from dataverse.file import DataverseFile
+from dataverse.settings import DOWNLOAD_CHUNK_SIZE
+from dataverse.utils import (
+    deposit_headers, get_collections, get_element, get_files_in_path, index_dataset_ids,
+    iter_elements, parse_dataset_entry, sanitize, zip_package,
+)
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Call `func` in the event loop's default executor."""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, partial(func, *args, **kwargs))
+
+
+def _file_size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+class AsyncConnection(object):
+    """Asynchronous counterpart of `dataverse.connection.Connection`.
+
+    No request is made until a coroutine is awaited. Use it as an async
+    context manager, or call `close` when done::
+
+        async with AsyncConnection(host, token) as connection:
+            dataverse = await connection.get_dataverse('ALIAS')
+    """
+
+    def __init__(self, host, token, use_https=True, limit=100):
+        self.token = token
+        self.host = host
+        self.limit = limit
+
+        url_scheme = 'https://' if use_https else 'http://'
+        self.base_url = '{0}{1}'.format(url_scheme, self.host)
+        self.native_base_url = '{0}/api/v1'.format(self.base_url)
+        self.sword_base_url = '{0}/dvn/api/data-deposit/v1.1/swordv2'.format(self.base_url)
+        self.sd_uri = '{0}/service-document'.format(self.sword_base_url)
+        self._service_document = None
+        self._dataverses = {}
+        self._session = None
+
+    @property
+    def auth_headers(self):
+        credentials = '{0}:'.format(self.token).encode('utf-8')
+        return {'Authorization': 'Basic ' + base64.b64encode(credentials).decode('ascii')}
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def validate(self):
+        await self.get_service_document(refresh=True)
+
+    async def get_service_document(self, refresh=False):
+        if not refresh and self._service_document is not None:
+            return self._service_document
+
+        async with self.session.get(self.sd_uri, headers=self.auth_headers) as resp:
+            if resp.status == 403:
+                raise UnauthorizedError('The credentials provided are invalid.')
+            elif resp.status != 200:
+                raise ConnectionError('Could not connect to the Dataverse')
+            self._service_document = etree.XML(await resp.read())
+
+        previous = self._dataverses
+        self._dataverses = {}
+        for collection in get_collections(self._service_document):
+            dataverse = AsyncDataverse(self, collection)
+            if dataverse.alias in previous:
+                dataverse = previous[dataverse.alias]
+                dataverse.collection = collection
+            self._dataverses[dataverse.alias] = dataverse
+
+        return self._service_document
+
+    async def get_dataverses(self, refresh=False):
+        await self.get_service_document(refresh)
+        return list(self._dataverses.values())
+
+    async def get_dataverse(self, alias, refresh=False):
+        await self.get_service_document(refresh)
+        return self._dataverses.get(alias)
+
+
+class AsyncDataverse(object):
+    """Asynchronous counterpart of `dataverse.dataverse.Dataverse`."""
+
+    def __init__(self, connection, collection):
+        self.connection = connection
+        self.collection = collection
+
+        self._collection_info = None
+        self._contents_json = None
+        self._dataset_ids = None
+        self._dataset_ids_source = None
+
+    @property
+    def collection(self):
+        return self._collection
+
+    @collection.setter
+    def collection(self, collection):
+        self._collection = collection
+        # Derived from the collection on first use
+        self._alias = None
+        self._title = None
+
+    @property
+    def alias(self):
+        if self._alias is None:
+            self._alias = self.collection.get('href').split('/')[-1]
+        return self._alias
+
+    @property
+    def title(self):
+        if self._title is None:
+            self._title = sanitize(get_element(
+                self.collection,
+                namespace='atom',
+                tag='title',
+            ).text)
+        return self._title
+
+    async def get_collection_info(self, refresh=False):
+        if not refresh and self._collection_info:
+            return self._collection_info
+
+        async with self.connection.session.get(
+            self.collection.get('href'),
+            headers=self.connection.auth_headers,
+        ) as resp:
+            if resp.status != 200:
+                raise ConnectionError('Collection info could not be retrieved.')
+            self._collection_info = await resp.read()
+
+        return self._collection_info
+
+    async def get_contents(self, refresh=False):
+        if not refresh and self._contents_json:
+            return self._contents_json
+
+        content_uri = '{0}/dataverses/{1}/contents'.format(
+            self.connection.native_base_url, self.alias
+        )
+        async with self.connection.session.get(
+            content_uri,
+            params={'key': self.connection.token},
+        ) as resp:
+            if resp.status == 404:
+                raise DataverseNotFoundError(
+                    'Dataverse {0} was not found.'.format(self.alias)
+                )
+            elif resp.status != 200:
+                raise ConnectionError('Atom entry could not be retrieved.')
+            self._contents_json = (await resp.json())['data']
+
+        return self._contents_json
+
+    async def get_dataset_id(self, doi, refresh=False):
+        """Find the id of a dataset in this dataverse from its DOI.
+
+        Ids are looked up in an index built from a single contents fetch and
+        shared by all datasets of the dataverse. DOIs missing from the index
+        are resolved individually with the native API.
+
+        Returns None if no dataset has the DOI.
+        """
+        dataset_ids = await self._get_dataset_ids(refresh)
+
+        if doi not in dataset_ids:
+            dataset_id = await self._lookup_dataset_id(doi)
+            if dataset_id is None:
+                return None
+            dataset_ids[doi] = dataset_id
+
+        return dataset_ids[doi]
+
+    async def _get_dataset_ids(self, refresh=False):
+        contents = await self.get_contents(refresh)
+        if contents is not self._dataset_ids_source:
+            self._dataset_ids = index_dataset_ids(contents)
+            self._dataset_ids_source = contents
+        return self._dataset_ids
+
+    async def _lookup_dataset_id(self, doi):
+        async with self.connection.session.get(
+            '{0}/datasets/:persistentId/'.format(self.connection.native_base_url),
+            params={'persistentId': doi, 'key': self.connection.token},
+        ) as resp:
+            if resp.status == 404:
+                return None
+            elif resp.status != 200:
+                raise ConnectionError('The dataset ID could not be retrieved.')
+            return (await resp.json())['data']['id']
+
+    async def get_datasets(self, refresh=False):
+        collection_info = await self.get_collection_info(refresh)
+        entries = iter_elements(collection_info, tag='entry', namespace='atom')
+        return [AsyncDataset(self, **parse_dataset_entry(entry)) for entry in entries]
+
+    async def get_dataset_by_doi(self, doi, refresh=False):
+        return next(
+            (s for s in await self.get_datasets(refresh) if s.doi == doi),
+            None
+        )
+
+
+class AsyncDataset(object):
+    """Asynchronous counterpart of a `dataverse.dataset.Dataset` in a Dataverse."""
+
+    def __init__(self, dataverse, title=None, id=None, edit_uri=None, edit_media_uri=None):
+        self.dataverse = dataverse
+        self.title = title
+        self.edit_uri = edit_uri
+        self.edit_media_uri = edit_media_uri
+
+        self._metadata = {}
+        self._id = None
+
+    @property
+    def connection(self):
+        return self.dataverse.connection
+
+    @property
+    def doi(self):
+        # Note: This depends strongly on URL structure, and may break easily
+        return self.edit_media_uri.rsplit('/study/', 1)[-1]
+
+    async def get_id(self):
+        if self._id:
+            return self._id
+
+        self._id = await self.dataverse.get_dataset_id(self.doi)
+        if self._id:
+            return self._id
+
+        raise MetadataNotFoundError('The dataset ID could not be found.')
+
+    async def get_metadata(self, version='latest', refresh=False):
+        if not refresh and self._metadata.get(version):
+            return self._metadata[version]
+
+        url = '{0}/datasets/{1}/versions/:{2}'.format(
+            self.connection.native_base_url,
+            await self.get_id(),
+            version,
+        )
+        async with self.connection.session.get(
+            url,
+            params={'key': self.connection.token},
+        ) as resp:
+            if resp.status == 404:
+                raise VersionJsonNotFoundError(
+                    'JSON metadata could not be found for this version.'
+                )
+            elif resp.status != 200:
+                raise ConnectionError('JSON metadata could not be retrieved.')
+            metadata = (await resp.json())['data']
+
+        self._metadata[version] = metadata
+        return metadata
+
+    async def get_files(self, version='latest', refresh=False):
+        try:
+            files_json = (await self.get_metadata(version, refresh))['files']
+        except VersionJsonNotFoundError:
+            return []
+        return [AsyncDataverseFile.from_json(self, file_json) for file_json in files_json]
+
+    async def upload_filepaths(self, filepaths):
+        # Convert a directory to a list of files
+        if len(filepaths) == 1 and os.path.isdir(filepaths[0]):
+            filepaths = await run_blocking(get_files_in_path, filepaths[0])
+
+        package = await run_blocking(zip_package, filepaths=filepaths)
+        try:
+            await self._deposit('temp.zip', package)
+        finally:
+            package.close()
+        await self.get_metadata(refresh=True)
+
+    async def upload_file(self, filename, content):
+        package = await run_blocking(zip_package, files=[(filename, content)])
+        try:
+            await self._deposit('temp.zip', package)
+        finally:
+            package.close()
+        await self.get_metadata(refresh=True)
+
+    async def _deposit(self, filename, package):
+        async def chunks():
+            while True:
+                chunk = await run_blocking(package.read, UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+        headers = deposit_headers(filename)
+        headers.update(self.connection.auth_headers)
+
+        async with self.connection.session.post(
+            self.edit_media_uri,
+            data=chunks(),
+            headers=headers,
+        ) as resp:
+            if resp.status not in (200, 201):
+                raise OperationFailedError('The files could not be uploaded.')
+
+    async def download(self, dataverse_file, path, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        """Stream `dataverse_file` to `path`, resuming a partial download.
+
+        :return: the number of bytes written
+        """
+        if dataverse_file.dataset is not self:
+            raise NoContainerError('The file does not belong to this dataset.')
+
+        start = await run_blocking(_file_size, path)
+        headers = {'Range': 'bytes={0}-'.format(start)} if start else {}
+        written = 0
+
+        async with self.connection.session.get(
+            dataverse_file.download_url,
+            headers=headers,
+            params={'key': self.connection.token},
+        ) as resp:
+            if resp.status == 416:
+                return 0
+            elif resp.status in (401, 403):
+                raise UnauthorizedError(
+                    'Download of file {0} unauthorized.'.format(dataverse_file.name)
+                )
+            elif resp.status not in (200, 206):
+                raise ConnectionError('The file could not be downloaded.')
+
+            # Servers that ignore Range resend the file from its first byte
+            f = await run_blocking(open, path, 'ab' if resp.status == 206 else 'wb')
+            try:
+                async for chunk in resp.content.iter_chunked(chunk_size):
+                    await run_blocking(f.write, chunk)
+                    written += len(chunk)
+            finally:
+                await run_blocking(f.close)
+
+        return written
+
+
+class AsyncDataverseFile(DataverseFile):
+    """A `dataverse.file.DataverseFile` of an `AsyncDataset`.
+
+    `iter_content` and `download` are coroutines; the synchronous transfer
+    methods of `DataverseFile` are not available.
+    """
+
+    async def iter_content(self, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        """Yield the contents of the file in chunks of at most `chunk_size` bytes."""
+        async with self.connection.session.get(
+            self.download_url,
+            params={'key': self.connection.token},
+        ) as resp:
+            if resp.status in (401, 403):
+                raise UnauthorizedError(
+                    'Download of file {0} unauthorized.'.format(self.name)
+                )
+            elif resp.status != 200:
+                raise ConnectionError('The file could not be downloaded.')
+
+            async for chunk in resp.content.iter_chunked(chunk_size):
+                yield chunk
+
+    async def download(self, path, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        """Stream the file to `path`, resuming a partial download.
+
+        :return: the number of bytes written
+        """
+        return await self.dataset.download(self, path, chunk_size)
+
+    def _open(self, position, validator=None):
+        raise NotImplementedError('Use the coroutines of AsyncDataverseFile.')
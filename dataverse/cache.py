@@ -0,0 +1,210 @@
+from __future__ import absolute_import
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+
+class ValidatorCache(object):
+    """Response bodies stored with their ETag and Last-Modified validators.
+
+    Holds at most `max_bytes` of bodies, evicting the least recently used.
+    Bodies larger than that are not stored.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        """Total bytes of the stored bodies."""
+        return self._size
+
+    def get(self, key):
+        """Return the ``(etag, last_modified, body)`` stored for `key`, if any."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+            return entry
+
+    def store(self, key, resp):
+        """Store the body of `resp`, if it has validators."""
+        etag = resp.headers.get('ETag')
+        last_modified = resp.headers.get('Last-Modified')
+
+        with self._lock:
+            self._discard(key)
+            body = resp.content
+            if (not etag and not last_modified) or len(body) > self.max_bytes:
+                return
+            self._entries[key] = (etag, last_modified, body)
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[2])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+def conditional_headers(entry):
+    """Build the request headers that revalidate a `ValidatorCache` entry."""
+    headers = {}
+    if entry is not None:
+        etag, last_modified, _ = entry
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+    return headers
+
+
+def build_response(url, headers, body):
+    """Build a 200 response from a stored body, to be parsed again."""
+    resp = requests.Response()
+    resp.status_code = 200
+    resp.url = url
+    resp.headers = CaseInsensitiveDict(headers)
+    resp._content = body
+    return resp
+
+
+class ResponseCache(object):
+    """A persistent cache of GET responses in a SQLite database.
+
+    The database can be shared by several processes. Entries are keyed by URL,
+    query parameters and a hash of the API token, so tokens are never stored.
+    Entries are fresh for `ttl` seconds, after which they are revalidated
+    with conditional requests. When the stored bodies exceed `max_bytes`, the
+    least recently used entries are evicted.
+    """
+
+    STORED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+    def __init__(self, path, ttl=300, max_bytes=256 * 1024 * 1024, timeout=30):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._local = threading.local()
+
+        with self._connect() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, url TEXT, headers TEXT, body BLOB, '
+                'size INTEGER, stored_at REAL, accessed_at REAL)'
+            )
+            db.execute(
+                'CREATE INDEX IF NOT EXISTS responses_accessed_at '
+                'ON responses (accessed_at)'
+            )
+            db.execute('CREATE INDEX IF NOT EXISTS responses_url ON responses (url)')
+
+    def _connect(self):
+        # SQLite connections cannot be shared between threads
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.timeout)
+            db.execute('PRAGMA journal_mode=WAL')
+            self._local.db = db
+        return db
+
+    @staticmethod
+    def key(url, params, token):
+        params = sorted((k, v) for k, v in (params or {}).items() if k != 'key')
+        scope = hashlib.sha256((token or '').encode('utf-8')).hexdigest()
+        raw = json.dumps([url, params, scope])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached response for `key` and whether it is still fresh.
+
+        Returns ``(None, False)`` on a miss.
+        """
+        with self._connect() as db:
+            row = db.execute(
+                'SELECT url, headers, body, stored_at FROM responses WHERE key = ?',
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None, False
+            db.execute(
+                'UPDATE responses SET accessed_at = ? WHERE key = ?',
+                (time.time(), key),
+            )
+
+        url, headers, body, stored_at = row
+        resp = build_response(url, json.loads(headers), bytes(body))
+        return resp, time.time() - stored_at < self.ttl
+
+    def store(self, key, url, resp):
+        """Store a 200 response to a GET of `url`.
+
+        `url` should not include the query string, which may hold the token.
+        """
+        headers = dict(
+            (name, resp.headers[name]) for name in self.STORED_HEADERS
+            if name in resp.headers
+        )
+        now = time.time()
+
+        with self._connect() as db:
+            db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, url, json.dumps(headers), sqlite3.Binary(resp.content),
+                 len(resp.content), now, now),
+            )
+            self._evict(db)
+
+    def touch(self, key):
+        """Mark the entry for `key` as fresh after a successful revalidation."""
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                'UPDATE responses SET stored_at = ?, accessed_at = ? WHERE key = ?',
+                (now, now, key),
+            )
+
+    def invalidate(self, urls):
+        """Delete the entries for `urls`, whatever their parameters and token."""
+        with self._connect() as db:
+            db.executemany('DELETE FROM responses WHERE url = ?', [(url,) for url in urls])
+
+    def clear(self):
+        with self._connect() as db:
+            db.execute('DELETE FROM responses')
+
+    def _evict(self, db):
+        total = db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = db.execute(
+            'SELECT key, size FROM responses ORDER BY accessed_at'
+        ).fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        db.executemany('DELETE FROM responses WHERE key = ?', evicted)
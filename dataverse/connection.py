@@ -1,18 +1,56 @@
 from __future__ import absolute_import
 
+from collections import OrderedDict
+from contextlib import contextmanager
+
 from lxml import etree
 import requests
 
+from dataverse.cache import ValidatorCache, build_response, conditional_headers
 from dataverse.dataverse import Dataverse
 from dataverse import exceptions
-from dataverse.utils import get_elements
+from dataverse.metrics import RequestTracker
+from dataverse.settings import SWORD_NAMESPACE, VALIDATOR_CACHE_BYTES
+from dataverse.transport import RetryPolicy, Transport, default_hooks
+from dataverse.utils import get_collections
 
 
 class Connection(object):
 
-    def __init__(self, host, token, use_https=True):
+    def __init__(self, host, token, use_https=True, pool_size=10, max_retries=0,
+                 keep_alive=True, lazy=False, cache=None, backoff_factor=0.5,
+                 timeout=None, rate_limiter=None):
+        """Connect to a Dataverse host.
+
+        Unless `lazy` is True, the service document is fetched immediately,
+        which also checks the credentials. Lazy connections do no network I/O
+        until they are first used; call `validate` to check them explicitly.
+
+        :param int max_retries: times to retry a request after a connection
+            error, a read timeout or a 429, 502, 503 or 504 response. Requests
+            that may not be idempotent, such as deposits, are only retried if
+            they never reached the server. See `dataverse.transport.RetryPolicy`.
+        :param float backoff_factor: base of the exponential backoff between
+            retries, in seconds
+        :param timeout: default timeout of every request, in seconds
+        :param rate_limiter: optional `dataverse.utils.RateLimiter` throttling
+            every request, including retries
+        :param cache: optional `dataverse.cache.ResponseCache` used for GETs
+            of both the SWORD and the native API
+
+        Every HTTP request is passed to the callables in ``hooks``, see
+        `dataverse.transport.Transport`. Add `dataverse.metrics.Metrics.record`
+        to ``hooks['after_request']`` to collect per-endpoint metrics.
+        """
         self.token = token
         self.host = host
+        self.hooks = default_hooks()
+        self.session = self._create_session(
+            pool_size, max_retries, keep_alive, backoff_factor, timeout, rate_limiter,
+            self.hooks,
+        )
+        self.validators = ValidatorCache(VALIDATOR_CACHE_BYTES)
+        self.cache = cache
 
         if use_https:
             url_scheme = 'https://'
@@ -23,29 +61,186 @@ class Connection(object):
         self.sword_base_url = '{0}/dvn/api/data-deposit/v1.1/swordv2'.format(self.base_url)
         self.sd_uri = '{0}/service-document'.format(self.sword_base_url)
         self._service_document = None
+        self._dataverses = OrderedDict()
+
+        if not lazy:
+            self.get_service_document()
 
-        self.get_service_document()
+    @contextmanager
+    def track_requests(self, max_requests=None, allow_duplicate_gets=True):
+        """Record every request made through this connection inside the block.
+
+        Requests made by other threads during the block are recorded too::
+
+            with connection.track_requests(max_requests=2) as tracker:
+                dataverse.delete_dataset(dataset)
+            print(tracker.duplicate_gets())
+
+        :param int max_requests: raise `RequestBudgetError` when the block
+            exits if it made more requests than this
+        :param bool allow_duplicate_gets: if False, raise `RequestBudgetError`
+            when the block fetched a URL more than once
+        :return: a `dataverse.metrics.RequestTracker`
+        """
+        tracker = RequestTracker(max_requests, allow_duplicate_gets)
+        self.hooks['after_request'].append(tracker.record)
+        try:
+            yield tracker
+        finally:
+            self.hooks['after_request'].remove(tracker.record)
+        tracker.check()
 
     @property
     def auth(self):
         return self.token, None
 
+    @staticmethod
+    def _create_session(pool_size, max_retries, keep_alive, backoff_factor=0.5,
+                        timeout=None, rate_limiter=None, hooks=None):
+        """Build the session shared by every object reached from this connection.
+
+        Requests made through a session reuse pooled connections, so only the
+        first request to the host pays for the TCP and TLS handshakes.
+        """
+        session = requests.Session()
+        adapter = Transport(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=RetryPolicy.with_backoff(max_retries, backoff_factor, rate_limiter),
+            timeout=timeout,
+            rate_limiter=rate_limiter,
+            hooks=hooks,
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        if not keep_alive:
+            session.headers['Connection'] = 'close'
+
+        return session
+
+    def conditional_get(self, url, parse, refresh=False, **kwargs):
+        """GET `url`, revalidating the response stored by a previous call.
+
+        When the server answers 304 Not Modified, the value is parsed again
+        from the body of the earlier response instead of being downloaded.
+        Only bodies are kept for this, in `validators`, up to
+        `VALIDATOR_CACHE_BYTES` per connection.
+        Each call returns a new value, so callers may modify it. If the
+        connection has a persistent `cache`, fresh responses are read from it
+        without contacting the server at all.
+
+        :param parse: called with a 200 response to build the value to return
+        :param bool refresh: always ask the server, even if the persistent
+            cache holds a fresh response
+        :return: tuple of the response and the parsed value, which is None
+            unless the request succeeded
+        """
+        params = kwargs.get('params') or {}
+        key = (url, tuple(sorted(params.items())))
+        entry = self.validators.get(key)
+
+        cache_key = cached = None
+        if self.cache is not None:
+            cache_key = self.cache.key(url, params, self.token)
+            cached, is_fresh = self.cache.get(cache_key)
+            if is_fresh and not refresh:
+                return self._reuse(key, cached, parse)
+
+        if entry is not None:
+            headers = conditional_headers(entry)
+        elif cached is not None:
+            headers = conditional_headers(self._validators_of(cached))
+        else:
+            headers = {}
+        headers.update(kwargs.pop('headers', None) or {})
+        resp = self.session.get(url, headers=headers, **kwargs)
+
+        if resp.status_code == 304 and entry is not None:
+            if cached is not None and self._validators_of(cached)[:2] == entry[:2]:
+                self.cache.touch(cache_key)
+            etag, last_modified, body = entry
+            headers = dict(
+                (name, value) for name, value in
+                (('ETag', etag), ('Last-Modified', last_modified)) if value
+            )
+            return resp, parse(build_response(url, headers, body))
+        elif resp.status_code == 304 and cached is not None:
+            self.cache.touch(cache_key)
+            return self._reuse(key, cached, parse)
+        elif resp.status_code != 200:
+            return resp, None
+
+        value = parse(resp)
+        self.validators.store(key, resp)
+        if cache_key is not None:
+            self.cache.store(cache_key, url, resp)
+        return resp, value
+
+    def _reuse(self, key, cached, parse):
+        """Return a response from the persistent cache and its parsed value."""
+        self.validators.store(key, cached)
+        return cached, parse(cached)
+
+    def invalidate(self, *urls):
+        """Drop the responses for `urls` from the persistent cache, if any.
+
+        Called after every write, so that other connections sharing the cache
+        do not read responses that the write made stale.
+        """
+        if self.cache is not None:
+            self.cache.invalidate(url for url in urls if url)
+
+    @staticmethod
+    def _validators_of(resp):
+        return resp.headers.get('ETag'), resp.headers.get('Last-Modified'), None
+
+    def validate(self):
+        """Check that the host can be reached with the given credentials.
+
+        Raises `UnauthorizedError` or `ConnectionError` otherwise.
+        """
+        self.get_service_document(refresh=True)
+
     def get_service_document(self, refresh=False):
         if not refresh and self._service_document is not None:
             return self._service_document
 
-        resp = requests.get(self.sd_uri, auth=self.auth)
+        resp, service_document = self.conditional_get(
+            self.sd_uri,
+            lambda resp: etree.XML(resp.content),
+            refresh=refresh,
+            auth=self.auth,
+        )
 
         if resp.status_code == 403:
             raise exceptions.UnauthorizedError('The credentials provided are invalid.')
-        elif resp.status_code != 200:
+        elif service_document is None:
             raise exceptions.ConnectionError('Could not connect to the Dataverse')
 
-        self._service_document = etree.XML(resp.content)
+        if service_document is not self._service_document:
+            self._service_document = service_document
+            self._index_dataverses()
         return self._service_document
 
+    def _index_dataverses(self):
+        """Index the service document's collections by alias.
+
+        Dataverses already known to the connection are kept, so that repeated
+        lookups return the same object.
+        """
+        previous = self._dataverses
+        self._dataverses = OrderedDict()
+
+        for collection in get_collections(self._service_document):
+            dataverse = Dataverse(self, collection)
+            if dataverse.alias in previous:
+                dataverse = previous[dataverse.alias]
+                dataverse.collection = collection
+            self._dataverses[dataverse.alias] = dataverse
+
     def create_dataverse(self, alias, name, email, parent=':root'):
-        resp = requests.post(
+        resp = self.session.post(
             '{0}/dataverses/{1}'.format(self.native_base_url, parent),
             json={
                 'alias': alias,
@@ -54,6 +249,9 @@ class Connection(object):
             },
             params={'key': self.token},
         )
+        self.invalidate(
+            self.sd_uri, '{0}/dataverses/{1}/contents'.format(self.native_base_url, parent),
+        )
 
         if resp.status_code == 404:
             raise exceptions.DataverseNotFoundError(
@@ -64,15 +262,30 @@ class Connection(object):
                 '{0} Dataverse could not be created.'.format(name)
             )
 
-        self.get_service_document(refresh=True)
-        return self.get_dataverse(alias)
+        # Add the new collection to the service document instead of refetching
+        # it, unless it was first fetched just now and lists it already
+        workspace = self.get_service_document()[0]
+        if alias in self._dataverses:
+            return self._dataverses[alias]
+        collection = etree.SubElement(
+            workspace,
+            '{{{0}}}collection'.format(etree.QName(workspace).namespace),
+            href='{0}/collection/dataverse/{1}'.format(self.sword_base_url, alias),
+        )
+        title = etree.SubElement(collection, '{{{0}}}title'.format(SWORD_NAMESPACE['atom']))
+        title.text = name
+
+        dataverse = Dataverse(self, collection)
+        self._dataverses[alias] = dataverse
+        return dataverse
 
     def delete_dataverse(self, dataverse):
 
-        resp = requests.delete(
+        resp = self.session.delete(
             '{0}/dataverses/{1}'.format(self.native_base_url, dataverse.alias),
             params={'key': self.token},
         )
+        self.invalidate(self.sd_uri, *dataverse._cached_urls())
 
         if resp.status_code == 401:
             raise exceptions.UnauthorizedError(
@@ -87,16 +300,15 @@ class Connection(object):
                 'Dataverse {0} could not be deleted.'.format(dataverse.alias)
             )
 
-        self.get_service_document(refresh=True)
+        self._dataverses.pop(dataverse.alias, None)
+        collection = dataverse.collection
+        if collection.getparent() is not None:
+            collection.getparent().remove(collection)
 
     def get_dataverses(self, refresh=False):
-        collections = get_elements(
-            self.get_service_document(refresh)[0],
-            tag='collection',
-        )
-
-        return [Dataverse(self, col) for col in collections]
+        self.get_service_document(refresh)
+        return list(self._dataverses.values())
 
     def get_dataverse(self, alias, refresh=False):
-        return next((dataverse for dataverse in self.get_dataverses(refresh)
-                     if dataverse.alias == alias), None)
+        self.get_service_document(refresh)
+        return self._dataverses.get(alias)
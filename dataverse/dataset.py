@@ -2,16 +2,9 @@ from __future__ import absolute_import
 
 import os
 import json
-
-try:
-    from StringIO import StringIO
-except ImportError:
-    from io import BytesIO as StringIO
-
-from zipfile import ZipFile
+from collections import namedtuple
 
 from lxml import etree
-import requests
 
 from .exceptions import (
     NoContainerError, OperationFailedError, UnpublishedDataverseError,
@@ -19,7 +12,15 @@ from .exceptions import (
 )
 from dataverse.file import DataverseFile
 from dataverse.settings import SWORD_BOOTSTRAP
-from dataverse.utils import get_element, get_files_in_path, add_field
+from dataverse.utils import (
+    get_element, get_files_in_path, add_field, concurrent_map, iter_chunks,
+    plan_batches, zip_package, deposit_headers, parse_dataset_entry, get_links,
+    safe_filename, local_copy_state,
+)
+
+
+FileReport = namedtuple('FileReport', ['file', 'path', 'status', 'error'])
+BatchReport = namedtuple('BatchReport', ['batch', 'filepaths', 'status', 'error', 'attempts'])
 
 
 class Dataset(object):
@@ -38,7 +39,9 @@ class Dataset(object):
 
         self._entry = etree.XML(entry) if isinstance(entry, str) else entry
         self._statement = None
+        self._statement_element = None
         self._metadata = {}
+        self._files = {}
         self._id = None
 
         # Updates sword entry from keyword arguments
@@ -64,22 +67,7 @@ class Dataset(object):
     def from_dataverse(cls, entry_element, dataverse):
 
         # Entry not in appropriate format--extract relevant metadata
-        id_element = get_element(entry_element, tag='id')
-        title_element = get_element(entry_element, tag='title')
-        edit_media_element = get_element(
-            entry_element,
-            tag='link',
-            attribute='rel',
-            attribute_value='edit-media',
-        )
-
-        return cls(
-            title=title_element.text,
-            id=id_element.text,
-            dataverse=dataverse,
-            edit_uri=entry_element.base,
-            edit_media_uri=edit_media_element.get('href'),
-        )
+        return cls(dataverse=dataverse, **parse_dataset_entry(entry_element))
 
     @property
     def doi(self):
@@ -97,23 +85,16 @@ class Dataset(object):
         if not self.dataverse:
             raise NoContainerError('This dataset has not been added to a Dataverse.')
 
-        for dataset in self.dataverse.get_contents(refresh=True):
-            if dataset['type'] == 'dataset':
-                doi = '{0}:{1}/{2}'.format(
-                    dataset['protocol'],
-                    dataset['authority'],
-                    dataset['identifier'],
-                )
-                if doi == self.doi:
-                    self._id = dataset['id']
-                    return self._id
+        self._id = self.dataverse.get_dataset_id(self.doi)
+        if self._id:
+            return self._id
 
         raise MetadataNotFoundError('The dataset ID could not be found.')
 
     @property
     def citation(self):
         return get_element(
-            self.get_entry(),
+            self._get_entry_element(),
             namespace='http://purl.org/dc/terms/',
             tag='bibliographicCitation'
         ).text
@@ -126,15 +107,24 @@ class Dataset(object):
         if not refresh and self._entry is not None:
             return etree.tostring(self._entry)
 
-        resp = requests.get(self.edit_uri, auth=self.connection.auth)
+        resp, entry = self.connection.conditional_get(
+            self.edit_uri,
+            lambda resp: (resp.content, etree.XML(resp.content)),
+            refresh=refresh,
+            auth=self.connection.auth,
+        )
 
-        if resp.status_code != 200:
+        if entry is None:
             raise ConnectionError('Atom entry could not be retrieved.')
 
-        entry_string = resp.content
-        self._entry = etree.XML(entry_string)
+        entry_string, self._entry = entry
         return entry_string
 
+    def _get_entry_element(self, refresh=False):
+        if refresh or self._entry is None:
+            self.get_entry(refresh)
+        return self._entry
+
     def get_statement(self, refresh=False):
         if not refresh and self._statement:
             return self._statement
@@ -145,7 +135,7 @@ class Dataset(object):
         if not self.statement_uri:
             # Try to find statement uri without a request to the server
             link = get_element(
-                self.get_entry(),
+                self._get_entry_element(),
                 tag='link',
                 attribute='rel',
                 attribute_value='http://purl.org/net/sword/terms/statement',
@@ -153,55 +143,67 @@ class Dataset(object):
             if link is None:
                 # Find link with request to server
                 link = get_element(
-                    self.get_entry(refresh=True),
+                    self._get_entry_element(refresh=True),
                     tag='link',
                     attribute='rel',
                     attribute_value='http://purl.org/net/sword/terms/statement',
                 )
             self.statement_uri = link.get('href')
 
-        resp = requests.get(self.statement_uri, auth=self.connection.auth)
+        resp, statement = self.connection.conditional_get(
+            self.statement_uri,
+            lambda resp: (resp.content, etree.XML(resp.content)),
+            refresh=refresh,
+            auth=self.connection.auth,
+        )
 
-        if resp.status_code != 200:
+        if statement is None:
             raise ConnectionError('Statement could not be retrieved.')
 
-        self._statement = resp.content
+        self._statement, self._statement_element = statement
         return self._statement
 
     def get_state(self, refresh=False):
         if self.is_deleted:
             return 'DEACCESSIONED'
 
+        self.get_statement(refresh)
         return get_element(
-            self.get_statement(refresh),
+            self._statement_element,
             tag='category',
             attribute='term',
             attribute_value='latestVersionState'
         ).text
 
-    def get_metadata(self, version='latest', refresh=False):
+    def get_metadata(self, version='latest', refresh=False, cache=True):
+        """Return the JSON metadata of a version of the dataset.
+
+        :param bool cache: keep the metadata on the dataset for later calls.
+            Bulk operations pass False, so that the metadata of a whole
+            dataverse is never held at once.
+        """
         if not refresh and self._metadata.get(version):
             return self._metadata[version]
 
         if not self.dataverse:
             raise NoContainerError('This dataset has not been added to a Dataverse.')
 
-        url = '{0}/datasets/{1}/versions/:{2}'.format(
-            self.connection.native_base_url,
-            self.id,
-            version,
+        resp, metadata = self.connection.conditional_get(
+            self._version_uri(version),
+            lambda resp: resp.json()['data'],
+            refresh=refresh,
+            params={'key': self.connection.token},
         )
 
-        resp = requests.get(url, params={'key': self.connection.token})
-
         if resp.status_code == 404:
             raise VersionJsonNotFoundError(
                 'JSON metadata could not be found for this version.'
             )
-        elif resp.status_code != 200:
+        elif metadata is None:
             raise ConnectionError('JSON metadata could not be retrieved.')
+        elif not cache:
+            return metadata
 
-        metadata = resp.json()['data']
         self._metadata[version] = metadata
 
         # Update corresponding version metadata if retrieving 'latest'
@@ -215,29 +217,53 @@ class Dataset(object):
 
         return metadata
 
-    def update_metadata(self, metadata):
+    def _version_uri(self, version, dataset_id=None):
+        return '{0}/datasets/{1}/versions/:{2}'.format(
+            self.connection.native_base_url,
+            dataset_id or self.id,
+            version,
+        )
+
+    def _cached_urls(self):
+        """URLs of the responses that change when the dataset is written to.
+
+        Version URLs are only known once the dataset's id was resolved.
+        """
+        urls = [self.edit_uri, self.statement_uri]
+        if self._id:
+            urls.extend(
+                self._version_uri(version, self._id)
+                for version in ('latest', 'draft', 'latest-published')
+            )
+        return urls
+
+    def update_metadata(self, metadata, cache=True):
         """Updates dataset draft with provided metadata.
         Will create a draft version if none exists.
 
         :param dict metadata: json retrieved from `get_version_metadata`
+        :param bool cache: keep the updated metadata on the dataset, as
+            `get_metadata` does
         """
-        url = '{0}/datasets/{1}/versions/:draft'.format(
-            self.connection.native_base_url,
-            self.id,
-        )
-        resp = requests.put(
-            url,
+        resp = self.connection.session.put(
+            self._version_uri('draft'),
             headers={'Content-type': 'application/json'},
             data=json.dumps(metadata),
             params={'key': self.connection.token},
         )
+        self.connection.invalidate(*self._cached_urls())
 
         if resp.status_code != 200:
             raise OperationFailedError('JSON metadata could not be updated.')
 
         updated_metadata = resp.json()['data']
-        self._metadata['draft'] = updated_metadata
-        self._metadata['latest'] = updated_metadata
+        if cache:
+            self._metadata['draft'] = updated_metadata
+            self._metadata['latest'] = updated_metadata
+        else:
+            self._metadata.pop('draft', None)
+            self._metadata.pop('latest', None)
+        return updated_metadata
 
     def create_draft(self):
         """Create draft version of dataset without changing metadata"""
@@ -249,11 +275,12 @@ class Dataset(object):
         if not self.dataverse.is_published:
             raise UnpublishedDataverseError('Host Dataverse must be published.')
 
-        resp = requests.post(
+        resp = self.connection.session.post(
             self.edit_uri,
             headers={'In-Progress': 'false', 'Content-Length': '0'},
             auth=self.connection.auth,
         )
+        self.connection.invalidate(*(self._cached_urls() + self.dataverse._cached_urls()))
 
         if resp.status_code != 200:
             raise OperationFailedError('The Dataset could not be published.')
@@ -270,13 +297,58 @@ class Dataset(object):
         return next((f for f in files if f.id == file_id), None)
 
     def get_files(self, version='latest', refresh=False):
+        """Return the files of a version of the dataset.
+
+        Files are built once per fetch of the version's metadata.
+        """
         try:
-            files_json = self.get_metadata(version, refresh)['files']
-            return [DataverseFile.from_json(self, file_json)
-                    for file_json in files_json]
+            metadata = self.get_metadata(version, refresh)
         except VersionJsonNotFoundError:
             return []
 
+        source, files = self._files.get(version, (None, None))
+        if source is not metadata:
+            files = [DataverseFile.from_json(self, file_json)
+                     for file_json in metadata['files']]
+            self._files[version] = (metadata, files)
+        return list(files)
+
+    def download_all(self, dest_dir, version='latest', workers=4, refresh=False):
+        """Download every file in a version of the dataset to `dest_dir`.
+
+        Files are fetched concurrently over the connection's session, so
+        `workers` should not exceed the connection's `pool_size`. Files that
+        already exist with a matching size or checksum are skipped, and
+        partial files are resumed. Directories in file names are ignored, and
+        a file whose name was already taken gets its id appended to it.
+
+        :return: list of `FileReport`, one per file, whose `status` is
+            'downloaded', 'skipped' or 'failed'
+        """
+        if not os.path.isdir(dest_dir):
+            os.makedirs(dest_dir)
+
+        files = self.get_files(version, refresh)
+        paths = _local_paths(files, dest_dir)
+
+        def fetch(dataverse_file):
+            path = paths[dataverse_file]
+            state = local_copy_state(dataverse_file, path)
+            if state == 'complete':
+                return 'skipped'
+            dataverse_file.download(path, resume=state == 'partial')
+            return 'downloaded'
+
+        reports = []
+        for dataverse_file, status, error in concurrent_map(fetch, files, workers):
+            if error is None:
+                reports.append(FileReport(dataverse_file, paths[dataverse_file], status, None))
+            else:
+                reports.append(
+                    FileReport(dataverse_file, paths[dataverse_file], 'failed', error)
+                )
+        return reports
+
     def upload_filepath(self, filepath):
         self.upload_filepaths([filepath])
 
@@ -285,47 +357,97 @@ class Dataset(object):
         if len(filepaths) == 1 and os.path.isdir(filepaths[0]):
             filepaths = get_files_in_path(filepaths[0])
 
-        # Zip up files
-        s = StringIO()
-        zip_file = ZipFile(s, 'w')
-        for filepath in filepaths:
-            zip_file.write(filepath)
-        zip_file.close()
-        content = s.getvalue()
+        self._deposit_filepaths(filepaths)
+        self.get_metadata(refresh=True)
+
+    def upload_batches(self, filepaths, max_bytes=None, max_files=None, workers=1,
+                       retries=2):
+        """Upload files in several SWORD deposits of bounded size.
+
+        Batches are deposited on `workers` threads. Batches that fail are
+        retried up to `retries` times, without resending the batches that
+        succeeded.
+
+        :param int max_bytes: maximum total size of the files in one deposit
+        :param int max_files: maximum number of files in one deposit
+        :return: list of `BatchReport`, one per deposit, whose `status` is
+            'uploaded' or 'failed'
+        """
+        if len(filepaths) == 1 and os.path.isdir(filepaths[0]):
+            filepaths = get_files_in_path(filepaths[0])
+
+        batches = plan_batches(filepaths, max_bytes, max_files)
+        reports = {}
+        pending = range(len(batches))
 
-        self.upload_file('temp.zip', content, zip_files=False)
+        for attempt in range(1, retries + 2):
+            failed = []
+            results = concurrent_map(
+                lambda index: self._deposit_filepaths(batches[index]),
+                pending,
+                workers,
+            )
+            for index, _, error in results:
+                status = 'failed' if error else 'uploaded'
+                reports[index] = BatchReport(index, batches[index], status, error, attempt)
+                if error:
+                    failed.append(index)
+
+            pending = failed
+            if not pending:
+                break
+
+        self.get_metadata(refresh=True)
+        return [reports[index] for index in range(len(batches))]
+
+    def _deposit_filepaths(self, filepaths):
+        package = zip_package(filepaths=filepaths)
+        try:
+            self._deposit('temp.zip', package)
+        finally:
+            package.close()
 
     def upload_file(self, filename, content, zip_files=True):
+        """Upload a file to the dataset.
+
+        :param content: contents of the file. If `zip_files` is False, this may
+            also be a readable binary file object holding a zip archive, which
+            is streamed to the server with chunked transfer encoding.
+        """
         if zip_files:
-            s = StringIO()
-            zip_file = ZipFile(s, 'w')
-            zip_file.writestr(filename, content)
-            zip_file.close()
-            # filename, content should reflect zipped file
-            filename = 'temp.zip'
-            content = s.getvalue()
-
-        headers = {
-            'Content-Disposition': 'filename={0}'.format(filename),
-            'Content-Type': 'application/zip',
-            'Packaging': 'http://purl.org/net/sword/package/SimpleZip',
-        }
-
-        requests.post(
+            package = zip_package(files=[(filename, content)])
+            try:
+                # filename, content should reflect zipped file
+                self._deposit('temp.zip', package)
+            finally:
+                package.close()
+        else:
+            self._deposit(filename, content)
+
+        self.get_metadata(refresh=True)
+        # Note: We can't determine which file was uploaded. Returns None
+
+    def _deposit(self, filename, content):
+        if hasattr(content, 'read'):
+            content = iter_chunks(content)
+
+        resp = self.connection.session.post(
             self.edit_media_uri,
             data=content,
-            headers=headers,
+            headers=deposit_headers(filename),
             auth=self.connection.auth,
         )
+        self.connection.invalidate(*self._cached_urls())
 
-        self.get_metadata(refresh=True)
-        # Note: We can't determine which file was uploaded. Returns None
+        if resp.status_code not in (200, 201):
+            raise OperationFailedError('The files could not be uploaded.')
 
     def delete_file(self, dataverse_file):
-        resp = requests.delete(
+        resp = self.connection.session.delete(
             dataverse_file.edit_media_uri,
             auth=self.connection.auth,
         )
+        self.connection.invalidate(*self._cached_urls())
 
         if resp.status_code != 204:
             raise OperationFailedError('The file could not be deleted.')
@@ -333,27 +455,51 @@ class Dataset(object):
         self.get_metadata(refresh=True)
 
     # If we perform a server operation, we should refresh the dataset object
-    def _refresh(self, receipt=None):
-        if receipt:
-            self.edit_uri = get_element(
-                receipt,
-                tag='link',
-                attribute='rel',
-                attribute_value='edit'
-            ).get('href')
-            self.edit_media_uri = get_element(
-                receipt,
-                tag='link',
-                attribute='rel',
-                attribute_value='edit-media'
-            ).get('href')
-            self.statement_uri = get_element(
-                receipt,
-                tag='link',
-                attribute='rel',
-                attribute_value='http://purl.org/net/sword/terms/statement'
-            ).get('href')
+    def _refresh(self, receipt=None, lazy=False):
+        """Update the dataset from a deposit receipt and reload its resources.
 
-        self.get_statement(refresh=True)
-        self.get_entry(refresh=True)
-        self.get_metadata('latest', refresh=True)
+        The statement, entry and metadata are fetched concurrently, or on
+        first use if `lazy` is true.
+        """
+        if receipt:
+            links = get_links(etree.XML(receipt))
+            self.edit_uri = links['edit']
+            self.edit_media_uri = links['edit-media']
+            self.statement_uri = links['http://purl.org/net/sword/terms/statement']
+
+        if lazy:
+            self._entry = None
+            self._statement = self._statement_element = None
+            self._metadata = {}
+            return
+
+        fetches = [
+            lambda: self.get_statement(refresh=True),
+            lambda: self.get_entry(refresh=True),
+            lambda: self.get_metadata('latest', refresh=True),
+        ]
+        errors = [
+            error for _, _, error in
+            concurrent_map(lambda fetch: fetch(), fetches, workers=len(fetches))
+            if error is not None
+        ]
+        if errors:
+            raise errors[0]
+
+
+def _local_paths(files, dest_dir):
+    """Map each file to a distinct path inside `dest_dir`."""
+    paths = {}
+    taken = set()
+    for dataverse_file in files:
+        name = safe_filename(dataverse_file.name, str(dataverse_file.id))
+        if name in taken:
+            root, extension = os.path.splitext(name)
+            name = '{0}-{1}{2}'.format(root, dataverse_file.id, extension)
+            suffix = 1
+            while name in taken:
+                suffix += 1
+                name = '{0}-{1}-{2}{3}'.format(root, dataverse_file.id, suffix, extension)
+        taken.add(name)
+        paths[dataverse_file] = os.path.join(dest_dir, name)
+    return paths
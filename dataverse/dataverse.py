@@ -1,12 +1,22 @@
 from __future__ import absolute_import
 
-import requests
+from collections import namedtuple
 
 from dataverse.dataset import Dataset
 from dataverse.exceptions import (
-    ConnectionError, MethodNotAllowedError, OperationFailedError,
+    ConnectionError, MetadataNotFoundError, MethodNotAllowedError, OperationFailedError,
 )
-from dataverse.utils import get_element, get_elements, sanitize
+from dataverse.search import SearchIndex
+from dataverse.settings import SEARCH_PAGE_SIZE
+from dataverse.utils import (
+    RateLimiter, concurrent_map, dataset_state, entry_digest, get_element,
+    index_dataset_ids, iter_elements, sanitize,
+)
+
+
+DatasetReport = namedtuple('DatasetReport', ['dataset', 'status', 'error'])
+MetadataResult = namedtuple('MetadataResult', ['dataset', 'metadata', 'error'])
+SyncEvent = namedtuple('SyncEvent', ['kind', 'doi', 'dataset', 'state', 'previous', 'error'])
 
 
 class Dataverse(object):
@@ -16,15 +26,20 @@ class Dataverse(object):
 
         self._collection_info = None
         self._contents_json = None
+        self._dataset_ids = None
+        self._dataset_dois = None
+        self._dataset_ids_source = None
+        self._dataset_index = None
+        self._dataset_index_source = None
+        self._search_index = SearchIndex()
+        self._search_index_source = None
+        self._snapshot = {}
 
     @property
     def is_published(self):
 
         # Always check latest version
-        collection_info = requests.get(
-            self.collection.get('href'),
-            auth=self.connection.auth,
-        ).content
+        collection_info = self.get_collection_info(refresh=True)
 
         status_tag = get_element(
             collection_info,
@@ -35,61 +50,153 @@ class Dataverse(object):
 
         return status.lower() == 'true'
 
+    @property
+    def collection(self):
+        return self._collection
+
+    @collection.setter
+    def collection(self, collection):
+        self._collection = collection
+        # Derived from the collection on first use
+        self._alias = None
+        self._title = None
+
     @property
     def alias(self):
-        return self.collection.get('href').split('/')[-1]
+        if self._alias is None:
+            self._alias = self.collection.get('href').split('/')[-1]
+        return self._alias
 
     @property
     def title(self):
-        return sanitize(get_element(
-            self.collection,
-            namespace='atom',
-            tag='title',
-        ).text)
+        if self._title is None:
+            self._title = sanitize(get_element(
+                self.collection,
+                namespace='atom',
+                tag='title',
+            ).text)
+        return self._title
+
+    @property
+    def contents_uri(self):
+        return '{0}/dataverses/{1}/contents'.format(
+            self.connection.native_base_url, self.alias
+        )
+
+    def _cached_urls(self):
+        """URLs of the responses that change when a dataset is added or removed."""
+        return [self.collection.get('href'), self.contents_uri]
 
     def get_contents(self, refresh=False):
         if not refresh and self._contents_json:
             return self._contents_json
 
-        content_uri = '{0}/dataverses/{1}/contents'.format(
-            self.connection.native_base_url, self.alias
-        )
-        resp = requests.get(
-            content_uri,
-            params={'key': self.connection.token}
+        resp, contents_json = self.connection.conditional_get(
+            self.contents_uri,
+            lambda resp: resp.json()['data'],
+            refresh=refresh,
+            params={'key': self.connection.token},
         )
 
-        if resp.status_code != 200:
+        if contents_json is None:
             raise ConnectionError('Atom entry could not be retrieved.')
 
-        self._contents_json = resp.json()['data']
+        self._contents_json = contents_json
         return self._contents_json
 
+    def get_dataset_id(self, doi, refresh=False):
+        """Find the id of a dataset in this dataverse from its DOI.
+
+        Ids are looked up in an index built from a single contents fetch and
+        shared by all datasets of the dataverse. DOIs missing from the index
+        are resolved individually with the native API.
+
+        Returns None if no dataset has the DOI.
+        """
+        dataset_ids = self._get_dataset_ids(refresh)
+
+        if doi not in dataset_ids:
+            dataset_id = self._lookup_dataset_id(doi)
+            if dataset_id is None:
+                return None
+            dataset_ids[doi] = dataset_id
+            self._dataset_dois[dataset_id] = doi
+
+        return dataset_ids[doi]
+
+    def resolve_ids(self, datasets):
+        """Find the ids of several datasets of this dataverse at once.
+
+        :return: list of ids, in the order of `datasets`
+        """
+        ids = []
+        for dataset in datasets:
+            if not dataset._id:
+                dataset._id = self.get_dataset_id(dataset.doi)
+            ids.append(dataset._id)
+        return ids
+
+    def _get_dataset_ids(self, refresh=False):
+        contents = self.get_contents(refresh)
+        if contents is not self._dataset_ids_source:
+            self._dataset_ids = index_dataset_ids(contents)
+            self._dataset_dois = dict(
+                (dataset_id, doi) for doi, dataset_id in self._dataset_ids.items()
+            )
+            self._dataset_ids_source = contents
+        return self._dataset_ids
+
+    def _lookup_dataset_id(self, doi):
+        resp = self.connection.session.get(
+            '{0}/datasets/:persistentId/'.format(self.connection.native_base_url),
+            params={'persistentId': doi, 'key': self.connection.token},
+        )
+
+        if resp.status_code == 404:
+            return None
+        elif resp.status_code != 200:
+            raise ConnectionError('The dataset ID could not be retrieved.')
+
+        return resp.json()['data']['id']
+
     def get_collection_info(self, refresh=False, timeout=None):
         if not refresh and self._collection_info:
             return self._collection_info
 
-        self._collection_info = requests.get(
+        resp, collection_info = self.connection.conditional_get(
             self.collection.get('href'),
+            lambda resp: resp.content,
+            refresh=refresh,
             auth=self.connection.auth,
             timeout=timeout,
-        ).content
+        )
+
+        if collection_info is None:
+            raise ConnectionError('Collection info could not be retrieved.')
+
+        self._collection_info = collection_info
         return self._collection_info
 
     def publish(self):
         edit_uri = '{0}/edit/dataverse/{1}'.format(
             self.connection.sword_base_url, self.alias
         )
-        resp = requests.post(
+        resp = self.connection.session.post(
             edit_uri,
             headers={'In-Progress': 'false'},
             auth=self.connection.auth,
         )
+        self.connection.invalidate(*self._cached_urls())
 
         if resp.status_code != 200:
             raise OperationFailedError('The Dataverse could not be published.')
 
-    def create_dataset(self, title, description, creator, **kwargs):
+    def create_dataset(self, title, description, creator, lazy=False, **kwargs):
+        """Create a dataset in this dataverse.
+
+        :param bool lazy: fetch the new dataset's statement, entry and metadata
+            on first use instead of right after it is created
+        """
         dataset = Dataset(
             title=title,
             description=description,
@@ -97,33 +204,74 @@ class Dataverse(object):
             **kwargs
         )
 
-        self._add_dataset(dataset)
+        self._add_dataset(dataset, lazy)
         return dataset
 
-    def _add_dataset(self, dataset):
-
-        resp = requests.post(
+    def create_datasets(self, datasets, workers=4, lazy=True):
+        """Create several datasets in this dataverse concurrently.
+
+        The collection feed is refreshed once, after all deposits.
+
+        :param datasets: iterable of `Dataset` objects, or of dicts of keyword
+            arguments for `Dataset`
+        :param bool lazy: fetch the resources of each new dataset on first use
+        :return: list of `DatasetReport` in the order of `datasets`, with status
+            'created' or 'failed'. A failed deposit does not stop the others.
+        """
+        def create(item):
+            dataset = item if isinstance(item, Dataset) else Dataset(**item)
+            self._deposit_dataset(dataset, lazy)
+            return dataset
+
+        reports = []
+        for item, dataset, error in concurrent_map(create, datasets, workers):
+            if error is None:
+                reports.append(DatasetReport(dataset, 'created', None))
+            else:
+                reports.append(DatasetReport(item, 'failed', error))
+
+        if any(report.status == 'created' for report in reports):
+            self._dataset_index = None
+            try:
+                self.get_collection_info(refresh=True)
+            except ConnectionError:
+                # Fetched again on next use
+                self._collection_info = None
+
+        return reports
+
+    def _add_dataset(self, dataset, lazy=False):
+        self._deposit_dataset(dataset, lazy)
+        self._dataset_index = None
+        if lazy:
+            self._collection_info = None
+        else:
+            self.get_collection_info(refresh=True)
+
+    def _deposit_dataset(self, dataset, lazy=False):
+        resp = self.connection.session.post(
             self.collection.get('href'),
             data=dataset.get_entry(),
             headers={'Content-type': 'application/atom+xml'},
             auth=self.connection.auth,
         )
+        self.connection.invalidate(*self._cached_urls())
 
         if resp.status_code != 201:
             raise OperationFailedError('This dataset could not be added.')
 
         dataset.dataverse = self
-        dataset._refresh(receipt=resp.content)
-        self.get_collection_info(refresh=True)
+        dataset._refresh(receipt=resp.content, lazy=lazy)
 
     def delete_dataset(self, dataset):
-        if dataset.get_state() == 'DELETED' or dataset.get_state() == 'DEACCESSIONED':
+        if dataset.get_state() in ('DELETED', 'DEACCESSIONED'):
             return
 
-        resp = requests.delete(
+        resp = self.connection.session.delete(
             dataset.edit_uri,
             auth=self.connection.auth,
         )
+        self.connection.invalidate(*(self._cached_urls() + dataset._cached_urls()))
         if resp.status_code == 405:
             raise MethodNotAllowedError(
                 'Published datasets can only be deleted from the GUI. For '
@@ -132,27 +280,236 @@ class Dataverse(object):
             )
 
         dataset.is_deleted = True
+        self._dataset_index = None
         self.get_collection_info(refresh=True)
 
     def get_datasets(self, refresh=False, timeout=None):
+        return list(self._get_dataset_index(refresh, timeout)['datasets'])
+
+    def iter_datasets(self, refresh=False, timeout=None):
+        """Yield the datasets of the dataverse one at a time.
+
+        The collection feed is parsed incrementally, so a lookup that stops at
+        the first match does not build the remaining datasets.
+        """
+        collection_info = self.get_collection_info(refresh, timeout=timeout)
+        for entry in iter_elements(collection_info, tag='entry', namespace='atom'):
+            yield Dataset.from_dataverse(entry, self)
+
+    def _get_dataset_index(self, refresh=False, timeout=None):
+        """Index the datasets of the collection feed by DOI and title.
+
+        The index is built once per fetch of the feed and dropped when a
+        dataset is added to or deleted from the dataverse.
+        """
         collection_info = self.get_collection_info(refresh, timeout=timeout)
-        entries = get_elements(collection_info, tag='entry')
-        return [Dataset.from_dataverse(entry, self) for entry in entries]
+        if self._dataset_index is not None and \
+                collection_info is self._dataset_index_source:
+            return self._dataset_index
+
+        index = {'datasets': [], 'doi': {}, 'title': {}}
+        for dataset in self.iter_datasets(timeout=timeout):
+            index['datasets'].append(dataset)
+            index['doi'].setdefault(dataset.doi, dataset)
+            index['title'].setdefault(dataset.title, dataset)
+
+        self._dataset_index = index
+        self._dataset_index_source = collection_info
+        return index
+
+    def _get_search_index(self, refresh=False, timeout=None):
+        """Update the search index from the dataset index, on first search only."""
+        index = self._get_dataset_index(refresh, timeout)
+        if self._search_index_source is not index:
+            self._search_index.update(index['datasets'])
+            self._search_index_source = index
+        return self._search_index
 
     def get_dataset_by_doi(self, doi, refresh=False, timeout=None):
-        return next(
-            (s for s in self.get_datasets(refresh, timeout=timeout) if s.doi == doi),
-            None
-        )
+        return self._get_dataset_index(refresh, timeout)['doi'].get(doi)
+
+    def get_datasets_by_doi(self, dois, refresh=False, timeout=None):
+        """Look up several datasets by DOI.
+
+        :return: list of datasets in the order of `dois`, with None for DOIs
+            that are not in the dataverse
+        """
+        index = self._get_dataset_index(refresh, timeout)['doi']
+        return [index.get(doi) for doi in dois]
 
     def get_dataset_by_title(self, title, refresh=False, timeout=None):
-        return next(
-            (s for s in self.get_datasets(refresh, timeout=timeout) if s.title == title),
-            None
-        )
+        return self._get_dataset_index(refresh, timeout)['title'].get(title)
+
+    def get_dataset_by_id(self, dataset_id, refresh=False, timeout=None):
+        index = self._get_dataset_index(refresh, timeout)['doi']
+        self._get_dataset_ids(refresh)
+
+        dataset = index.get(self._dataset_dois.get(dataset_id))
+        if dataset is not None:
+            dataset._id = dataset_id
+        return dataset
+
+    def get_all_metadata(self, version='latest', workers=4, rate=None, refresh=False):
+        """Fetch the metadata of every dataset in the dataverse concurrently.
+
+        Results are yielded in the order of the datasets as they arrive, with
+        at most ``2 * workers`` requests outstanding. The metadata is not kept
+        on the datasets, so only the results not yet consumed are held in
+        memory.
+
+        :param rate: maximum number of requests per second, if any
+        :return: generator of `MetadataResult`. `error` is set instead of
+            `metadata` when a dataset's metadata could not be retrieved.
+        """
+        datasets = self.get_datasets(refresh)
+        self._get_dataset_ids(refresh)
+        limiter = RateLimiter(rate) if rate else None
+
+        def fetch(dataset):
+            if limiter is not None:
+                limiter.acquire()
+            return dataset.get_metadata(version, refresh, cache=False)
+
+        for dataset, metadata, error in concurrent_map(fetch, datasets, workers):
+            yield MetadataResult(dataset, metadata, error)
+
+    def bulk_update_metadata(self, mapping, workers=4, rate=None):
+        """Update the draft metadata of many datasets concurrently.
+
+        :param mapping: dict, or iterable of pairs, from a `Dataset` or a DOI to
+            its new metadata. An iterable is consumed as the updates proceed.
+        :param rate: maximum number of requests per second, if any
+        :return: generator of `MetadataResult` in the order of `mapping`, with
+            the updated metadata. `dataset` is the DOI if it was not found.
+        """
+        items = mapping.items() if hasattr(mapping, 'items') else mapping
+        self._get_dataset_ids()
+        limiter = RateLimiter(rate) if rate else None
+
+        def resolve(items):
+            for key, metadata in items:
+                if isinstance(key, Dataset):
+                    yield key, key, metadata
+                else:
+                    yield key, self.get_dataset_by_doi(key), metadata
+
+        def update(item):
+            key, dataset, metadata = item
+            if dataset is None:
+                raise MetadataNotFoundError(
+                    'Dataset {0} was not found in this dataverse.'.format(key)
+                )
+            if limiter is not None:
+                limiter.acquire()
+            return dataset.update_metadata(metadata, cache=False)
+
+        for (key, dataset, _), updated, error in concurrent_map(
+                update, resolve(items), workers):
+            yield MetadataResult(dataset if dataset is not None else key, updated, error)
+
+    def sync(self, snapshot=None, workers=4):
+        """Compare the dataverse with a snapshot and yield what changed.
+
+        The collection feed and contents are revalidated with conditional
+        requests, and the Search API lists when each dataset last changed.
+        Only the latest versions of datasets that are new, whose entry
+        changed or whose update time moved are fetched. Servers without the
+        Search API, and datasets it does not list, are checked by fetching
+        every latest version. The search index is updated shortly after a
+        change, so a change made just before a sync may only show in the
+        next one.
+
+        :param dict snapshot: maps DOIs to the `dataset_state` seen by a
+            previous sync, and is updated in place as events are yielded.
+            Defaults to a snapshot kept by this object.
+        :return: generator of `SyncEvent` with kind 'added', 'modified',
+            'deleted' or 'error'. `state` is None for deleted datasets and
+            `previous` is None for added ones. A dataset that could not be
+            checked yields an 'error' event with the exception in `error`,
+            and keeps its entry in the snapshot so that the next sync checks
+            it again.
+        """
+        if snapshot is None:
+            snapshot = self._snapshot
+
+        datasets = self.get_datasets(refresh=True)
+        self._get_dataset_ids(refresh=True)
+        update_times = self._get_update_times()
+        current = set()
+
+        def changed(datasets):
+            for dataset in datasets:
+                current.add(dataset.doi)
+                previous = snapshot.get(dataset.doi) or {}
+                updated_at = update_times.get(dataset.doi)
+                if (updated_at is None or previous.get('updated_at') != updated_at or
+                        previous.get('entry') != entry_digest(dataset.get_entry())):
+                    yield dataset
+
+        def check(dataset):
+            metadata = dataset.get_metadata(refresh=True, cache=False)
+            return dataset_state(
+                dataset.get_entry(), metadata, update_times.get(dataset.doi),
+            )
+
+        for dataset, state, error in concurrent_map(check, changed(datasets), workers):
+            previous = snapshot.get(dataset.doi)
+            if error is not None:
+                yield SyncEvent('error', dataset.doi, dataset, None, previous, error)
+                continue
+            if previous == state:
+                continue
+
+            snapshot[dataset.doi] = state
+            if previous is not None and \
+                    dict(previous, updated_at=None) == dict(state, updated_at=None):
+                # Only the update time moved, for example on reindexing
+                continue
+            kind = 'added' if previous is None else 'modified'
+            yield SyncEvent(kind, dataset.doi, dataset, state, previous, None)
+
+        for doi in sorted(set(snapshot) - current):
+            yield SyncEvent('deleted', doi, None, None, snapshot.pop(doi), None)
+
+    def _get_update_times(self):
+        """Map the DOI of each dataset to the time it last changed.
+
+        The times come from the Search API, one request per
+        `SEARCH_PAGE_SIZE` datasets. Returns an empty dict if the server
+        does not offer the Search API.
+        """
+        update_times = {}
+        start = 0
+        while True:
+            resp = self.connection.session.get(
+                '{0}/search'.format(self.connection.native_base_url),
+                params={
+                    'q': '*', 'type': 'dataset', 'subtree': self.alias,
+                    'start': start, 'per_page': SEARCH_PAGE_SIZE,
+                    'key': self.connection.token,
+                },
+            )
+            if resp.status_code != 200:
+                return {}
+
+            data = resp.json()['data']
+            for item in data['items']:
+                doi, updated_at = item.get('global_id'), item.get('updatedAt')
+                if doi and updated_at:
+                    # A dataset with a draft is listed once per version
+                    update_times[doi] = max(updated_at, update_times.get(doi, updated_at))
+
+            start += len(data['items'])
+            if not data['items'] or start >= data['total_count']:
+                return update_times
 
     def get_dataset_by_string_in_entry(self, string, refresh=False, timeout=None):
-        return next(
-            (s for s in self.get_datasets(refresh, timeout=timeout) if string in s.get_entry()),
-            None
-        )
+        return self._get_search_index(refresh, timeout).find_substring(string)
+
+    def search_datasets(self, terms=None, refresh=False, timeout=None, **fields):
+        """Find the datasets whose entries contain every word of `terms`.
+
+        Keyword arguments match words in a single field of the entry, for
+        example ``search_datasets(title='cats')``. Matching ignores case.
+        """
+        return self._get_search_index(refresh, timeout).search(terms, **fields)
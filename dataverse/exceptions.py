@@ -54,3 +54,8 @@ class VersionJsonNotFoundError(DataverseError):
 class DataverseNotFoundError(DataverseError):
     """Raised when a Dataverse cannot be found"""
     pass
+
+
+class RequestBudgetError(DataverseError):
+    """Raised when a block tracked with `track_requests` makes too many requests"""
+    pass
@@ -1,13 +1,33 @@
 from __future__ import absolute_import
 
-from dataverse.utils import sanitize
+import hashlib
+import os
+import time
+from collections import namedtuple
+
+from requests.exceptions import (
+    ChunkedEncodingError, ConnectionError as RequestsConnectionError,
+)
+
+from dataverse.exceptions import ConnectionError, OperationFailedError, UnauthorizedError
+from dataverse.settings import DOWNLOAD_CHUNK_SIZE
+from dataverse.utils import iter_chunks, sanitize
+
+
+DownloadProgress = namedtuple(
+    'DownloadProgress', ['downloaded', 'total', 'elapsed', 'throughput'],
+)
 
 
 class DataverseFile(object):
-    def __init__(self, dataset, name, file_id=None):
+    def __init__(self, dataset, name, file_id=None, size=None, checksum=None):
         self.dataset = dataset
         self.name = sanitize(name)
         self.id = file_id
+        self.size = size
+        self.checksum = checksum
+        # ETag or Last-Modified of the last response, to resume with If-Range
+        self._validator = None
 
         self.download_url = '{0}/access/datafile/{1}'.format(
             dataset.connection.native_base_url, self.id
@@ -20,9 +40,186 @@ class DataverseFile(object):
     @classmethod
     def from_json(cls, dataset, json):
         try:
-            name = json['dataFile']['filename']
-            file_id = json['dataFile']['id']
+            file_json = json['dataFile']
+            name = file_json['filename']
         except KeyError:
-            name = json['datafile']['name']
-            file_id = json['datafile']['id']
-        return cls(dataset, name, file_id)
+            file_json = json['datafile']
+            name = file_json['name']
+        return cls(
+            dataset,
+            name,
+            file_json['id'],
+            size=file_json.get('filesize'),
+            checksum=file_json.get('md5'),
+        )
+
+    @property
+    def connection(self):
+        return self.dataset.connection
+
+    def iter_content(self, chunk_size=DOWNLOAD_CHUNK_SIZE, start=0, max_resumes=3):
+        """Yield the contents of the file in chunks of at most `chunk_size` bytes.
+
+        Only one chunk is held in memory at a time. If the transfer is
+        interrupted, it is resumed from the last byte received with an HTTP
+        Range request, up to `max_resumes` times. The Range request carries
+        an ``If-Range`` validator when the server sent one, and
+        `OperationFailedError` is raised if the file changed meanwhile.
+
+        :param int start: offset of the first byte to yield
+        """
+        position = start
+        resumes = 0
+
+        while True:
+            validator = self._validator if position else None
+            resp = self._open(position, validator)
+            if resp is None:
+                return
+
+            if position and resp.status_code == 200 and validator and \
+                    self._validator != validator:
+                resp.close()
+                raise OperationFailedError(
+                    'The file {0} changed on the server.'.format(self.name)
+                )
+            # Servers that ignore Range resend the file from its first byte
+            skip = position if resp.status_code == 200 else 0
+            try:
+                for chunk in resp.iter_content(chunk_size):
+                    if skip:
+                        discarded = min(skip, len(chunk))
+                        chunk = chunk[discarded:]
+                        skip -= discarded
+                        if not chunk:
+                            continue
+                    position += len(chunk)
+                    yield chunk
+                return
+            except (ChunkedEncodingError, RequestsConnectionError):
+                if resumes >= max_resumes:
+                    raise ConnectionError('The file download was interrupted.')
+                resumes += 1
+            finally:
+                resp.close()
+
+    def download(self, path_or_fileobj, chunk_size=DOWNLOAD_CHUNK_SIZE, resume=True,
+                 callback=None):
+        """Stream the file to disk.
+
+        :param path_or_fileobj: path to write to, or a writable binary file object
+        :param bool resume: continue a partial download found at the given path
+            instead of starting over
+        :param callback: called with a `DownloadProgress` after every chunk
+        :return: the `DownloadProgress` of the completed download. `downloaded`
+            counts bytes now on disk and `throughput` is in bytes per second.
+        :raises OperationFailedError: if the file found at the path is larger
+            than the file on the server, or the download does not match the
+            size or checksum the server reported. A file that was written to
+            is removed.
+        """
+        md5 = hashlib.md5() if self.checksum else None
+        if hasattr(path_or_fileobj, 'write'):
+            return self._download_to(path_or_fileobj, 0, chunk_size, callback, md5)
+
+        start = 0
+        if resume and os.path.exists(path_or_fileobj):
+            start = os.path.getsize(path_or_fileobj)
+            if self.size is not None and start > self.size:
+                raise OperationFailedError(
+                    '{0} is larger than the file on the server.'.format(path_or_fileobj)
+                )
+            if md5 is not None and start:
+                with open(path_or_fileobj, 'rb') as f:
+                    for chunk in iter_chunks(f):
+                        md5.update(chunk)
+
+        try:
+            with open(path_or_fileobj, 'ab' if start else 'wb') as fileobj:
+                return self._download_to(fileobj, start, chunk_size, callback, md5)
+        except OperationFailedError:
+            os.remove(path_or_fileobj)
+            raise
+
+    def _download_to(self, fileobj, start, chunk_size, callback, md5=None):
+        started = time.time()
+        transferred = 0
+        progress = DownloadProgress(start, self.size, 0.0, 0.0)
+
+        for chunk in self.iter_content(chunk_size, start=start):
+            fileobj.write(chunk)
+            if md5 is not None:
+                md5.update(chunk)
+            transferred += len(chunk)
+            elapsed = time.time() - started
+            progress = DownloadProgress(
+                start + transferred,
+                self.size,
+                elapsed,
+                transferred / elapsed if elapsed else 0.0,
+            )
+            if callback is not None:
+                callback(progress)
+
+        if self.size is not None and progress.downloaded != self.size:
+            raise OperationFailedError(
+                'The size of {0} does not match: {1} bytes instead of {2}.'.format(
+                    self.name, progress.downloaded, self.size,
+                )
+            )
+        if md5 is not None and md5.hexdigest() != self.checksum:
+            raise OperationFailedError(
+                'The checksum of {0} does not match.'.format(self.name)
+            )
+        return progress
+
+    def _open(self, position, validator=None):
+        """Request the file from `position` onwards.
+
+        Returns None if there is nothing left to download.
+        """
+        headers = {}
+        if position:
+            headers['Range'] = 'bytes={0}-'.format(position)
+            if validator:
+                headers['If-Range'] = validator
+        try:
+            resp = self.connection.session.get(
+                self.download_url,
+                headers=headers,
+                params={'key': self.connection.token},
+                stream=True,
+            )
+        except RequestsConnectionError:
+            raise ConnectionError('The file could not be downloaded.')
+
+        # Record the full size of the file
+        content_range = resp.headers.get('Content-Range')
+        if content_range and '/' in content_range:
+            total = content_range.rsplit('/', 1)[-1]
+            if total.isdigit():
+                self.size = int(total)
+        elif (resp.status_code == 200 and resp.headers.get('Content-Length') and
+              not resp.headers.get('Content-Encoding')):
+            self.size = int(resp.headers['Content-Length'])
+
+        if resp.status_code == 416:
+            resp.close()
+            return None
+        elif resp.status_code in (401, 403):
+            resp.close()
+            raise UnauthorizedError(
+                'Download of file {0} unauthorized.'.format(self.name)
+            )
+        elif resp.status_code not in (200, 206):
+            resp.close()
+            raise ConnectionError('The file could not be downloaded.')
+
+        # Only strong ETags may be used in If-Range
+        etag = resp.headers.get('ETag')
+        if etag and etag.startswith('W/'):
+            etag = None
+        validator = etag or resp.headers.get('Last-Modified')
+        if validator or resp.status_code == 200:
+            self._validator = validator
+        return resp
@@ -0,0 +1,278 @@
+"""Per-endpoint request metrics, collected from a connection's request hooks.
+
+::
+
+    metrics = Metrics()
+    connection.hooks['after_request'].append(metrics.record)
+    ...
+    print(metrics.to_prometheus())
+"""
+from __future__ import absolute_import
+
+import logging
+import math
+import re
+import threading
+from collections import Counter, deque, namedtuple
+
+from dataverse.exceptions import RequestBudgetError
+
+try:
+    from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+except ImportError:
+    from urllib import urlencode
+    from urlparse import parse_qsl, urlsplit, urlunsplit
+
+
+RequestRecord = namedtuple('RequestRecord', [
+    'method', 'endpoint', 'url', 'status', 'bytes_sent', 'bytes_received',
+    'duration', 'error',
+])
+
+# Path segments replaced with placeholders, so that requests for different
+# datasets or files are aggregated under one endpoint
+ENDPOINT_PATTERNS = [
+    (re.compile(r'/(doi|hdl):.*$'), '/{pid}'),
+    (re.compile(r'/(dataverses?)/[^/]+'), r'/\1/{alias}'),
+    (re.compile(r'/\d+(?=/|$)'), '/{id}'),
+]
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def endpoint_template(url):
+    """Reduce a URL to its path, with identifiers replaced by placeholders.
+
+    For example ``https://host/api/v1/datasets/42/versions/:latest?key=x``
+    becomes ``/api/v1/datasets/{id}/versions/:latest``.
+    """
+    path = urlsplit(url).path
+    for pattern, replacement in ENDPOINT_PATTERNS:
+        path = pattern.sub(replacement, path)
+    return path
+
+
+def redact_url(url):
+    """Remove the API token, passed as the ``key`` parameter, from `url`."""
+    parts = urlsplit(url)
+    params = [(name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+              if name != 'key']
+    return urlunsplit(parts._replace(query=urlencode(params)))
+
+
+def content_length(headers):
+    length = headers.get('Content-Length')
+    return int(length) if length and length.isdigit() else 0
+
+
+def build_record(request, response, error, duration):
+    """Describe a request sent by a `dataverse.transport.Transport`.
+
+    Bytes are counted from Content-Length headers, so chunked bodies count
+    as zero. The duration runs until the response headers were received. The
+    API token is removed from the recorded URL.
+    """
+    return RequestRecord(
+        method=request.method,
+        endpoint=endpoint_template(request.url),
+        url=redact_url(request.url),
+        status=response.status_code if response is not None else None,
+        bytes_sent=content_length(request.headers),
+        bytes_received=content_length(response.headers) if response is not None else 0,
+        duration=duration,
+        error=error,
+    )
+
+
+def percentile(values, fraction):
+    """Return the nearest-rank percentile of sorted `values`."""
+    if not values:
+        return 0.0
+    index = int(math.ceil(fraction * len(values))) - 1
+    return values[min(max(index, 0), len(values) - 1)]
+
+
+class EndpointStats(object):
+    """Running totals for one method and endpoint.
+
+    Latency percentiles are computed over the last `max_samples` requests.
+    """
+
+    def __init__(self, max_samples):
+        self.count = 0
+        self.errors = 0
+        self.duration = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.samples = deque(maxlen=max_samples)
+
+    def add(self, record):
+        self.count += 1
+        if record.error is not None or (record.status or 0) >= 400:
+            self.errors += 1
+        self.duration += record.duration
+        self.bytes_sent += record.bytes_sent
+        self.bytes_received += record.bytes_received
+        self.samples.append(record.duration)
+
+    def quantiles(self):
+        samples = sorted(self.samples)
+        return dict((q, percentile(samples, q)) for q in QUANTILES)
+
+
+class Metrics(object):
+    """Aggregate request records by method and endpoint.
+
+    `record` can be appended to a connection's ``after_request`` hooks, and
+    the same instance may collect from several connections and threads.
+    """
+
+    PREFIX = 'dataverse_client'
+
+    def __init__(self, max_samples=1000):
+        self.max_samples = max_samples
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, record):
+        key = (record.method, record.endpoint)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = EndpointStats(self.max_samples)
+            stats.add(record)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def summary(self):
+        """Return a dict of totals and latency quantiles per (method, endpoint)."""
+        with self._lock:
+            return dict(
+                (key, {
+                    'count': stats.count,
+                    'errors': stats.errors,
+                    'duration': stats.duration,
+                    'bytes_sent': stats.bytes_sent,
+                    'bytes_received': stats.bytes_received,
+                    'quantiles': stats.quantiles(),
+                })
+                for key, stats in self._stats.items()
+            )
+
+    def to_prometheus(self):
+        """Render the metrics in the Prometheus text exposition format."""
+        summary = sorted(self.summary().items())
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            name = '{0}_{1}'.format(self.PREFIX, name)
+            lines.append('# HELP {0} {1}'.format(name, help_text))
+            lines.append('# TYPE {0} {1}'.format(name, kind))
+            for suffix, labels, value in samples:
+                lines.append('{0}{1}{{{2}}} {3}'.format(
+                    name, suffix, _format_labels(labels), _format_value(value),
+                ))
+
+        def per_endpoint(field):
+            return [
+                ('', {'method': method, 'endpoint': endpoint}, stats[field])
+                for (method, endpoint), stats in summary
+            ]
+
+        family('requests_total', 'counter', 'Requests sent.', per_endpoint('count'))
+        family('request_errors_total', 'counter',
+               'Requests that failed or returned a 4xx or 5xx status.',
+               per_endpoint('errors'))
+        family('request_bytes_total', 'counter', 'Bytes of request bodies sent.',
+               per_endpoint('bytes_sent'))
+        family('response_bytes_total', 'counter', 'Bytes of response bodies received.',
+               per_endpoint('bytes_received'))
+
+        durations = []
+        for (method, endpoint), stats in summary:
+            labels = {'method': method, 'endpoint': endpoint}
+            for quantile, value in sorted(stats['quantiles'].items()):
+                durations.append(('', dict(labels, quantile=str(quantile)), value))
+            durations.append(('_sum', labels, stats['duration']))
+            durations.append(('_count', labels, stats['count']))
+        family('request_duration_seconds', 'summary',
+               'Time until the response headers were received.', durations)
+
+        return '\n'.join(lines) + '\n'
+
+    def log(self, logger=None, level=logging.INFO):
+        """Log one line per endpoint, busiest first."""
+        logger = logger or logging.getLogger(__name__)
+        summary = sorted(self.summary().items(), key=lambda item: -item[1]['count'])
+        for (method, endpoint), stats in summary:
+            quantiles = stats['quantiles']
+            logger.log(
+                level,
+                '%s %s: %d requests, %d errors, p50 %.3fs, p95 %.3fs, p99 %.3fs, '
+                '%d bytes sent, %d bytes received',
+                method, endpoint, stats['count'], stats['errors'],
+                quantiles[0.5], quantiles[0.95], quantiles[0.99],
+                stats['bytes_sent'], stats['bytes_received'],
+            )
+
+
+class RequestTracker(object):
+    """Record the requests made by a connection, see `Connection.track_requests`."""
+
+    def __init__(self, max_requests=None, allow_duplicate_gets=True):
+        self.max_requests = max_requests
+        self.allow_duplicate_gets = allow_duplicate_gets
+        self.records = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def count(self):
+        return len(self.records)
+
+    def record(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def duplicate_gets(self):
+        """Map each URL fetched more than once with GET to its number of fetches."""
+        counts = Counter(r.url for r in self.records if r.method == 'GET')
+        return dict((url, count) for url, count in counts.items() if count > 1)
+
+    def check(self):
+        """Raise `RequestBudgetError` if the requests broke the budget."""
+        if self.max_requests is not None and self.count > self.max_requests:
+            raise RequestBudgetError(
+                '{0} requests were made, more than the {1} allowed:\n{2}'.format(
+                    self.count, self.max_requests, self.describe(),
+                )
+            )
+        duplicates = self.duplicate_gets()
+        if duplicates and not self.allow_duplicate_gets:
+            raise RequestBudgetError(
+                'URLs were fetched more than once: {0}'.format(', '.join(
+                    '{0} ({1} times)'.format(url, count)
+                    for url, count in sorted(duplicates.items())
+                ))
+            )
+
+    def describe(self):
+        return '\n'.join(
+            '{0} {1} -> {2}'.format(r.method, r.endpoint, r.status) for r in self.records
+        )
+
+
+def _format_labels(labels):
+    return ','.join(
+        '{0}="{1}"'.format(name, value.replace('\\', '\\\\').replace('"', '\\"')
+                           .replace('\n', '\\n'))
+        for name, value in sorted(labels.items())
+    )
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
@@ -0,0 +1,211 @@
+from __future__ import absolute_import
+
+import json
+import os
+from collections import namedtuple
+
+from dataverse.exceptions import DataverseNotFoundError
+from dataverse.file import DataverseFile
+from dataverse.utils import concurrent_map, local_copy_state, safe_filename
+
+
+MirrorReport = namedtuple('MirrorReport', ['dataset', 'file', 'path', 'status', 'error'])
+
+
+class Mirror(object):
+    """A local copy of the metadata and files of one or more dataverses.
+
+    The mirror is laid out as::
+
+        root/ALIAS/doi/10.5072/FK2/ABC123/metadata.json
+        root/ALIAS/doi/10.5072/FK2/ABC123/files/data.tab
+
+    A manifest at ``root/manifest.json`` records the id, size and checksum of
+    every file downloaded. Each update only downloads files that are new or
+    whose checksum changed, and an interrupted update resumes where it
+    stopped.
+    """
+
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, connection, root, version='latest', workers=4, save_every=100):
+        self.connection = connection
+        self.root = root
+        self.version = version
+        self.workers = workers
+        self.save_every = save_every
+        self.manifest = self._load_manifest()
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.root, self.MANIFEST)
+
+    def dataset_dir(self, dataset):
+        # The alias and DOI come from the server: each of their components
+        # is reduced to a safe name so that no path leads outside the root
+        scheme, _, identifier = dataset.doi.partition(':')
+        parts = [dataset.dataverse.alias, scheme] + identifier.split('/')
+        return os.path.join(self.root, *[safe_filename(part, '_') for part in parts])
+
+    def file_path(self, dataset, dataverse_file):
+        return os.path.join(
+            self.dataset_dir(dataset), 'files',
+            safe_filename(dataverse_file.name, str(dataverse_file.id)),
+        )
+
+    def update(self, aliases=None, prune=True):
+        """Bring the mirror up to date with the server.
+
+        Metadata is fetched and files of all datasets are downloaded
+        concurrently, on `workers` threads in all, and at least two: a third
+        of them fetch metadata ahead of the downloads made by the rest.
+
+        :param aliases: aliases of the dataverses to mirror, or None for every
+            dataverse of the connection
+        :param bool prune: delete local files that were removed from their
+            dataset
+        :return: list of `MirrorReport`, with status 'downloaded', 'skipped',
+            'deleted' or 'failed'. Failures do not stop the update; a failure
+            to fetch a dataset's metadata is reported with `file` None.
+        """
+        reports = []
+        completed = 0
+        metadata_workers = max(self.workers // 3, 1)
+        download_workers = max(self.workers - metadata_workers, 1)
+
+        def fetch(item):
+            dataset, dataverse_file, path = item
+            return self._fetch(dataverse_file, path)
+
+        try:
+            items = self._iter_files(
+                self._get_dataverses(aliases), prune, reports, metadata_workers,
+            )
+            for (dataset, dataverse_file, path), status, error in concurrent_map(
+                    fetch, items, download_workers):
+                key = self._key(path)
+                if error is None:
+                    self.manifest['files'][key] = {
+                        'id': dataverse_file.id,
+                        'size': dataverse_file.size,
+                        'md5': dataverse_file.checksum,
+                    }
+                    reports.append(MirrorReport(dataset, dataverse_file, path, status, None))
+                else:
+                    self.manifest['files'].pop(key, None)
+                    reports.append(MirrorReport(dataset, dataverse_file, path, 'failed', error))
+
+                completed += 1
+                if completed % self.save_every == 0:
+                    self.save_manifest()
+        finally:
+            self.save_manifest()
+
+        return reports
+
+    def _get_dataverses(self, aliases):
+        if aliases is None:
+            return self.connection.get_dataverses()
+
+        dataverses = []
+        for alias in aliases:
+            dataverse = self.connection.get_dataverse(alias)
+            if dataverse is None:
+                raise DataverseNotFoundError('Dataverse {0} was not found.'.format(alias))
+            dataverses.append(dataverse)
+        return dataverses
+
+    def _iter_files(self, dataverses, prune, reports, workers):
+        """Yield the ``(dataset, file, path)`` of every file to mirror.
+
+        Dataset metadata is written as it arrives, and files removed from a
+        dataset are deleted if `prune` is true.
+        """
+        for dataverse in dataverses:
+            results = dataverse.get_all_metadata(
+                self.version, workers=workers, refresh=True,
+            )
+            for dataset, metadata, error in results:
+                dataset_dir = self.dataset_dir(dataset)
+                if error is not None:
+                    reports.append(MirrorReport(dataset, None, dataset_dir, 'failed', error))
+                    continue
+
+                _write_json(os.path.join(dataset_dir, 'metadata.json'), metadata)
+
+                paths = set()
+                for file_json in metadata['files']:
+                    dataverse_file = DataverseFile.from_json(dataset, file_json)
+                    path = self.file_path(dataset, dataverse_file)
+                    paths.add(self._key(path))
+                    yield dataset, dataverse_file, path
+
+                if prune:
+                    reports.extend(self._prune(dataset, paths))
+
+    def _prune(self, dataset, paths):
+        prefix = self._key(os.path.join(self.dataset_dir(dataset), 'files')) + '/'
+        stale = [
+            key for key in self.manifest['files']
+            if key.startswith(prefix) and key not in paths
+        ]
+        for key in stale:
+            path = os.path.join(self.root, *key.split('/'))
+            if os.path.exists(path):
+                os.remove(path)
+            del self.manifest['files'][key]
+            yield MirrorReport(dataset, None, path, 'deleted', None)
+
+    def _fetch(self, dataverse_file, path):
+        recorded = self.manifest['files'].get(self._key(path))
+        if recorded is not None and os.path.exists(path):
+            if dataverse_file.checksum:
+                unchanged = recorded.get('md5') == dataverse_file.checksum
+            else:
+                unchanged = (recorded.get('id'), recorded.get('size')) == \
+                    (dataverse_file.id, dataverse_file.size)
+            if unchanged:
+                return 'skipped'
+            # The file changed on the server: start over
+            os.remove(path)
+
+        state = local_copy_state(dataverse_file, path)
+        if state == 'complete':
+            return 'skipped'
+
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Created by another thread
+                if not os.path.isdir(directory):
+                    raise
+
+        # Raises OperationFailedError, and removes the file, on a bad checksum
+        dataverse_file.download(path, resume=state == 'partial')
+        return 'downloaded'
+
+    def _key(self, path):
+        return os.path.relpath(path, self.root).replace(os.sep, '/')
+
+    def _load_manifest(self):
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        return {'files': {}}
+
+    def save_manifest(self):
+        _write_json(self.manifest_path, self.manifest)
+
+
+def _write_json(path, value):
+    """Write `value` to `path` atomically, so a crash never leaves half a file."""
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(value, f, indent=2, sort_keys=True)
+    getattr(os, 'replace', os.rename)(temp_path, path)
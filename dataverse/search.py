@@ -0,0 +1,118 @@
+from __future__ import absolute_import
+
+import re
+from collections import OrderedDict, defaultdict
+
+from lxml import etree
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower()) if text else []
+
+
+class SearchIndex(object):
+    """An inverted index over the Atom entries of a dataverse's datasets.
+
+    Datasets are indexed by the words in the text of their entry and of each
+    dcterms or Atom field. Substring lookups are narrowed down by the words
+    of the serialized entry, markup included. Calling `update` with a new
+    list of datasets only re-indexes the entries that changed.
+    """
+
+    def __init__(self):
+        self._datasets = OrderedDict()
+        self._texts = {}
+        self._words = {}
+        self._fields = {}
+        self._postings = defaultdict(set)
+        self._field_postings = defaultdict(set)
+        self._substring_postings = defaultdict(set)
+
+    def __len__(self):
+        return len(self._datasets)
+
+    def update(self, datasets):
+        """Make the index match `datasets`, keyed by DOI."""
+        indexed = OrderedDict()
+        for dataset in datasets:
+            key = dataset.doi
+            entry = dataset._get_entry_element()
+            text = etree.tostring(entry, encoding='unicode')
+
+            if self._texts.get(key) != text:
+                self._remove(key)
+                self._add(key, entry, text)
+            indexed[key] = dataset
+
+        for key in set(self._datasets) - set(indexed):
+            self._remove(key)
+        self._datasets = indexed
+
+    def _add(self, key, entry, text):
+        self._texts[key] = text
+        for token in tokenize(text):
+            self._substring_postings[token].add(key)
+
+        words = set()
+        fields = set()
+        for element in entry.iter(tag=etree.Element):
+            field = etree.QName(element).localname
+            tokens = tokenize(element.text)
+            words.update(tokens)
+            fields.update((field, token) for token in tokens)
+        for token in words:
+            self._postings[token].add(key)
+        for field_token in fields:
+            self._field_postings[field_token].add(key)
+        self._words[key] = words
+        self._fields[key] = fields
+
+    def _remove(self, key):
+        if key not in self._texts:
+            return
+
+        for token in tokenize(self._texts.pop(key)):
+            self._discard(self._substring_postings, token, key)
+        for token in self._words.pop(key):
+            self._discard(self._postings, token, key)
+        for field_token in self._fields.pop(key):
+            self._discard(self._field_postings, field_token, key)
+
+    @staticmethod
+    def _discard(postings, token, key):
+        keys = postings.get(token)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del postings[token]
+
+    def search(self, terms=None, **fields):
+        """Find the datasets that contain every word of `terms`.
+
+        Keyword arguments restrict words to a field of the entry, for example
+        ``search('coffee', creator='Peets')``. Matching ignores case.
+        """
+        required = [self._postings.get(token, set()) for token in tokenize(terms)]
+        for field, value in fields.items():
+            required.extend(
+                self._field_postings.get((field, token), set()) for token in tokenize(value)
+            )
+
+        keys = set.intersection(*required) if required else set(self._datasets)
+        return [dataset for key, dataset in self._datasets.items() if key in keys]
+
+    def find_substring(self, string):
+        """Find the first dataset whose serialized entry contains `string`."""
+        # Words inside the string are whole words of any matching entry, so
+        # only entries that contain all of them need to be scanned
+        candidates = None
+        for token in tokenize(string)[1:-1]:
+            keys = self._substring_postings.get(token, set())
+            candidates = keys if candidates is None else candidates & keys
+
+        for key, dataset in self._datasets.items():
+            if (candidates is None or key in candidates) and string in self._texts[key]:
+                return dataset
+        return None
@@ -4,6 +4,18 @@ import os
 
 TEST_HOST = 'demo.dataverse.org'
 
+# Bytes read per chunk when streaming file downloads
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Bytes of a zip package kept in memory before it is spooled to disk
+UPLOAD_SPOOL_SIZE = 16 * 1024 * 1024
+
+# Bytes of response bodies kept for revalidation with conditional requests
+VALIDATOR_CACHE_BYTES = 32 * 1024 * 1024
+
+# Results per page of the Search API; the server allows at most 1000
+SEARCH_PAGE_SIZE = 1000
+
 HERE = os.path.dirname(os.path.abspath(__file__))
 BASE_PATH = os.path.abspath(os.path.join(HERE, os.pardir))
 
@@ -17,3 +17,53 @@ EXAMPLE_FILES = [
     os.path.join(BASE_PATH, 'test', '__init__.py'),
     os.path.join(BASE_PATH, 'test', 'config.py'),
 ]
+
+SWORD_BASE_URL = 'https://{host}/dvn/api/data-deposit/v1.1/swordv2'
+
+SERVICE_DOCUMENT = '''<?xml version='1.0' encoding='UTF-8'?>
+<service xmlns="http://www.w3.org/2007/app"
+         xmlns:atom="http://www.w3.org/2005/Atom"
+         xmlns:sword="http://purl.org/net/sword/terms/">
+  <workspace>
+    <atom:title>Dataverse Network</atom:title>
+    <collection href="{sword}/collection/dataverse/cats">
+      <atom:title>Pictures of Cats</atom:title>
+      <accept>application/zip</accept>
+    </collection>
+    <collection href="{sword}/collection/dataverse/dogs">
+      <atom:title>Pictures of Dogs</atom:title>
+      <accept>application/zip</accept>
+    </collection>
+  </workspace>
+  <sword:version>2.0</sword:version>
+</service>'''
+
+COLLECTION_FEED = '''<?xml version='1.0' encoding='UTF-8'?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+  <id>{sword}/collection/dataverse/cats</id>
+  <title type="text">Pictures of Cats</title>
+  {entries}
+  <dataverseHasBeenReleased xmlns="http://purl.org/net/sword/terms/state">{released}\
+</dataverseHasBeenReleased>
+</feed>'''
+
+COLLECTION_ENTRY = '''<entry xml:base="{sword}/edit/study/{doi}">
+    <id>{sword}/edit/study/{doi}</id>
+    <title type="text">{title}</title>
+    <link rel="edit-media" href="{sword}/edit-media/study/{doi}"/>
+  </entry>'''
+
+DEPOSIT_RECEIPT = '''<?xml version='1.0' encoding='UTF-8'?>
+<entry xmlns="http://www.w3.org/2005/Atom">
+  <id>{sword}/edit/study/{doi}</id>
+  <link rel="edit" href="{sword}/edit/study/{doi}"/>
+  <link rel="edit-media" href="{sword}/edit-media/study/{doi}"/>
+  <link rel="http://purl.org/net/sword/terms/statement" href="{sword}/statement/study/{doi}"/>
+</entry>'''
+
+STATEMENT = '''<?xml version='1.0' encoding='UTF-8'?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+  <id>{sword}/statement/study/{doi}</id>
+  <category term="latestVersionState" scheme="http://purl.org/net/sword/terms/state"
+            label="State">{state}</category>
+</feed>'''
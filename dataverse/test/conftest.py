@@ -0,0 +1,4 @@
+import sys
+
+# The asyncio client's tests need asyncio.run, added in Python 3.7
+collect_ignore = [] if sys.version_info >= (3, 7) else ['test_aio.py']
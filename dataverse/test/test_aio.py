@@ -0,0 +1,187 @@
+from __future__ import absolute_import
+
+import asyncio
+import io
+import json
+import threading
+from zipfile import ZipFile
+
+import pytest
+
+web = pytest.importorskip('aiohttp.web')
+
+from dataverse import aio, utils  # noqa
+from dataverse.aio import AsyncConnection  # noqa
+from dataverse.test.config import (  # noqa
+    COLLECTION_ENTRY, COLLECTION_FEED, SERVICE_DOCUMENT,
+)
+
+SWORD_PATH = '/dvn/api/data-deposit/v1.1/swordv2'
+DOI = 'doi:10.5072/FK2/CATS'
+
+
+class MockDataverse(object):
+    """Serve the parts of a Dataverse used by the asyncio client."""
+
+    def __init__(self):
+        self.deposits = []
+        self.contents_requests = 0
+        self.app = web.Application()
+        self.app.router.add_get(SWORD_PATH + '/service-document', self.service_document)
+        self.app.router.add_get(SWORD_PATH + '/collection/dataverse/cats', self.collection)
+        self.app.router.add_post(SWORD_PATH + '/edit-media/study/' + DOI, self.deposit)
+        self.app.router.add_get('/api/v1/dataverses/cats/contents', self.contents)
+        self.app.router.add_get('/api/v1/datasets/:persistentId/', self.persistent_id)
+        self.app.router.add_get('/api/v1/datasets/42/versions/:latest', self.metadata)
+        self.app.router.add_get('/api/v1/access/datafile/7', self.datafile)
+
+    @property
+    def sword(self):
+        return 'http://{0}{1}'.format(self.host, SWORD_PATH)
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, '127.0.0.1', 0).start()
+        self.host = '{0}:{1}'.format(*self.runner.addresses[0])
+
+    async def service_document(self, request):
+        if request.headers.get('Authorization') is None:
+            return web.Response(status=403)
+        return web.Response(body=SERVICE_DOCUMENT.format(sword=self.sword))
+
+    async def collection(self, request):
+        entry = COLLECTION_ENTRY.format(sword=self.sword, doi=DOI, title='Cats')
+        return web.Response(body=COLLECTION_FEED.format(
+            sword=self.sword, entries=entry, released='true',
+        ))
+
+    async def contents(self, request):
+        self.contents_requests += 1
+        return web.json_response({'data': [{
+            'type': 'dataset', 'id': 42, 'protocol': 'doi',
+            'authority': '10.5072', 'identifier': 'FK2/CATS',
+        }]})
+
+    async def persistent_id(self, request):
+        if request.query['persistentId'] != 'doi:10.5072/FK2/DOGS':
+            return web.Response(status=404)
+        return web.json_response({'data': {'id': 43}})
+
+    async def metadata(self, request):
+        return web.json_response({'data': {'versionState': 'DRAFT', 'files': [
+            {'dataFile': {'id': 7, 'filename': 'cats.txt', 'filesize': 4}},
+        ]}})
+
+    async def deposit(self, request):
+        self.deposits.append((request.headers, await request.read()))
+        return web.Response(status=201)
+
+    async def datafile(self, request):
+        return web.Response(body=b'meow')
+
+
+def run(test):
+    async def main():
+        server = MockDataverse()
+        await server.start()
+        try:
+            async with AsyncConnection(server.host, 'token', use_https=False) as connection:
+                await test(server, connection)
+        finally:
+            await server.runner.cleanup()
+    asyncio.run(main())
+
+
+def test_get_dataverses():
+    async def test(server, connection):
+        dataverses = await connection.get_dataverses()
+        assert [dv.alias for dv in dataverses] == ['cats', 'dogs']
+        assert await connection.get_dataverse('cats') is dataverses[0]
+        assert dataverses[0].title == 'Pictures of Cats'
+    run(test)
+
+
+def test_get_datasets():
+    async def test(server, connection):
+        dataverse = await connection.get_dataverse('cats')
+        datasets = await dataverse.get_datasets()
+        assert [dataset.title for dataset in datasets] == ['Cats']
+        assert datasets[0].doi == DOI
+
+        dataset = await dataverse.get_dataset_by_doi(DOI)
+        assert await dataset.get_id() == 42
+        assert (await dataset.get_metadata())['versionState'] == 'DRAFT'
+    run(test)
+
+
+def test_upload_and_download(tmpdir):
+    async def test(server, connection):
+        dataverse = await connection.get_dataverse('cats')
+        dataset = await dataverse.get_dataset_by_doi(DOI)
+
+        await dataset.upload_file('cats.txt', b'meow')
+        headers, body = server.deposits[0]
+        assert headers['Packaging'] == 'http://purl.org/net/sword/package/SimpleZip'
+        assert ZipFile(io.BytesIO(body)).read('cats.txt') == b'meow'
+
+        files = await dataset.get_files()
+        path = str(tmpdir.join('cats.txt'))
+        assert await dataset.download(files[0], path) == 4
+        with open(path, 'rb') as f:
+            assert f.read() == b'meow'
+    run(test)
+
+
+def test_file_coroutines(tmpdir):
+    async def test(server, connection):
+        dataverse = await connection.get_dataverse('cats')
+        dataset = await dataverse.get_dataset_by_doi(DOI)
+
+        files = await dataset.get_files()
+        assert isinstance(files[0], aio.AsyncDataverseFile)
+        assert b''.join([chunk async for chunk in files[0].iter_content()]) == b'meow'
+
+        path = str(tmpdir.join('cats.txt'))
+        assert await files[0].download(path) == 4
+        with open(path, 'rb') as f:
+            assert f.read() == b'meow'
+    run(test)
+
+
+def test_dataset_ids_shared():
+    async def test(server, connection):
+        dataverse = await connection.get_dataverse('cats')
+        datasets = [await dataverse.get_dataset_by_doi(DOI) for _ in range(3)]
+        assert [await dataset.get_id() for dataset in datasets] == [42, 42, 42]
+        assert server.contents_requests == 1
+
+        assert await dataverse.get_dataset_id('doi:10.5072/FK2/DOGS') == 43
+        assert await dataverse.get_dataset_id('doi:10.5072/FK2/BIRDS') is None
+        assert server.contents_requests == 1
+    run(test)
+
+
+def test_concurrent_requests():
+    async def test(server, connection):
+        dataverse = await connection.get_dataverse('cats')
+        results = await asyncio.gather(*[dataverse.get_contents(refresh=True)
+                                         for _ in range(50)])
+        assert all(json.dumps(result) == json.dumps(results[0]) for result in results)
+    run(test)
+
+
+def test_blocking_work_in_executor(monkeypatch):
+    threads = []
+
+    def zip_package(*args, **kwargs):
+        threads.append(threading.current_thread())
+        return utils.zip_package(*args, **kwargs)
+    monkeypatch.setattr(aio, 'zip_package', zip_package)
+
+    async def test(server, connection):
+        dataverse = await connection.get_dataverse('cats')
+        dataset = await dataverse.get_dataset_by_doi(DOI)
+        await dataset.upload_file('cats.txt', b'meow')
+        assert threads and threads[0] is not threading.current_thread()
+    run(test)
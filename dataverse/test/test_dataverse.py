@@ -2,15 +2,37 @@ from __future__ import print_function, absolute_import
 
 import pytest
 
+import hashlib
+import io
+import json
+import os
+import re
+import socket
+import time
 import uuid
+from multiprocessing.pool import ThreadPool
+from zipfile import ZipFile
 import httpretty
 import requests
+from requests.adapters import HTTPAdapter
+from lxml import etree
 
+from benchmarks.server import DataverseModel, DataverseServer
+
+from dataverse.cache import ResponseCache, ValidatorCache, conditional_headers
 from dataverse.connection import Connection
 from dataverse.dataset import Dataset
+from dataverse.file import DataverseFile
+from dataverse.metrics import Metrics
+from dataverse.mirror import Mirror
 from dataverse.settings import TEST_HOST
-from dataverse.test.config import PICS_OF_CATS_DATASET, ATOM_DATASET, EXAMPLE_FILES
+from dataverse.transport import RetryPolicy
+from dataverse.test.config import (
+    PICS_OF_CATS_DATASET, ATOM_DATASET, EXAMPLE_FILES, SERVICE_DOCUMENT, SWORD_BASE_URL,
+    COLLECTION_FEED, COLLECTION_ENTRY, DEPOSIT_RECEIPT, STATEMENT,
+)
 from dataverse import exceptions
+from dataverse import metrics
 from dataverse import utils
 
 import logging
@@ -92,6 +114,73 @@ class TestUtils(object):
         nonsense = utils.get_elements(entry, 'nonsense', 'booga')
         assert nonsense == []
 
+    def test_get_elements_by_attribute(self):
+        with open(ATOM_DATASET) as f:
+            entry = etree.XML(f.read())
+
+        quoted = etree.SubElement(entry, '{http://www.w3.org/2005/Atom}link', rel='it\'s "quoted"')
+        assert utils.get_elements(entry, 'link', attribute='rel') == [quoted]
+        assert utils.get_element(entry, 'link', attribute='rel',
+                                 attribute_value='it\'s "quoted"') is quoted
+        assert utils.get_element(entry, 'link', attribute='rel', attribute_value='x') is None
+        with pytest.raises(Exception):
+            utils.get_elements(entry, 'link', attribute_value='x')
+
+    def test_rate_limiter(self):
+        limiter = utils.RateLimiter(50, burst=2)
+        start = time.time()
+        for _ in range(7):
+            limiter.acquire()
+
+        # Two calls in the initial burst, then one every 20 ms
+        assert time.time() - start >= 0.09
+
+    def test_concurrent_map(self):
+        def invert(value):
+            return 1.0 / value
+
+        results = list(utils.concurrent_map(invert, iter([1, 2, 0, 4]), workers=2))
+
+        assert [item for item, _, _ in results] == [1, 2, 0, 4]
+        assert [result for _, result, _ in results] == [1.0, 0.5, None, 0.25]
+        assert isinstance(results[2][2], ZeroDivisionError)
+
+    def test_plan_batches(self, tmpdir):
+        filepaths = []
+        for name, size in [('a', 4), ('b', 4), ('c', 10), ('d', 1), ('e', 1), ('f', 1)]:
+            path = tmpdir.join(name)
+            path.write(b'x' * size, mode='wb')
+            filepaths.append(str(path))
+
+        batches = utils.plan_batches(filepaths, max_bytes=8, max_files=2)
+        names = [[os.path.basename(path) for path in batch] for batch in batches]
+
+        assert names == [['a', 'b'], ['c'], ['d', 'e'], ['f']]
+        assert utils.plan_batches(filepaths) == [filepaths]
+
+    def test_iter_elements(self):
+        with open(ATOM_DATASET, 'rb') as f:
+            entry = f.read()
+
+        subjects = utils.iter_elements(entry, 'subject', 'dcterms')
+        first = next(subjects)
+        assert first.text == 'coffee'
+
+        second = next(subjects)
+        assert second.text == 'beverage'
+        assert first.text is None
+
+        third = next(subjects)
+        assert third.getprevious() is second
+        assert second.getprevious() is None
+
+    def test_sanitize(self):
+        plain = u'data 2015-01 (final) "v2".tab'
+        assert utils.sanitize(plain) is plain
+        assert utils.sanitize(u'<b>Cats</b> & dogs') == u'Cats &amp; dogs'
+        assert utils.sanitize(u'a > b') == u'a &gt; b'
+        assert utils.sanitize(u'a\r\nb') == u'a\nb'
+
     def test_format_term(self):
         # A term not in the replacement dict
         formatted_term = utils.format_term('title', namespace='dcterms')
@@ -200,6 +289,1479 @@ class TestConnection(DataverseServerTestBase):
             connection.delete_dataverse(dataverse)
 
 
+class MockServerTestBase(object):
+    """Serve a canned service document for `TEST_HOST` through httpretty."""
+
+    token = 'mock-token'
+    sword_base_url = SWORD_BASE_URL.format(host=TEST_HOST)
+    native_base_url = 'https://{0}/api/v1'.format(TEST_HOST)
+
+    def setup_method(self, method):
+        httpretty.enable()
+        httpretty.register_uri(
+            httpretty.GET,
+            '{0}/service-document'.format(self.sword_base_url),
+            body=SERVICE_DOCUMENT.format(sword=self.sword_base_url),
+        )
+
+    def teardown_method(self, method):
+        httpretty.disable()
+        httpretty.reset()
+
+
+class TestSession(MockServerTestBase):
+
+    def test_session_pool(self):
+        connection = Connection(TEST_HOST, self.token, pool_size=4, max_retries=2)
+        adapter = connection.session.get_adapter('https://{0}'.format(TEST_HOST))
+
+        assert adapter._pool_maxsize == 4
+        assert adapter.max_retries.total == 2
+        assert connection.session.headers['Connection'] == 'keep-alive'
+
+    def test_session_no_keep_alive(self):
+        connection = Connection(TEST_HOST, self.token, keep_alive=False)
+        assert connection.session.headers['Connection'] == 'close'
+
+    def test_session_shared(self):
+        connection = Connection(TEST_HOST, self.token)
+        httpretty.register_uri(
+            httpretty.GET,
+            '{0}/collection/dataverse/cats'.format(self.sword_base_url),
+            body='<feed xmlns="http://www.w3.org/2005/Atom"/>',
+        )
+
+        urls = []
+        send = connection.session.send
+
+        def recording_send(request, **kwargs):
+            urls.append(request.url)
+            return send(request, **kwargs)
+        connection.session.send = recording_send
+
+        dataverse = connection.get_dataverse('cats')
+        dataverse.get_collection_info()
+
+        assert dataverse.connection.session is connection.session
+        assert urls == ['{0}/collection/dataverse/cats'.format(self.sword_base_url)]
+
+
+class TestTransport(MockServerTestBase):
+
+    def setup_method(self, method):
+        super(TestTransport, self).setup_method(method)
+        self.url = '{0}/collection/dataverse/cats'.format(self.sword_base_url)
+        self.statuses = []
+
+        def respond(request, uri, headers):
+            status = self.statuses.pop(0) if self.statuses else 200
+            if status == 429:
+                headers['Retry-After'] = '0'
+            return status, headers, '<feed xmlns="http://www.w3.org/2005/Atom"/>'
+        httpretty.register_uri(httpretty.GET, self.url, body=respond)
+        httpretty.register_uri(httpretty.POST, self.url, body=respond)
+
+    def connect(self, **kwargs):
+        return Connection(TEST_HOST, self.token, lazy=True, backoff_factor=0.01, **kwargs)
+
+    def test_retry(self):
+        self.statuses = [503, 429, 502]
+        resp = self.connect(max_retries=3).session.get(self.url)
+
+        assert resp.status_code == 200
+        assert self.statuses == []
+
+    def test_retries_exhausted(self):
+        self.statuses = [503, 503, 503]
+        resp = self.connect(max_retries=1).session.get(self.url)
+
+        assert resp.status_code == 503
+        assert self.statuses == [503]
+
+    def test_no_retry_by_default(self):
+        self.statuses = [503]
+        assert self.connect().session.get(self.url).status_code == 503
+
+    def test_post_not_retried(self):
+        self.statuses = [503]
+        assert self.connect(max_retries=3).session.post(self.url).status_code == 503
+
+    def test_rate_limiter(self):
+        class CountingLimiter(object):
+            calls = 0
+
+            def acquire(self):
+                self.calls += 1
+
+        limiter = CountingLimiter()
+        self.statuses = [503]
+        self.connect(max_retries=2, rate_limiter=limiter).session.get(self.url)
+
+        # The first attempt and the retry each take a token
+        assert limiter.calls == 2
+
+    def test_read_timeout_not_retried(self):
+        httpretty.disable()
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        try:
+            connection = Connection(
+                '{0}:{1}'.format(*listener.getsockname()), self.token,
+                use_https=False, lazy=True,
+            )
+            with pytest.raises(requests.exceptions.ReadTimeout):
+                connection.session.get(connection.sd_uri, timeout=0.1)
+        finally:
+            listener.close()
+
+    def test_backoff_jitter(self):
+        policy = RetryPolicy.with_backoff(5, backoff_factor=1).increment(method='GET') \
+            .increment(method='GET').increment(method='GET')
+
+        delays = [policy.get_backoff_time() for _ in range(50)]
+        assert all(0 <= delay <= 4 for delay in delays)
+        assert len(set(delays)) > 1
+
+    def test_default_timeout(self, monkeypatch):
+        session = self.connect(timeout=5).session
+        timeouts = []
+        send = HTTPAdapter.send
+
+        def recording_send(adapter, request, **kwargs):
+            timeouts.append(kwargs['timeout'])
+            return send(adapter, request, **kwargs)
+        monkeypatch.setattr(HTTPAdapter, 'send', recording_send)
+
+        session.get(self.url)
+        session.get(self.url, timeout=1)
+        assert timeouts == [5, 1]
+
+
+class TestMetrics(MockServerTestBase):
+
+    def setup_method(self, method):
+        super(TestMetrics, self).setup_method(method)
+        self.connection = Connection(TEST_HOST, self.token, lazy=True)
+        self.metrics = Metrics()
+        self.connection.hooks['after_request'].append(self.metrics.record)
+        for i in (1, 2):
+            httpretty.register_uri(
+                httpretty.GET,
+                '{0}/datasets/{1}/versions/:latest'.format(self.native_base_url, i),
+                body='{"data": {}}',
+                status=200 if i == 1 else 404,
+            )
+
+    def test_endpoint_template(self):
+        assert metrics.endpoint_template(
+            'https://host/api/v1/datasets/42/versions/:latest?key=x'
+        ) == '/api/v1/datasets/{id}/versions/:latest'
+        assert metrics.endpoint_template(
+            'https://host/dvn/api/data-deposit/v1.1/swordv2/edit/study/doi:10.5072/FK2/ABC'
+        ) == '/dvn/api/data-deposit/v1.1/swordv2/edit/study/{pid}'
+        assert metrics.endpoint_template(
+            'https://host/dvn/api/data-deposit/v1.1/swordv2/collection/dataverse/cats'
+        ) == '/dvn/api/data-deposit/v1.1/swordv2/collection/dataverse/{alias}'
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        assert metrics.percentile(values, 0.5) == 50
+        assert metrics.percentile(values, 0.99) == 99
+        assert metrics.percentile([], 0.5) == 0.0
+
+    def test_hooks(self):
+        sent = []
+        self.connection.hooks['before_request'].append(lambda request: sent.append(request.url))
+        self.connection.get_service_document()
+
+        assert sent == [self.connection.sd_uri]
+
+    def test_metrics(self):
+        for i in (1, 1, 2):
+            self.connection.session.get(
+                '{0}/datasets/{1}/versions/:latest'.format(self.native_base_url, i),
+            )
+        summary = self.metrics.summary()
+        stats = summary[('GET', '/api/v1/datasets/{id}/versions/:latest')]
+
+        assert len(summary) == 1
+        assert stats['count'] == 3
+        assert stats['errors'] == 1
+        assert stats['bytes_received'] == 3 * len('{"data": {}}')
+        assert 0 <= stats['quantiles'][0.5] <= stats['quantiles'][0.99]
+
+    def test_error(self):
+        session = self.connection.session
+        with pytest.raises(requests.ConnectionError):
+            session.get('http://{0}.invalid/'.format(uuid.uuid4().hex))
+
+        (stats,) = self.metrics.summary().values()
+        assert stats['errors'] == 1
+
+    def test_failing_hook(self):
+        def fail(record):
+            raise ValueError(record)
+        self.connection.hooks['after_request'].insert(0, fail)
+
+        with pytest.raises(requests.ConnectionError):
+            self.connection.session.get('http://{0}.invalid/'.format(uuid.uuid4().hex))
+        assert self.connection.session.get(self.connection.sd_uri).status_code == 200
+        assert sum(s['count'] for s in self.metrics.summary().values()) == 2
+
+    def test_hook_removed_while_running(self):
+        hooks = self.connection.hooks['after_request']
+
+        def remove_self(record):
+            hooks.remove(remove_self)
+        hooks.insert(0, remove_self)
+
+        self.connection.session.get(self.connection.sd_uri)
+        assert sum(s['count'] for s in self.metrics.summary().values()) == 1
+
+    def test_token_redacted(self):
+        records = []
+        self.connection.hooks['after_request'].append(records.append)
+        self.connection.session.get(
+            '{0}/datasets/1/versions/:latest'.format(self.native_base_url),
+            params={'key': self.token, 'page': 2},
+        )
+
+        assert records[0].url == '{0}/datasets/1/versions/:latest?page=2'.format(
+            self.native_base_url)
+
+    def test_prometheus(self):
+        self.connection.session.get(
+            '{0}/datasets/1/versions/:latest'.format(self.native_base_url),
+        )
+        text = self.metrics.to_prometheus()
+        labels = 'endpoint="/api/v1/datasets/{id}/versions/:latest",method="GET"'
+
+        assert '# TYPE dataverse_client_requests_total counter' in text
+        assert 'dataverse_client_requests_total{{{0}}} 1'.format(labels) in text
+        assert 'dataverse_client_request_duration_seconds_count{{{0}}} 1'.format(labels) in text
+        assert 'dataverse_client_request_duration_seconds{{{0},quantile="0.99"}}'.format(
+            labels) in text
+
+
+class TestTrackRequests(MockServerTestBase):
+
+    def setup_method(self, method):
+        super(TestTrackRequests, self).setup_method(method)
+        self.connection = Connection(TEST_HOST, self.token, lazy=True)
+
+    def test_track_requests(self):
+        with self.connection.track_requests() as tracker:
+            self.connection.get_service_document()
+            self.connection.get_service_document(refresh=True)
+
+        assert tracker.count == 2
+        assert tracker.duplicate_gets() == {self.connection.sd_uri: 2}
+        assert self.connection.hooks['after_request'] == []
+
+        # Requests made after the block are not recorded
+        self.connection.get_service_document(refresh=True)
+        assert len(tracker) == 2
+
+    def test_max_requests(self):
+        with pytest.raises(exceptions.RequestBudgetError):
+            with self.connection.track_requests(max_requests=1):
+                self.connection.get_service_document()
+                self.connection.get_service_document(refresh=True)
+
+    def test_duplicate_gets(self):
+        with pytest.raises(exceptions.RequestBudgetError) as error:
+            with self.connection.track_requests(allow_duplicate_gets=False):
+                self.connection.get_service_document()
+                self.connection.get_service_document(refresh=True)
+
+        assert '(2 times)' in str(error.value)
+
+    def test_token_redacted(self):
+        dataverse = self.connection.get_dataverse('cats')
+        httpretty.register_uri(httpretty.GET, dataverse.contents_uri, body='{"data": []}')
+
+        with pytest.raises(exceptions.RequestBudgetError) as error:
+            with self.connection.track_requests(allow_duplicate_gets=False):
+                dataverse.get_contents(refresh=True)
+                dataverse.get_contents(refresh=True)
+
+        assert self.token not in str(error.value)
+        assert '{0} (2 times)'.format(dataverse.contents_uri) in str(error.value)
+
+
+class TestLazyConnection(MockServerTestBase):
+
+    def test_lazy(self):
+        connection = Connection(TEST_HOST, self.token, lazy=True)
+
+        assert not httpretty.latest_requests()
+        assert connection._service_document is None
+        assert connection.get_dataverse('cats').alias == 'cats'
+        assert len(httpretty.latest_requests()) == 1
+
+    def test_validate(self):
+        connection = Connection(TEST_HOST, self.token, lazy=True)
+        connection.validate()
+        assert connection._service_document is not None
+
+    def test_validate_unauthorized(self):
+        host = 'unauthorized.{0}'.format(TEST_HOST)
+        httpretty.register_uri(
+            httpretty.GET,
+            '{0}/service-document'.format(SWORD_BASE_URL.format(host=host)),
+            status=403,
+        )
+        connection = Connection(host, 'wrong-token', lazy=True)
+        with pytest.raises(exceptions.UnauthorizedError):
+            connection.validate()
+
+
+class TestConditionalGet(MockServerTestBase):
+
+    def setup_method(self, method):
+        super(TestConditionalGet, self).setup_method(method)
+        self.dataverse = Connection(TEST_HOST, self.token).get_dataverse('cats')
+        self.conditional_requests = []
+
+        def respond(request, uri, headers):
+            if request.headers.get('If-None-Match') == '"v1"':
+                self.conditional_requests.append(request)
+                return 304, headers, ''
+            headers['ETag'] = '"v1"'
+            return 200, headers, '<feed xmlns="http://www.w3.org/2005/Atom"/>'
+        httpretty.register_uri(httpretty.GET, self.dataverse.collection.get('href'), body=respond)
+
+    def test_not_modified(self):
+        collection_info = self.dataverse.get_collection_info()
+
+        assert self.dataverse.get_collection_info(refresh=True) is collection_info
+        assert len(self.conditional_requests) == 1
+
+    def test_not_modified_returns_copy(self):
+        def respond(request, uri, headers):
+            if request.headers.get('If-None-Match') == '"v1"':
+                self.conditional_requests.append(request)
+                return 304, headers, ''
+            headers['ETag'] = '"v1"'
+            return 200, headers, '{"data": [{"type": "dataverse"}]}'
+        httpretty.register_uri(httpretty.GET, self.dataverse.contents_uri, body=respond)
+
+        self.dataverse.get_contents().append({'type': 'dataset'})
+        assert self.dataverse.get_contents(refresh=True) == [{'type': 'dataverse'}]
+        assert len(self.conditional_requests) == 1
+
+    def test_validator_cache(self):
+        cache = ValidatorCache(max_bytes=10)
+
+        class Response(object):
+            headers = {'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+
+            def __init__(self, content):
+                self.content = content
+
+        for key in ['a', 'b', 'c']:
+            cache.store(key, Response(key.encode('ascii') * 4))
+
+        assert cache.get('a') is None
+        assert cache.get('c')[2] == b'cccc'
+        assert conditional_headers(cache.get('b')) == {
+            'If-Modified-Since': 'Wed, 21 Oct 2015 07:28:00 GMT',
+        }
+        assert cache.size == 8
+
+        cache.store('d', Response(b'd' * 11))
+        assert cache.get('d') is None
+        assert len(cache) == 2
+
+        Response.headers = {}
+        cache.store('b', Response(b'B'))
+        assert cache.get('b') is None
+        assert cache.size == 4
+
+
+class TestResponseCache(MockServerTestBase):
+
+    def setup_method(self, method):
+        super(TestResponseCache, self).setup_method(method)
+        self.collection_requests = []
+
+        def respond(request, uri, headers):
+            self.collection_requests.append(request)
+            if request.headers.get('If-None-Match') == '"v1"':
+                return 304, headers, ''
+            headers['ETag'] = '"v1"'
+            return 200, headers, '<feed xmlns="http://www.w3.org/2005/Atom"/>'
+        httpretty.register_uri(
+            httpretty.GET,
+            '{0}/collection/dataverse/cats'.format(self.sword_base_url),
+            body=respond,
+        )
+
+    def count_service_document_requests(self):
+        return len([r for r in httpretty.latest_requests() if r.path.endswith('service-document')])
+
+    def test_fresh(self, tmpdir):
+        path = str(tmpdir.join('cache.db'))
+        Connection(TEST_HOST, self.token, cache=ResponseCache(path))
+        connection = Connection(TEST_HOST, self.token, cache=ResponseCache(path))
+
+        assert self.count_service_document_requests() == 1
+        assert connection.get_dataverse('cats').title == 'Pictures of Cats'
+
+    def test_scoped_by_token(self, tmpdir):
+        path = str(tmpdir.join('cache.db'))
+        Connection(TEST_HOST, self.token, cache=ResponseCache(path))
+        Connection(TEST_HOST, 'other-token', cache=ResponseCache(path))
+
+        assert self.count_service_document_requests() == 2
+        with open(path, 'rb') as f:
+            assert self.token.encode('utf-8') not in f.read()
+
+    def test_stale(self, tmpdir):
+        path = str(tmpdir.join('cache.db'))
+        connection = Connection(TEST_HOST, self.token, cache=ResponseCache(path, ttl=0))
+        collection_info = connection.get_dataverse('cats').get_collection_info()
+
+        connection = Connection(TEST_HOST, self.token, cache=ResponseCache(path, ttl=0))
+        assert connection.get_dataverse('cats').get_collection_info() == collection_info
+        assert self.collection_requests[-1].headers['If-None-Match'] == '"v1"'
+        assert len(self.collection_requests) == 2
+
+    def test_refresh(self, tmpdir):
+        connection = Connection(
+            TEST_HOST, self.token, cache=ResponseCache(str(tmpdir.join('cache.db'))),
+        )
+        dataverse = connection.get_dataverse('cats')
+        dataverse.get_collection_info()
+        dataverse.get_collection_info(refresh=True)
+        connection.validate()
+
+        assert len(self.collection_requests) == 2
+        assert self.collection_requests[-1].headers['If-None-Match'] == '"v1"'
+        assert self.count_service_document_requests() == 2
+
+    def test_write_invalidates(self, tmpdir):
+        path = str(tmpdir.join('cache.db'))
+        httpretty.register_uri(
+            httpretty.POST, '{0}/edit/dataverse/cats'.format(self.sword_base_url),
+        )
+        connection = Connection(TEST_HOST, self.token, cache=ResponseCache(path))
+        dataverse = connection.get_dataverse('cats')
+        dataverse.get_collection_info()
+        dataverse.publish()
+
+        other = Connection(TEST_HOST, self.token, cache=ResponseCache(path))
+        other.get_dataverse('cats').get_collection_info()
+        assert len(self.collection_requests) == 2
+        assert 'If-None-Match' not in self.collection_requests[-1].headers
+
+    def test_eviction(self, tmpdir):
+        cache = ResponseCache(str(tmpdir.join('cache.db')), max_bytes=10)
+
+        class Response(object):
+            headers = {}
+            content = b'123456'
+
+        cache.store('a', 'https://example.com/a', Response())
+        cache.store('b', 'https://example.com/b', Response())
+
+        assert cache.get('a') == (None, False)
+        assert cache.get('b')[0].content == b'123456'
+
+
+class TestDataverseIndex(MockServerTestBase):
+
+    def setup_method(self, method):
+        super(TestDataverseIndex, self).setup_method(method)
+        self.connection = Connection(TEST_HOST, self.token)
+
+    def count_service_document_requests(self):
+        return len([r for r in httpretty.latest_requests() if r.path.endswith('service-document')])
+
+    def test_get_dataverse(self):
+        dataverse = self.connection.get_dataverse('cats')
+
+        assert dataverse.title == 'Pictures of Cats'
+        assert self.connection.get_dataverse('cats') is dataverse
+        assert self.connection.get_dataverse('cats', refresh=True) is dataverse
+        assert self.connection.get_dataverse('birds') is None
+        assert [dv.alias for dv in self.connection.get_dataverses()] == ['cats', 'dogs']
+
+    def test_dataverse_title(self):
+        dataverse = self.connection.get_dataverse('cats')
+        assert dataverse.title == 'Pictures of Cats'
+
+        collection = etree.XML(etree.tostring(dataverse.collection))
+        utils.get_element(collection, 'title', 'atom').text = 'Pictures of <b>Lions</b>'
+        dataverse.collection = collection
+        assert dataverse.title == 'Pictures of Lions'
+        assert dataverse.alias == 'cats'
+
+    def test_create_dataverse(self):
+        httpretty.register_uri(
+            httpretty.POST,
+            '{0}/dataverses/:root'.format(self.native_base_url),
+            status=201,
+        )
+        dataverse = self.connection.create_dataverse('birds', 'Birds', 'bird@example.com')
+
+        assert self.count_service_document_requests() == 1
+        assert dataverse.alias == 'birds'
+        assert dataverse.title == 'Birds'
+        assert self.connection.get_dataverse('birds') is dataverse
+        assert [dv.alias for dv in self.connection.get_dataverses()] == ['cats', 'dogs', 'birds']
+
+    def test_create_dataverse_lazy(self):
+        httpretty.register_uri(
+            httpretty.POST,
+            '{0}/dataverses/:root'.format(self.native_base_url),
+            status=201,
+        )
+        connection = Connection(TEST_HOST, self.token, lazy=True)
+        # The service document fetched after the POST lists the new dataverse
+        dataverse = connection.create_dataverse('dogs', 'Dogs', 'dog@example.com')
+
+        assert connection.get_dataverse('dogs') is dataverse
+        assert [dv.alias for dv in connection.get_dataverses()] == ['cats', 'dogs']
+        assert len(utils.get_collections(connection.get_service_document())) == 2
+
+    def test_delete_dataverse(self):
+        httpretty.register_uri(
+            httpretty.DELETE,
+            '{0}/dataverses/cats'.format(self.native_base_url),
+        )
+        self.connection.delete_dataverse(self.connection.get_dataverse('cats'))
+
+        assert self.count_service_document_requests() == 1
+        assert self.connection.get_dataverse('cats') is None
+        assert [dv.alias for dv in self.connection.get_dataverses()] == ['dogs']
+
+
+class CollectionTestBase(MockServerTestBase):
+    """Serve a collection feed with `dataset_count` datasets for the 'cats' dataverse."""
+
+    dataset_count = 5
+
+    def setup_method(self, method):
+        super(CollectionTestBase, self).setup_method(method)
+        self.dataverse = Connection(TEST_HOST, self.token).get_dataverse('cats')
+        self.dois = [
+            'doi:10.5072/FK2/CAT{0}'.format(i) for i in range(self.dataset_count)
+        ]
+        self.titles = {}
+        httpretty.register_uri(
+            httpretty.GET,
+            self.dataverse.collection.get('href'),
+            body=self.collection_feed,
+        )
+
+    def collection_feed(self, request, uri, headers):
+        entries = ''.join(
+            COLLECTION_ENTRY.format(
+                sword=self.sword_base_url, doi=doi,
+                title=self.titles.get(doi, 'Cat {0}'.format(i)),
+            )
+            for i, doi in enumerate(self.dois)
+        )
+        return 200, headers, COLLECTION_FEED.format(
+            sword=self.sword_base_url, entries=entries, released='true',
+        ).encode('utf-8')
+
+
+class TestDatasets(CollectionTestBase):
+
+    def test_get_datasets(self):
+        datasets = self.dataverse.get_datasets()
+
+        assert [dataset.doi for dataset in datasets] == self.dois
+        assert datasets[2].title == 'Cat 2'
+        assert datasets[2].edit_uri == '{0}/edit/study/{1}'.format(
+            self.sword_base_url, self.dois[2],
+        )
+
+    def test_iter_datasets(self):
+        datasets = self.dataverse.iter_datasets()
+
+        assert next(datasets).doi == self.dois[0]
+        assert len(list(datasets)) == 4
+
+    def test_get_dataset_by_doi(self):
+        assert self.dataverse.get_dataset_by_doi(self.dois[3]).title == 'Cat 3'
+        assert self.dataverse.get_dataset_by_doi('doi:10.5072/FK2/DOG') is None
+
+    def test_get_dataset_by_title(self):
+        assert self.dataverse.get_dataset_by_title('Cat 1').doi == self.dois[1]
+
+    def test_get_datasets_by_doi(self):
+        datasets = self.dataverse.get_datasets_by_doi([self.dois[4], 'doi:10.5072/FK2/DOG'])
+
+        assert datasets[0].title == 'Cat 4'
+        assert datasets[1] is None
+
+    def test_get_dataset_by_id(self):
+        httpretty.register_uri(
+            httpretty.GET,
+            '{0}/dataverses/cats/contents'.format(self.native_base_url),
+            body=json.dumps({'data': [
+                {'type': 'dataset', 'id': 12, 'protocol': 'doi',
+                 'authority': '10.5072', 'identifier': 'FK2/CAT2'},
+            ]}),
+        )
+        dataset = self.dataverse.get_dataset_by_id(12)
+
+        assert dataset.doi == self.dois[2]
+        assert dataset.id == 12
+        assert self.dataverse.get_dataset_by_id(13) is None
+
+    def test_index(self):
+        dataset = self.dataverse.get_dataset_by_doi(self.dois[0])
+
+        with self.dataverse.connection.track_requests(max_requests=0):
+            assert self.dataverse.get_dataset_by_doi(self.dois[0]) is dataset
+            assert self.dataverse.get_datasets()[0] is dataset
+
+        self.dois.append('doi:10.5072/FK2/KITTEN')
+        assert self.dataverse.get_dataset_by_doi(self.dois[-1]) is None
+        assert self.dataverse.get_dataset_by_doi(self.dois[-1], refresh=True).title == 'Cat 5'
+
+    def test_is_published(self):
+        assert self.dataverse.is_published
+
+
+class TestSearchDatasets(CollectionTestBase):
+
+    def test_search_datasets(self):
+        datasets = self.dataverse.search_datasets('cat')
+
+        assert [dataset.doi for dataset in datasets] == self.dois
+        assert [d.doi for d in self.dataverse.search_datasets('CAT 3')] == [self.dois[3]]
+        assert self.dataverse.search_datasets('dog') == []
+
+    def test_search_datasets_by_field(self):
+        datasets = self.dataverse.search_datasets(title='3')
+
+        assert [dataset.title for dataset in datasets] == ['Cat 3']
+        assert self.dataverse.search_datasets(title='fk2') == []
+
+    def test_search_non_ascii(self):
+        self.titles[self.dois[1]] = u'Caf\xe9 prices'
+
+        assert [d.doi for d in self.dataverse.search_datasets(u'caf\xe9')] == [self.dois[1]]
+        assert [d.doi for d in self.dataverse.search_datasets(title=u'CAF\xc9')] == [self.dois[1]]
+        assert self.dataverse.get_dataset_by_string_in_entry(u'Caf\xe9').doi == self.dois[1]
+
+    def test_markup_not_indexed(self):
+        for word in ('entry', 'link', 'href', 'rel', 'type'):
+            assert self.dataverse.search_datasets(word) == []
+
+    def test_get_dataset_by_string_in_entry(self):
+        dataset = self.dataverse.get_dataset_by_string_in_entry('FK2/CAT2')
+
+        assert dataset.doi == self.dois[2]
+        assert self.dataverse.get_dataset_by_string_in_entry('FK2/CAT').doi == self.dois[0]
+        assert self.dataverse.get_dataset_by_string_in_entry('fk2/cat2') is None
+
+    def test_update(self):
+        self.dataverse.search_datasets()
+        self.dois[1] = 'doi:10.5072/FK2/KITTEN'
+
+        assert self.dataverse.search_datasets('kitten') == []
+        assert len(self.dataverse.search_datasets('kitten', refresh=True)) == 1
+        assert self.dataverse.search_datasets('cat1') == []
+        assert len(self.dataverse._search_index) == len(self.dois)
+
+    def test_lookups_do_not_index(self):
+        self.dataverse.get_dataset_by_doi(self.dois[0])
+        assert len(self.dataverse._search_index) == 0
+
+        self.dataverse.search_datasets('cat')
+        assert len(self.dataverse._search_index) == len(self.dois)
+
+
+class VersionTestBase(CollectionTestBase):
+    """Also serve the contents of the dataverse and the versions of its datasets."""
+
+    def setup_method(self, method):
+        super(VersionTestBase, self).setup_method(method)
+        self.ids = dict((doi, 10 + i) for i, doi in enumerate(self.dois))
+        self.changes = {}
+        httpretty.register_uri(
+            httpretty.GET, '{0}/dataverses/cats/contents'.format(self.native_base_url),
+            body=self.contents,
+        )
+        version_uri = re.compile(r'.*/datasets/\d+/versions/:(latest|draft)')
+        httpretty.register_uri(httpretty.GET, version_uri, body=self.version)
+        httpretty.register_uri(httpretty.PUT, version_uri, body=self.version)
+
+    def contents(self, request, uri, headers):
+        items = []
+        for doi in self.dois:
+            authority, identifier = doi.split(':')[1].split('/', 1)
+            items.append({
+                'type': 'dataset', 'id': self.ids.setdefault(doi, 10 + len(self.ids)),
+                'protocol': 'doi', 'authority': authority, 'identifier': identifier,
+            })
+        return 200, headers, json.dumps({'data': items})
+
+    def version(self, request, uri, headers):
+        dataset_id = int(uri.split('/datasets/')[1].split('/')[0])
+        metadata = {'versionState': 'DRAFT', 'id': dataset_id, 'files': []}
+        metadata.update(self.changes.get(dataset_id, {}))
+        if request.method == 'PUT':
+            metadata.update(json.loads(request.body.decode('utf-8')))
+        return 200, headers, json.dumps({'data': metadata})
+
+
+class TestGetFiles(VersionTestBase):
+
+    def test_get_files(self):
+        self.changes[10] = {'files': [
+            {'datafile': {'id': 20 + i, 'name': 'cat{0}.tab'.format(i)}} for i in range(3)
+        ]}
+        dataset = self.dataverse.get_dataset_by_doi(self.dois[0])
+        files = dataset.get_files()
+
+        assert [f.name for f in files] == ['cat0.tab', 'cat1.tab', 'cat2.tab']
+        assert dataset.get_file('cat1.tab') is files[1]
+        assert dataset.get_file_by_id(22) is files[2]
+        assert dataset.get_files(refresh=True)[0] is not files[0]
+
+
+class TestCachedMetadata(VersionTestBase):
+
+    def test_update_then_refresh(self, tmpdir):
+        cache = self.dataverse.connection.cache = ResponseCache(str(tmpdir.join('cache.db')))
+        dataset = self.dataverse.get_dataset_by_doi(self.dois[0])
+        assert 'title' not in dataset.get_metadata()
+
+        dataset.update_metadata({'title': 'Lions'})
+        key = cache.key(dataset._version_uri('latest'), {}, self.token)
+        assert cache.get(key) == (None, False)
+
+        self.changes[dataset.id] = {'title': 'Lions'}
+        assert dataset.get_metadata(refresh=True)['title'] == 'Lions'
+
+
+class TestCreateDataset(CollectionTestBase):
+
+    doi = 'doi:10.5072/FK2/NEW'
+
+    def setup_method(self, method):
+        super(TestCreateDataset, self).setup_method(method)
+        receipt = DEPOSIT_RECEIPT.format(sword=self.sword_base_url, doi=self.doi)
+        httpretty.register_uri(
+            httpretty.POST, self.dataverse.collection.get('href'), body=self.deposit,
+        )
+        httpretty.register_uri(
+            httpretty.GET, '{0}/edit/study/{1}'.format(self.sword_base_url, self.doi),
+            body=receipt,
+        )
+        httpretty.register_uri(
+            httpretty.GET, '{0}/statement/study/{1}'.format(self.sword_base_url, self.doi),
+            body=STATEMENT.format(sword=self.sword_base_url, doi=self.doi, state='DRAFT'),
+        )
+        httpretty.register_uri(
+            httpretty.GET, '{0}/dataverses/cats/contents'.format(self.native_base_url),
+            body=json.dumps({'data': [
+                {'type': 'dataset', 'id': 7, 'protocol': 'doi',
+                 'authority': '10.5072', 'identifier': 'FK2/NEW'},
+            ]}),
+        )
+        httpretty.register_uri(
+            httpretty.GET, '{0}/datasets/7/versions/:latest'.format(self.native_base_url),
+            body=json.dumps({'data': {'versionState': 'DRAFT', 'files': []}}),
+        )
+
+    def deposit(self, request, uri, headers):
+        if b'Bad cat' in request.body:
+            return 400, headers, ''
+        return 201, headers, DEPOSIT_RECEIPT.format(sword=self.sword_base_url, doi=self.doi)
+
+    def test_create_dataset(self):
+        dataset = self.dataverse.create_dataset('New cat', 'Descripty', 'foo@test.com')
+        requests_made = len(httpretty.latest_requests())
+
+        assert dataset.edit_media_uri == '{0}/edit-media/study/{1}'.format(
+            self.sword_base_url, self.doi,
+        )
+        assert dataset.get_state() == 'DRAFT'
+        assert dataset.get_metadata()['versionState'] == 'DRAFT'
+        assert len(httpretty.latest_requests()) == requests_made
+
+    def test_delete_dataset(self):
+        httpretty.register_uri(
+            httpretty.DELETE, '{0}/edit/study/{1}'.format(self.sword_base_url, self.doi),
+            status=204,
+        )
+        dataset = self.dataverse.create_dataset(
+            'New cat', 'Descripty', 'foo@test.com', lazy=True,
+        )
+        connection = self.dataverse.connection
+
+        # Statement, delete and collection feed
+        with connection.track_requests(max_requests=3, allow_duplicate_gets=False) as tracker:
+            self.dataverse.delete_dataset(dataset)
+
+        assert [record.method for record in tracker.records] == ['GET', 'DELETE', 'GET']
+        assert dataset.is_deleted
+
+    def test_create_dataset_lazy(self):
+        requests_made = len(httpretty.latest_requests())
+        dataset = self.dataverse.create_dataset(
+            'New cat', 'Descripty', 'foo@test.com', lazy=True,
+        )
+
+        # Only the deposit was made
+        assert all(
+            request.method == 'POST' for request in httpretty.latest_requests()[requests_made:]
+        )
+        assert dataset.statement_uri == '{0}/statement/study/{1}'.format(
+            self.sword_base_url, self.doi,
+        )
+        assert dataset.get_state() == 'DRAFT'
+        assert httpretty.last_request().path.endswith('/statement/study/' + self.doi)
+
+
+class LocalServerTestBase(object):
+    """Serve a dataverse of five datasets from a local, threaded `DataverseServer`.
+
+    Unlike httpretty, the server answers concurrent requests correctly, so
+    tests of the thread pools can use several workers.
+    """
+
+    workers = 3
+
+    def setup_method(self, method):
+        self.model = DataverseModel(alias='cats', datasets=5, files_per_dataset=0)
+        self.server = DataverseServer(self.model).start()
+        self.connection = Connection(self.server.host, 'token', use_https=False)
+        self.dataverse = self.connection.get_dataverse('cats')
+        self.dois = list(self.model.datasets)
+
+    def teardown_method(self, method):
+        self.server.stop()
+
+    def fail_version(self, doi, status=404):
+        dataset_id = self.model.datasets[doi]['id']
+        self.server.faults['/api/v1/datasets/{0}/versions/:latest'.format(dataset_id)] = status
+
+
+class TestBulkMetadata(LocalServerTestBase):
+
+    def setup_method(self, method):
+        super(TestBulkMetadata, self).setup_method(method)
+        self.fail_version(self.dois[3])
+
+    def test_get_all_metadata(self):
+        results = list(self.dataverse.get_all_metadata(workers=self.workers))
+
+        assert [result.dataset.doi for result in results] == self.dois
+        assert [result.metadata['id'] for result in results if not result.error] == [1, 2, 3, 5]
+        assert isinstance(results[3].error, exceptions.VersionJsonNotFoundError)
+        assert results[3].metadata is None
+
+    def test_get_all_metadata_rate(self):
+        start = time.time()
+        results = list(self.dataverse.get_all_metadata(workers=self.workers, rate=40))
+
+        assert len(results) == len(self.dois)
+        assert time.time() - start >= 0.1
+
+    def test_metadata_not_kept(self):
+        list(self.dataverse.get_all_metadata(workers=self.workers))
+        list(self.dataverse.bulk_update_metadata(
+            [(doi, {}) for doi in self.dois], workers=self.workers,
+        ))
+        list(self.dataverse.sync(workers=self.workers))
+
+        datasets = self.dataverse.get_datasets()
+        assert len(datasets) == len(self.dois)
+        assert [dataset._metadata for dataset in datasets] == [{}] * len(datasets)
+
+    def test_bulk_update_metadata(self):
+        dataset = self.dataverse.get_dataset_by_doi(self.dois[1])
+        updates = iter([
+            (self.dois[0], {'metadataBlocks': {'citation': {'displayName': 'Zero'}}}),
+            (dataset, {'metadataBlocks': {'citation': {'displayName': 'One'}}}),
+            ('doi:10.5072/FK2/DOG', {'metadataBlocks': {'citation': {'displayName': 'Dog'}}}),
+        ])
+        results = list(self.dataverse.bulk_update_metadata(updates, workers=self.workers))
+
+        assert results[0].dataset.doi == self.dois[0]
+        assert results[0].metadata['metadataBlocks']['citation']['displayName'] == 'Zero'
+        assert results[1].dataset is dataset
+        blocks = dataset.get_metadata('draft', refresh=True)['metadataBlocks']
+        assert blocks['citation']['displayName'] == 'One'
+        assert results[2].dataset == 'doi:10.5072/FK2/DOG'
+        assert isinstance(results[2].error, exceptions.MetadataNotFoundError)
+
+
+class TestSync(LocalServerTestBase):
+
+    def sync(self, snapshot=None):
+        return [
+            (event.kind, event.doi)
+            for event in self.dataverse.sync(snapshot, workers=self.workers)
+        ]
+
+    def test_sync(self):
+        assert self.sync() == [('added', doi) for doi in self.dois]
+        assert self.sync() == []
+
+        self.model.datasets[self.dois[1]]['version'] += 1
+        self.model.add_files(self.dois[2], ['cat.tab'])
+        self.model.delete_dataset(self.dois[4])
+        kitten = self.model.add_dataset('Kitten')['doi']
+
+        assert self.sync() == [
+            ('modified', self.dois[1]),
+            ('modified', self.dois[2]),
+            ('added', kitten),
+            ('deleted', self.dois[4]),
+        ]
+        assert self.sync() == []
+
+    def version_fetches(self, tracker):
+        return [record.url for record in tracker.records if '/versions/' in record.url]
+
+    def test_sync_fetches_changed_only(self):
+        self.sync()
+        with self.connection.track_requests() as tracker:
+            assert self.sync() == []
+        assert self.version_fetches(tracker) == []
+
+        self.model.add_files(self.dois[3], ['cat.tab'])
+        with self.connection.track_requests() as tracker:
+            assert self.sync() == [('modified', self.dois[3])]
+        assert len(self.version_fetches(tracker)) == 1
+
+    def test_sync_without_search(self):
+        self.server.faults['/api/v1/search'] = 404
+        assert self.sync() == [('added', doi) for doi in self.dois]
+
+        self.model.datasets[self.dois[0]]['version'] += 1
+        with self.connection.track_requests() as tracker:
+            assert self.sync() == [('modified', self.dois[0])]
+        assert len(self.version_fetches(tracker)) == len(self.dois)
+
+    def test_sync_error(self):
+        self.sync()
+        self.model.datasets[self.dois[1]]['version'] += 1
+        self.model.datasets[self.dois[2]]['version'] += 1
+        self.fail_version(self.dois[1], 500)
+
+        events = list(self.dataverse.sync(workers=self.workers))
+
+        assert [(event.kind, event.doi) for event in events] == [
+            ('error', self.dois[1]), ('modified', self.dois[2]),
+        ]
+        assert isinstance(events[0].error, exceptions.DataverseError)
+        assert events[0].previous is not None
+
+        self.server.faults.clear()
+        assert self.sync() == [('modified', self.dois[1])]
+
+    def test_sync_snapshot(self):
+        snapshot = {}
+        self.sync(snapshot)
+        snapshot = json.loads(json.dumps(snapshot))
+        self.model.datasets[self.dois[4]]['version'] += 1
+
+        events = list(self.dataverse.sync(snapshot, workers=self.workers))
+
+        assert [event.doi for event in events] == [self.dois[4]]
+        assert events[0].previous['last_update_time'] == '2015-01-01T00:00:01Z'
+        assert events[0].state['last_update_time'] == '2015-01-01T00:00:02Z'
+        assert snapshot[self.dois[4]] == events[0].state
+
+
+class TestMirror(LocalServerTestBase):
+
+    def setup_method(self, method):
+        super(TestMirror, self).setup_method(method)
+        self.fail_version(self.dois[4])
+        self.files = self.model.add_files(self.dois[0], ['meow.txt'], content=b'meow')
+        self.files += self.model.add_files(self.dois[0], ['purr.txt'], content=b'purr purr')
+
+    def dataset_dir(self, tmpdir, doi):
+        return tmpdir.join('cats', *doi.replace(':', '/').split('/'))
+
+    def fail_download(self, file_id):
+        self.server.faults['/api/v1/access/datafile/{0}'.format(file_id)] = 500
+
+    def update(self, mirror):
+        with self.connection.track_requests() as tracker:
+            reports = mirror.update(aliases=['cats'])
+        self.downloads = sorted(
+            int(record.url.split('?')[0].rsplit('/', 1)[-1]) for record in tracker.records
+            if '/access/datafile/' in record.url
+        )
+        return reports
+
+    def statuses(self, reports):
+        return sorted((report.status, os.path.basename(report.path)) for report in reports)
+
+    def test_update(self, tmpdir):
+        mirror = Mirror(self.connection, str(tmpdir), workers=self.workers)
+        dataset_dir = self.dataset_dir(tmpdir, self.dois[0])
+        files_dir = dataset_dir.join('files')
+        failed = ('failed', self.dois[4].rsplit('/', 1)[-1])
+
+        assert self.statuses(self.update(mirror)) == [
+            ('downloaded', 'meow.txt'), ('downloaded', 'purr.txt'), failed,
+        ]
+        assert files_dir.join('purr.txt').read_binary() == b'purr purr'
+        assert json.loads(dataset_dir.join('metadata.json').read())['id'] == 1
+        assert len(Mirror(None, str(tmpdir)).manifest['files']) == 2
+        assert all(not dataset._metadata for dataset in self.dataverse.get_datasets())
+
+        assert self.statuses(self.update(mirror)) == [
+            failed, ('skipped', 'meow.txt'), ('skipped', 'purr.txt'),
+        ]
+        assert self.downloads == []
+
+        for dataverse_file in self.files:
+            self.model.delete_file(dataverse_file['id'])
+        hiss = self.model.add_files(self.dois[0], ['purr.txt'], content=b'hiss')[0]
+        assert self.statuses(self.update(mirror)) == [
+            ('deleted', 'meow.txt'), ('downloaded', 'purr.txt'), failed,
+        ]
+        assert self.downloads == [hiss['id']]
+        assert not files_dir.join('meow.txt').exists()
+        assert files_dir.join('purr.txt').read_binary() == b'hiss'
+
+    def test_resume(self, tmpdir):
+        self.fail_download(self.files[0]['id'])
+        reports = self.update(Mirror(self.connection, str(tmpdir), workers=self.workers))
+
+        assert [report.status for report in reports if report.file] == ['failed', 'downloaded']
+
+        self.server.faults.clear()
+        reports = self.update(Mirror(self.connection, str(tmpdir), workers=self.workers))
+
+        assert [report.status for report in reports if report.file] == ['downloaded', 'skipped']
+        assert self.downloads == [self.files[0]['id']]
+
+    def test_unsafe_doi(self, tmpdir):
+        doi = 'doi:10.5072/../../../../evil'
+        dataset = self.model.datasets.pop(self.dois[1])
+        dataset['doi'] = doi
+        self.model.datasets[doi] = dataset
+        self.model.dois[dataset['id']] = doi
+        self.model.add_files(doi, ['cat.txt'])
+        root = tmpdir.join('mirror')
+
+        reports = Mirror(self.connection, str(root), workers=self.workers).update(['cats'])
+
+        assert [report.status for report in reports if report.dataset.doi == doi] == [
+            'downloaded',
+        ]
+        dataset_dir = root.join('cats', 'doi', '10.5072', '_', '_', '_', '_', 'evil')
+        assert dataset_dir.join('files', 'cat.txt').check(file=1)
+        assert dataset_dir.join('metadata.json').check(file=1)
+        assert sorted(os.listdir(str(tmpdir))) == ['mirror']
+
+    def test_worker_budget(self, tmpdir, monkeypatch):
+        pool_sizes = []
+
+        def pool(workers):
+            pool_sizes.append(workers)
+            return ThreadPool(workers)
+
+        monkeypatch.setattr(utils, 'ThreadPool', pool)
+        Mirror(self.connection, str(tmpdir), workers=6).update(['cats'])
+
+        assert sorted(pool_sizes) == [2, 4]
+
+    def test_unknown_dataverse(self, tmpdir):
+        with pytest.raises(exceptions.DataverseNotFoundError):
+            Mirror(self.connection, str(tmpdir)).update(['birds'])
+
+
+class TestCreateDatasets(LocalServerTestBase):
+
+    def test_create_datasets(self):
+        items = [
+            {'title': 'Cat {0}'.format(i), 'description': 'Descripty', 'creator': 'foo'}
+            for i in range(5)
+        ]
+        # The server rejects a deposit without a title
+        items[2]['title'] = ''
+        items.append(Dataset(title='Kitten', description='Descripty', creator='foo'))
+
+        with self.connection.track_requests() as tracker:
+            reports = self.dataverse.create_datasets(items, workers=3)
+
+        statuses = [report.status for report in reports]
+        assert statuses == ['created', 'created', 'failed', 'created', 'created', 'created']
+        assert reports[2].dataset is items[2]
+        assert isinstance(reports[2].error, exceptions.OperationFailedError)
+        assert reports[5].dataset is items[5]
+        assert reports[0].dataset.title == 'Cat 0'
+        assert reports[0].dataset.dataverse is self.dataverse
+
+        feed_fetches = [
+            record for record in tracker.records
+            if record.method == 'GET' and record.url.endswith('/collection/dataverse/cats')
+        ]
+        assert len(feed_fetches) == 1
+
+
+class TestDatasetIds(MockServerTestBase):
+
+    def setup_method(self, method):
+        super(TestDatasetIds, self).setup_method(method)
+        self.dataverse = Connection(TEST_HOST, self.token).get_dataverse('cats')
+        httpretty.register_uri(
+            httpretty.GET,
+            '{0}/dataverses/cats/contents'.format(self.native_base_url),
+            body=json.dumps({'data': [
+                {'type': 'dataverse', 'id': 1},
+                {'type': 'dataset', 'id': 2, 'protocol': 'doi',
+                 'authority': '10.5072', 'identifier': 'FK2/TABBY'},
+                {'type': 'dataset', 'id': 3, 'protocol': 'doi',
+                 'authority': '10.5072', 'identifier': 'FK2/CALICO'},
+            ]}),
+        )
+
+        def lookup(request, uri, headers):
+            if request.querystring['persistentId'] == ['doi:10.5072/FK2/SIAMESE']:
+                return 200, headers, json.dumps({'data': {'id': 4}})
+            return 404, headers, ''
+        httpretty.register_uri(
+            httpretty.GET,
+            '{0}/datasets/:persistentId/'.format(self.native_base_url),
+            body=lookup,
+        )
+
+    def make_dataset(self, identifier):
+        return Dataset(
+            title=identifier,
+            dataverse=self.dataverse,
+            edit_media_uri='{0}/edit-media/study/doi:10.5072/FK2/{1}'.format(
+                self.sword_base_url, identifier,
+            ),
+        )
+
+    def count_requests(self, path):
+        return len([r for r in httpretty.latest_requests() if path in r.path])
+
+    def test_resolve_ids(self):
+        datasets = [self.make_dataset(name) for name in ['TABBY', 'CALICO', 'SIAMESE']]
+
+        assert self.dataverse.resolve_ids(datasets) == [2, 3, 4]
+        assert [dataset.id for dataset in datasets] == [2, 3, 4]
+        assert self.count_requests('/contents') == 1
+        assert self.count_requests('/:persistentId/') == 1
+
+    def test_id_shared_index(self):
+        assert self.make_dataset('TABBY').id == 2
+        assert self.make_dataset('CALICO').id == 3
+        assert self.count_requests('/contents') == 1
+
+    def test_id_not_found(self):
+        with pytest.raises(exceptions.MetadataNotFoundError):
+            self.make_dataset('SPHYNX').id
+
+
+class TestDataverseFile(MockServerTestBase):
+
+    content = b'0123456789' * 100
+
+    def setup_method(self, method):
+        super(TestDataverseFile, self).setup_method(method)
+        connection = Connection(TEST_HOST, self.token)
+        dataset = Dataset(title='Cats', dataverse=connection.get_dataverse('cats'))
+        self.file = DataverseFile(dataset, 'cats.tab', 42)
+
+    def register_content(self, honor_range=True):
+        def respond(request, uri, headers):
+            byte_range = request.headers.get('Range')
+            if not honor_range or not byte_range:
+                return 200, headers, self.content
+            start = int(byte_range.split('=')[1].rstrip('-'))
+            headers['Content-Range'] = 'bytes {0}-{1}/{2}'.format(
+                start, len(self.content) - 1, len(self.content),
+            )
+            return 206, headers, self.content[start:]
+
+        httpretty.register_uri(httpretty.GET, self.file.download_url, body=respond)
+
+    def test_from_json(self):
+        dataset = self.file.dataset
+        dataverse_file = DataverseFile.from_json(dataset, {'dataFile': {
+            'id': 7, 'filename': 'a.txt', 'filesize': 12, 'md5': 'abc',
+        }})
+        assert dataverse_file.name == 'a.txt'
+        assert dataverse_file.size == 12
+        assert dataverse_file.checksum == 'abc'
+
+    def test_iter_content(self):
+        self.register_content()
+        chunks = list(self.file.iter_content(chunk_size=64))
+
+        assert b''.join(chunks) == self.content
+        assert max(len(chunk) for chunk in chunks) <= 64
+        assert self.file.size == len(self.content)
+
+    def test_iter_content_range_ignored(self):
+        self.register_content(honor_range=False)
+        assert b''.join(self.file.iter_content(start=995)) == self.content[995:]
+
+    def test_download(self, tmpdir):
+        self.register_content()
+        path = str(tmpdir.join('cats.tab'))
+        updates = []
+        progress = self.file.download(path, chunk_size=100, callback=updates.append)
+
+        with open(path, 'rb') as f:
+            assert f.read() == self.content
+        assert progress.downloaded == progress.total == len(self.content)
+        assert len(updates) == 10
+
+    def test_download_resume(self, tmpdir):
+        self.register_content()
+        path = tmpdir.join('cats.tab')
+        path.write(self.content[:300], mode='wb')
+        progress = self.file.download(str(path))
+
+        assert path.read(mode='rb') == self.content
+        assert httpretty.last_request().headers['Range'] == 'bytes=300-'
+        assert progress.downloaded == len(self.content)
+
+    def test_resume_refused(self, monkeypatch):
+        self.register_content()
+        session = self.file.connection.session
+        get = session.get
+        ranges = []
+
+        def interrupted_get(url, headers, **kwargs):
+            ranges.append(headers.get('Range'))
+            if headers:
+                raise requests.exceptions.ConnectionError('Connection refused')
+            resp = get(url, headers=headers, **kwargs)
+
+            def iter_content(chunk_size):
+                yield self.content[:100]
+                raise requests.exceptions.ChunkedEncodingError('Connection reset')
+
+            resp.iter_content = iter_content
+            return resp
+
+        monkeypatch.setattr(session, 'get', interrupted_get)
+        with pytest.raises(exceptions.ConnectionError):
+            list(self.file.iter_content())
+        assert ranges == [None, 'bytes=100-']
+
+    def test_download_complete(self, tmpdir):
+        httpretty.register_uri(httpretty.GET, self.file.download_url, status=416)
+        path = tmpdir.join('cats.tab')
+        path.write(self.content, mode='wb')
+        self.file.download(str(path))
+
+        assert path.read(mode='rb') == self.content
+
+    def test_download_not_found(self, tmpdir):
+        httpretty.register_uri(httpretty.GET, self.file.download_url, status=404)
+        with pytest.raises(exceptions.ConnectionError):
+            self.file.download(str(tmpdir.join('cats.tab')))
+
+
+class TestStaleDownload(LocalServerTestBase):
+    """Resuming onto a file that is not a prefix of the file on the server."""
+
+    content = b'0123456789abcde'
+
+    def setup_method(self, method):
+        super(TestStaleDownload, self).setup_method(method)
+        self.model.add_files(self.dois[0], ['cat.txt'], content=self.content)
+        self.file = self.dataverse.get_dataset_by_doi(self.dois[0]).get_files()[0]
+
+    def test_larger(self, tmpdir):
+        path = tmpdir.join('cat.txt')
+        path.write(b'x' * 200, mode='wb')
+
+        with pytest.raises(exceptions.OperationFailedError):
+            self.file.download(str(path))
+        assert path.size() == 200
+
+    def test_larger_size_unknown(self, tmpdir):
+        path = tmpdir.join('cat.txt')
+        path.write(b'x' * 200, mode='wb')
+        dataverse_file = DataverseFile(self.file.dataset, 'cat.txt', self.file.id)
+
+        with pytest.raises(exceptions.OperationFailedError):
+            dataverse_file.download(str(path))
+        assert dataverse_file.size == len(self.content)
+        assert not path.exists()
+
+    def test_different_prefix(self, tmpdir):
+        path = tmpdir.join('cat.txt')
+        path.write(b'OLDCONTENT', mode='wb')
+
+        with pytest.raises(exceptions.OperationFailedError):
+            self.file.download(str(path))
+        assert not path.exists()
+
+        self.file.download(str(path))
+        assert path.read(mode='rb') == self.content
+
+    def test_changed_while_resuming(self, tmpdir):
+        path = tmpdir.join('cat.txt')
+        self.file.download(str(path))
+        path.write(self.content[:5], mode='wb')
+        self.file.download(str(path))
+        assert path.read(mode='rb') == self.content
+
+        # Without a checksum, only If-Range can tell that the file changed
+        self.file.checksum = None
+        path.write(self.content[:5], mode='wb')
+        self.model.file_contents[self.file.id] = self.content[::-1]
+        with pytest.raises(exceptions.OperationFailedError):
+            self.file.download(str(path))
+        assert not path.exists()
+
+
+class TestDownloadAll(MockServerTestBase):
+
+    def setup_method(self, method):
+        super(TestDownloadAll, self).setup_method(method)
+        connection = Connection(TEST_HOST, self.token)
+        self.dataset = Dataset(title='Cats', dataverse=connection.get_dataverse('cats'))
+        self.contents = {1: b'tabby', 2: b'calico', 3: b'siamese'}
+        calico_md5 = hashlib.md5(b'calico').hexdigest()
+        self.dataset._metadata['latest'] = {'files': [
+            {'dataFile': {'id': 1, 'filename': 'tabby.txt', 'filesize': 5}},
+            {'dataFile': {'id': 2, 'filename': 'calico.txt', 'md5': calico_md5}},
+            {'dataFile': {'id': 3, 'filename': 'siamese.txt', 'filesize': 7}},
+            {'dataFile': {'id': 4, 'filename': 'missing.txt'}},
+        ]}
+        for file_id, content in self.contents.items():
+            httpretty.register_uri(
+                httpretty.GET,
+                '{0}/access/datafile/{1}'.format(self.native_base_url, file_id),
+                body=content,
+            )
+        httpretty.register_uri(
+            httpretty.GET,
+            '{0}/access/datafile/4'.format(self.native_base_url),
+            status=404,
+        )
+
+    def test_download_all(self, tmpdir):
+        tmpdir.join('calico.txt').write(b'calico', mode='wb')
+        tmpdir.join('siamese.txt').write(b'siamese', mode='wb')
+        reports = self.dataset.download_all(str(tmpdir.join('.')), workers=2)
+        statuses = dict((report.file.name, report.status) for report in reports)
+
+        assert statuses == {
+            'tabby.txt': 'downloaded',
+            'calico.txt': 'skipped',
+            'siamese.txt': 'skipped',
+            'missing.txt': 'failed',
+        }
+        assert tmpdir.join('tabby.txt').read(mode='rb') == b'tabby'
+        assert isinstance(reports[3].error, exceptions.ConnectionError)
+
+    def test_download_all_creates_directory(self, tmpdir):
+        dest_dir = str(tmpdir.join('mirror'))
+        self.dataset.download_all(dest_dir)
+
+        assert tmpdir.join('mirror', 'siamese.txt').read(mode='rb') == b'siamese'
+
+    def test_download_all_unsafe_names(self, tmpdir):
+        self.dataset._metadata['latest'] = {'files': [
+            {'dataFile': {'id': 1, 'filename': '../../tabby.txt'}},
+            {'dataFile': {'id': 2, 'filename': '/tmp/tabby.txt'}},
+            {'dataFile': {'id': 3, 'filename': '..'}},
+        ]}
+        dest_dir = tmpdir.join('cats')
+        reports = self.dataset.download_all(str(dest_dir), workers=2)
+
+        assert [os.path.basename(report.path) for report in reports] == [
+            'tabby.txt', 'tabby-2.txt', '3',
+        ]
+        assert all(report.status == 'downloaded' for report in reports)
+        assert dest_dir.join('tabby.txt').read(mode='rb') == b'tabby'
+        assert dest_dir.join('tabby-2.txt').read(mode='rb') == b'calico'
+        assert sorted(os.listdir(str(tmpdir))) == ['cats']
+
+
+class TestUpload(MockServerTestBase):
+
+    def setup_method(self, method):
+        super(TestUpload, self).setup_method(method)
+        connection = Connection(TEST_HOST, self.token)
+        self.dataset = Dataset(
+            title='Cats',
+            dataverse=connection.get_dataverse('cats'),
+            edit_media_uri='{0}/edit-media/study/doi:10.5072/FK2/CATS'.format(
+                self.sword_base_url,
+            ),
+        )
+        self.dataset._id = 42
+        self.deposits = []
+        self.failures = []
+
+        def deposit(request, uri, headers):
+            self.deposits.append(request)
+            status = self.failures.pop(0) if self.failures else 201
+            return status, headers, ''
+        httpretty.register_uri(httpretty.POST, self.dataset.edit_media_uri, body=deposit)
+        httpretty.register_uri(
+            httpretty.GET,
+            '{0}/datasets/42/versions/:latest'.format(self.native_base_url),
+            body=json.dumps({'data': {'versionState': 'DRAFT', 'files': []}}),
+        )
+
+    def get_deposit(self):
+        deposit = self.deposits[-1]
+        return deposit, ZipFile(io.BytesIO(deposit.body))
+
+    def test_upload_filepaths(self):
+        self.dataset.upload_filepaths(EXAMPLE_FILES)
+        deposit, package = self.get_deposit()
+
+        assert deposit.headers['Transfer-Encoding'] == 'chunked'
+        assert deposit.headers['Packaging'] == 'http://purl.org/net/sword/package/SimpleZip'
+        assert deposit.headers['Content-Disposition'] == 'filename=temp.zip'
+        assert sorted(os.path.basename(name) for name in package.namelist()) == [
+            '__init__.py', 'config.py',
+        ]
+
+    def test_upload_file(self):
+        self.dataset.upload_file('file.txt', 'This is a simple text file!')
+        deposit, package = self.get_deposit()
+
+        assert deposit.headers['Content-Type'] == 'application/zip'
+        assert package.read('file.txt') == b'This is a simple text file!'
+
+    def test_upload_file_failure(self):
+        self.failures = [413]
+        with pytest.raises(exceptions.OperationFailedError):
+            self.dataset.upload_file('file.txt', 'This is a simple text file!')
+
+    def test_upload_batches(self):
+        # Fail the second deposit once
+        self.failures = [201, 500]
+        reports = self.dataset.upload_batches(EXAMPLE_FILES, max_files=1)
+
+        assert len(self.deposits) == 3
+        assert [report.filepaths for report in reports] == [[path] for path in EXAMPLE_FILES]
+        assert [report.status for report in reports] == ['uploaded', 'uploaded']
+        assert [report.attempts for report in reports] == [1, 2]
+
+    def test_upload_batches_failed(self):
+        self.failures = [500, 500]
+        reports = self.dataset.upload_batches(EXAMPLE_FILES, retries=1, workers=2)
+
+        assert len(reports) == 1
+        assert reports[0].status == 'failed'
+        assert reports[0].attempts == 2
+        assert isinstance(reports[0].error, exceptions.OperationFailedError)
+
+
 class TestDataset(object):
 
     def test_init(self):
@@ -0,0 +1,114 @@
+from __future__ import absolute_import
+
+import logging
+import random
+import time
+
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from dataverse.metrics import build_record
+
+# Statuses that signal a transient failure or throttling
+RETRY_STATUSES = frozenset([429, 502, 503, 504])
+
+logger = logging.getLogger(__name__)
+
+
+class RetryPolicy(Retry):
+    """Retry connection errors, read timeouts and throttled responses.
+
+    Like `urllib3.util.retry.Retry`, only idempotent requests are retried
+    after they reached the server, and ``Retry-After`` headers are honored.
+    Backoff delays are drawn uniformly between zero and the exponential
+    backoff, so clients that failed together do not retry together. If a
+    `rate_limiter` is given, every retry also waits for a token from it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.rate_limiter = kwargs.pop('rate_limiter', None)
+        super(RetryPolicy, self).__init__(*args, **kwargs)
+
+    @classmethod
+    def with_backoff(cls, retries, backoff_factor=0.5, rate_limiter=None):
+        return cls(
+            total=retries,
+            # Like requests' default, so that a read timeout without retries
+            # raises Timeout rather than ConnectionError
+            read=None if retries else False,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            raise_on_status=False,
+            rate_limiter=rate_limiter,
+        )
+
+    def new(self, **kwargs):
+        retry = super(RetryPolicy, self).new(**kwargs)
+        retry.rate_limiter = self.rate_limiter
+        return retry
+
+    def get_backoff_time(self):
+        backoff = super(RetryPolicy, self).get_backoff_time()
+        return random.uniform(0, backoff) if backoff else 0
+
+    def sleep(self, response=None):
+        super(RetryPolicy, self).sleep(response)
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+
+
+class Transport(HTTPAdapter):
+    """An adapter that applies a default timeout and a client-side rate limit.
+
+    Every request is also passed to the callables in `hooks`:
+    ``hooks['before_request']`` are called with the prepared request before it
+    is sent, and ``hooks['after_request']`` with a
+    `dataverse.metrics.RequestRecord` once its response headers arrived or it
+    failed. Exceptions raised by ``after_request`` hooks are logged, so that
+    they never replace the response or the error of the request.
+
+    :param timeout: seconds to wait for the server when a request does not
+        set its own timeout, or a ``(connect, read)`` tuple
+    :param rate_limiter: a `dataverse.utils.RateLimiter`, which may be shared
+        with other connections and threads
+    """
+
+    __attrs__ = HTTPAdapter.__attrs__ + ['timeout', 'rate_limiter', 'hooks']
+
+    def __init__(self, timeout=None, rate_limiter=None, hooks=None, **kwargs):
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        self.hooks = hooks if hooks is not None else default_hooks()
+        super(Transport, self).__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+
+        # Hooks may be added and removed by other threads, such as a
+        # `track_requests` block ending, so iterate over a copy
+        for hook in tuple(self.hooks['before_request']):
+            hook(request)
+
+        started = time.time()
+        resp = error = None
+        try:
+            resp = super(Transport, self).send(request, timeout=timeout, **kwargs)
+            return resp
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            if self.hooks['after_request']:
+                record = build_record(request, resp, error, time.time() - started)
+                for hook in tuple(self.hooks['after_request']):
+                    try:
+                        hook(record)
+                    except Exception:
+                        logger.exception('Request hook %r failed.', hook)
+
+
+def default_hooks():
+    return {'before_request': [], 'after_request': []}
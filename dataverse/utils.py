@@ -1,11 +1,26 @@
 from __future__ import absolute_import
 
+import hashlib
 import os
+import re
+import threading
+import time
+from collections import deque
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
+from tempfile import SpooledTemporaryFile
+from zipfile import ZipFile
 
 from lxml import etree
 import bleach
 
-from dataverse.settings import SWORD_NAMESPACE, REPLACEMENT_DICT, UNIQUE_FIELDS
+from dataverse.settings import (
+    SWORD_NAMESPACE, REPLACEMENT_DICT, UNIQUE_FIELDS, UPLOAD_SPOOL_SIZE,
+)
+
+
+# Characters that bleach escapes, strips or replaces in text without markup
+UNSAFE_TEXT_PATTERN = re.compile(u'[\x00-\x08\x0b-\x1f&<>]')
 
 
 # factor out xpath operations so we don't have to look at its ugliness
@@ -15,11 +30,20 @@ def get_element(root, tag='*', namespace=None, attribute=None, attribute_value=N
 
 
 def get_elements(root, tag='*', namespace=None, attribute=None, attribute_value=None):
+    """Find the children of `root` matching a tag and, optionally, an attribute.
+
+    `root` may be XML content or an element that was already parsed. Pass the
+    element when looking up several paths in the same document, so that it is
+    parsed only once.
+    """
 
     # If string, convert to etree element
     if isinstance(root, (str, bytes)):
         root = etree.XML(root)
 
+    if attribute_value and not attribute:
+        raise Exception('You must pass an attribute with attribute_value')
+
     namespace = root.nsmap.get(namespace, namespace)
 
     if namespace is None:
@@ -29,14 +53,77 @@ def get_elements(root, tag='*', namespace=None, attribute=None, attribute_value=
 
     if attribute and not attribute_value:
         xpath += '[@{att}]'.format(att=attribute)
-    elif not attribute and attribute_value:
-        raise Exception('You must pass an attribute with attribute_value')
-    elif attribute and attribute_value:
+    elif attribute and "'" not in attribute_value:
         xpath += "[@{att}='{val}']".format(att=attribute, val=attribute_value)
+    elif attribute and '"' not in attribute_value:
+        xpath += '[@{att}="{val}"]'.format(att=attribute, val=attribute_value)
+    elif attribute:
+        # A value holding both quotes cannot be written in the path
+        xpath += '[@{att}]'.format(att=attribute)
+        return [e for e in root.findall(xpath) if e.get(attribute) == attribute_value]
 
     return root.findall(xpath)
 
 
+def get_links(root):
+    """Map the `rel` of each link element of an Atom entry to its `href`."""
+    return dict(
+        (link.get('rel'), link.get('href'))
+        for link in get_elements(root, tag='link', attribute='rel')
+    )
+
+
+def iter_elements(content, tag, namespace=None):
+    """Parse an XML document incrementally, yielding each `tag` element.
+
+    Each element is cleared, along with the elements before it, once the
+    caller moves on to the next one, so memory use does not grow with the
+    size of the document.
+    """
+    if namespace is not None:
+        tag = '{{{0}}}{1}'.format(SWORD_NAMESPACE.get(namespace, namespace), tag)
+
+    for _, element in etree.iterparse(BytesIO(content), events=('end',), tag=tag):
+        yield element
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+
+def get_collections(service_document):
+    return get_elements(service_document[0], tag='collection')
+
+
+def parse_dataset_entry(entry):
+    """Extract the metadata needed to build a dataset from a collection feed entry."""
+    edit_media_element = get_element(
+        entry,
+        tag='link',
+        attribute='rel',
+        attribute_value='edit-media',
+    )
+    return {
+        'title': get_element(entry, tag='title').text,
+        'id': get_element(entry, tag='id').text,
+        'edit_uri': entry.base,
+        'edit_media_uri': edit_media_element.get('href'),
+    }
+
+
+def index_dataset_ids(contents):
+    """Map the DOI of each dataset in a dataverse's contents json to its id."""
+    return dict(
+        ('{0}:{1}/{2}'.format(item['protocol'], item['authority'], item['identifier']),
+         item['id'])
+        for item in contents if item['type'] == 'dataset'
+    )
+
+
+def find_dataset_id(contents, doi):
+    """Find the id of the dataset with `doi` in a dataverse's contents json."""
+    return index_dataset_ids(contents).get(doi)
+
+
 def format_term(term, namespace):
 
     if term in REPLACEMENT_DICT:
@@ -98,5 +185,189 @@ def get_files_in_path(path):
     return filepaths
 
 
+def zip_package(filepaths=(), files=()):
+    """Build a SimpleZip package without holding the archive in memory.
+
+    :param filepaths: paths of files to add to the package
+    :param files: ``(filename, content)`` pairs to add to the package
+    :return: a temporary file holding the archive, positioned at its start.
+        The caller is responsible for closing it.
+    """
+    package = SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE)
+    zip_file = ZipFile(package, 'w')
+    for filepath in filepaths:
+        zip_file.write(filepath)
+    for filename, content in files:
+        zip_file.writestr(filename, content)
+    zip_file.close()
+    package.seek(0)
+    return package
+
+
+def deposit_headers(filename):
+    return {
+        'Content-Disposition': 'filename={0}'.format(filename),
+        'Content-Type': 'application/zip',
+        'Packaging': 'http://purl.org/net/sword/package/SimpleZip',
+    }
+
+
+def plan_batches(filepaths, max_bytes=None, max_files=None):
+    """Split `filepaths` into consecutive batches of bounded size.
+
+    A file larger than `max_bytes` is placed in a batch of its own.
+    """
+    batches = []
+    batch = []
+    batch_bytes = 0
+
+    for filepath in filepaths:
+        size = os.path.getsize(filepath)
+        too_many = max_files is not None and len(batch) >= max_files
+        too_big = max_bytes is not None and batch_bytes + size > max_bytes
+        if batch and (too_many or too_big):
+            batches.append(batch)
+            batch = []
+            batch_bytes = 0
+        batch.append(filepath)
+        batch_bytes += size
+
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def iter_chunks(fileobj, chunk_size=1024 * 1024):
+    """Read a file object lazily, one chunk at a time."""
+    return iter(lambda: fileobj.read(chunk_size), b'')
+
+
+def dataset_state(entry, metadata, updated_at=None):
+    """Summarize a dataset's entry and version json for change detection.
+
+    The summary is a JSON-serializable dict, so snapshots can be saved
+    between runs.
+
+    :param updated_at: the time the Search API last saw the dataset change,
+        if known
+    """
+    files = [f.get('dataFile') or f.get('datafile') for f in metadata.get('files', [])]
+    return {
+        'entry': entry_digest(entry),
+        'updated_at': updated_at,
+        'version': '{0}.{1}'.format(
+            metadata.get('versionNumber'), metadata.get('versionMinorNumber'),
+        ),
+        'state': metadata.get('versionState'),
+        'last_update_time': metadata.get('lastUpdateTime'),
+        'file_ids': sorted(f['id'] for f in files),
+    }
+
+
+def entry_digest(entry):
+    return hashlib.sha1(entry).hexdigest()
+
+
+def safe_filename(name, default):
+    """Reduce a file name sent by the server to a single path component.
+
+    Directories, including ``..``, are dropped so that the file cannot be
+    written outside of the directory it is saved to. `default` is returned
+    if no name is left.
+    """
+    name = os.path.basename(name.replace('\\', '/'))
+    return name if name not in ('', '.', '..') else default
+
+
+def md5_of_file(path, chunk_size=1024 * 1024):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter_chunks(f, chunk_size):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def local_copy_state(dataverse_file, path):
+    """Compare the local copy of `dataverse_file` at `path` with the server's.
+
+    Returns 'complete', 'partial' (the download can be resumed) or None.
+    """
+    if not os.path.exists(path):
+        return None
+
+    size = os.path.getsize(path)
+    expected_size = dataverse_file.size
+    if expected_size is not None and size == expected_size:
+        return 'complete'
+    elif expected_size is not None and size < expected_size:
+        return 'partial'
+    elif dataverse_file.checksum and md5_of_file(path) == dataverse_file.checksum:
+        return 'complete'
+    return None
+
+
 def sanitize(value):
+    """Strip markup from `value`.
+
+    Text that bleach would return unchanged, such as most titles and file
+    names, is returned as is without being parsed.
+    """
+    if not UNSAFE_TEXT_PATTERN.search(value):
+        return value
     return bleach.clean(value, strip=True, tags=[], attributes=[], styles=[])
+
+
+def concurrent_map(func, items, workers=4):
+    """Apply `func` to each item on a pool of threads.
+
+    Yields ``(item, result, error)`` tuples in the order of `items`, where
+    `error` is the exception raised by `func`, if any. Items are consumed
+    lazily, so no more than ``2 * workers`` are in flight at a time.
+    """
+    pool = ThreadPool(workers)
+    pending = deque()
+
+    def collect(item, async_result):
+        try:
+            return item, async_result.get(), None
+        except Exception as error:
+            return item, None, error
+
+    try:
+        for item in items:
+            pending.append((item, pool.apply_async(func, (item,))))
+            if len(pending) >= 2 * workers:
+                yield collect(*pending.popleft())
+        while pending:
+            yield collect(*pending.popleft())
+    finally:
+        pool.close()
+        pool.join()
+
+
+class RateLimiter(object):
+    """A token bucket allowing `rate` calls per second, in bursts of up to `burst`.
+
+    One limiter can be shared by several threads.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a call is allowed."""
+        while True:
+            with self._lock:
+                now = time.time()
+                elapsed = max(now - self._updated, 0)
+                self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
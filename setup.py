@@ -9,6 +9,10 @@ REQUIRES = [
     'lxml>=3.2.5',
 ]
 
+EXTRAS_REQUIRE = {
+    'async': ['aiohttp>=3.0; python_version >= "3.6"'],
+}
+
 TESTS_REQUIRE = [
     'httpretty>=0.8.8',
     'pytest>=2.7.0',
@@ -21,6 +25,7 @@ def read(fname):
         content = fp.read()
     return content
 
+
 setup(
     name='dataverse',
     version='0.1.2',
@@ -29,10 +34,11 @@ setup(
     author='Dataverse',
     author_email='rliebz@gmail.com',
     url='https://github.com/rliebz/dvn-client-python',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     package_dir={'dvn-client-python': 'dataverse'},
     include_package_data=True,
     install_requires=REQUIRES,
+    extras_require=EXTRAS_REQUIRE,
     license=read("LICENSE"),
     zip_safe=False,
     keywords='dataverse',
@@ -41,6 +47,10 @@ setup(
         'Intended Audience :: Developers',
         'License :: OSI Approved :: MIT License',
         'Natural Language :: English',
+        'Programming Language :: Python :: 2.7',
+        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
     ],
     test_suite='dataverse/test',
     tests_require=TESTS_REQUIRE,